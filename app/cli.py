@@ -3,8 +3,12 @@ import sys
 
 import argcomplete
 
+from commands.diff import hook_command as cmd_diff
 from commands.flatten import hook_command as cmd_flatten
+from commands.partition import hook_command as cmd_partition
 from commands.retain import hook_command as cmd_retain
+from commands.scan import hook_command as cmd_scan
+from commands.validate import hook_command as cmd_validate
 
 
 def run(*argv):
@@ -13,6 +17,10 @@ def run(*argv):
 
     cmd_flatten(parser, subparsers)
     cmd_retain(parser, subparsers)
+    cmd_partition(parser, subparsers)
+    cmd_scan(parser, subparsers)
+    cmd_validate(parser, subparsers)
+    cmd_diff(parser, subparsers)
 
     argcomplete.autocomplete(parser)
 
@@ -0,0 +1,81 @@
+import sys
+
+from cfn.traversal import DESCEND, rebuild
+from cfn.yaml_extensions import CloudFormationObject
+
+# Subtrees with fewer nodes are not worth an anchor in the output.
+DEFAULT_MIN_SUBTREE_SIZE = 16
+
+
+def share_subtrees(obj, min_size: int = DEFAULT_MIN_SUBTREE_SIZE):
+    """
+    Return a copy of obj in which all strings are interned and every subtree with at least
+    min_size nodes is replaced by a single shared instance of all subtrees equal to it.
+
+    The result must be treated as immutable, since a shared subtree appears on several places of
+    the tree. dump_cfn(aliases=True) writes shared subtrees as YAML anchors and aliases.
+    """
+    return SubtreeSharing(min_size).share(obj)
+
+
+class SubtreeSharing(object):
+    """
+    Hash-consing of template trees. Every distinct subtree gets a small integer id, so the key of
+    a container is a flat tuple of the ids of its members and the whole tree is processed in
+    linear time.
+
+    Subtrees are shared across all trees passed to share, so a tree can be shared piecewise while
+    it is built, e.g. resource by resource, without ever holding an unshared copy of it whole.
+    """
+
+    def __init__(self, min_size: int = DEFAULT_MIN_SUBTREE_SIZE):
+        self.min_size = min_size
+        self.ids: dict[tuple, int] = {}
+        self.shared: dict[int, object] = {}
+
+    def share(self, obj):
+        # every node is rebuilt as an (id, size, value) triple
+        _, _, value = rebuild(obj, enter=self._enter, leave=self._container)
+        return value
+
+    def _enter(self, node):
+        if isinstance(node, (dict, list, tuple, CloudFormationObject)):
+            return DESCEND
+        return self._leaf(node)
+
+    def _leaf(self, node) -> tuple[int, int, object]:
+        if isinstance(node, str):
+            node = sys.intern(node)
+        return self._id(('leaf', type(node), node)), 1, node
+
+    def _container(self, node, copy) -> tuple[int, int, object]:
+        if isinstance(copy, dict):
+            members = [member for key, value in copy.items() for member in (self._leaf(key), value)]
+        elif isinstance(copy, CloudFormationObject):
+            members = [copy.data]
+        else:
+            members = list(copy)
+
+        size = 1 + sum(member_size for _, member_size, _ in members)
+        member_ids = tuple(member_id for member_id, _, _ in members)
+        values = [value for _, _, value in members]
+
+        if isinstance(node, dict):
+            key = ('dict', member_ids)
+            value = dict(zip(values[0::2], values[1::2]))
+        elif isinstance(node, CloudFormationObject):
+            key = ('cfn', node.__class__, member_ids)
+            value = node.__class__(values[0])
+        else:
+            key = (type(node).__name__, member_ids)
+            value = type(node)(values)
+
+        node_id = self._id(key)
+        if size >= self.min_size:
+            value = self.shared.setdefault(node_id, value)
+
+        return node_id, size, value
+
+    def _id(self, key: tuple) -> int:
+        return self.ids.setdefault(key, len(self.ids))
+
@@ -0,0 +1,240 @@
+"""
+Compact binary encoding of template trees, to ship parsed templates between processes or to
+cache them on disk without pickling the dynamically created CloudFormationObject classes.
+
+Layout, all integers are unsigned LEB128 varints:
+
+    MAGIC, VERSION
+    string count, (byte length, UTF-8 bytes) per string
+    root node
+
+A node is a tag byte followed by its payload: nothing for null and booleans, a zigzag varint for
+ints, 8 little-endian bytes for floats, a string index for strings, dates and timestamps (in ISO
+format) and intrinsic functions (their YAML tag, followed by the data node), a length and the
+members for lists and bytes, and the number of pairs followed by key and value nodes for maps.
+Every distinct string, including map keys, is stored once. Shared subtrees (YAML aliases, see
+cfn.dedupe) are encoded and decoded as separate copies.
+"""
+import datetime
+import struct
+
+from cfn.macros import restored_macro_state
+from cfn.yaml_extensions import CloudFormationObject, load_cfn
+
+MAGIC = b'CFNT'
+VERSION = 1
+
+_NULL = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_FLOAT = 4
+_STR = 5
+_LIST = 6
+_MAP = 7
+_FUNCTION = 8
+_BYTES = 9
+_DATE = 10
+_DATETIME = 11
+
+_float = struct.Struct('<d')
+
+
+def encode_template(obj) -> bytes:
+    strings = {}
+    stream = bytearray()
+
+    def string_index(value: str) -> int:
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+
+        if node is None:
+            stream.append(_NULL)
+        elif node is True:
+            stream.append(_TRUE)
+        elif node is False:
+            stream.append(_FALSE)
+        elif isinstance(node, str):
+            stream.append(_STR)
+            _write_varint(stream, string_index(node))
+        elif isinstance(node, dict):
+            stream.append(_MAP)
+            _write_varint(stream, len(node))
+            for key, value in reversed(node.items()):
+                stack.append(value)
+                stack.append(key)
+        elif isinstance(node, (list, tuple)):
+            stream.append(_LIST)
+            _write_varint(stream, len(node))
+            stack.extend(reversed(node))
+        elif isinstance(node, CloudFormationObject):
+            stream.append(_FUNCTION)
+            _write_varint(stream, string_index(node.tag))
+            stack.append(node.data)
+        elif isinstance(node, int):
+            stream.append(_INT)
+            _write_varint(stream, node * 2 if node >= 0 else -node * 2 - 1)
+        elif isinstance(node, float):
+            stream.append(_FLOAT)
+            stream += _float.pack(node)
+        elif isinstance(node, bytes):
+            stream.append(_BYTES)
+            _write_varint(stream, len(node))
+            stream += node
+        elif isinstance(node, datetime.datetime):
+            stream.append(_DATETIME)
+            _write_varint(stream, string_index(node.isoformat()))
+        elif isinstance(node, datetime.date):
+            stream.append(_DATE)
+            _write_varint(stream, string_index(node.isoformat()))
+        else:
+            raise TypeError(f'Cannot encode {type(node).__name__} value {node!r}')
+
+    header = bytearray(MAGIC)
+    header.append(VERSION)
+    _write_varint(header, len(strings))
+    for value in strings:
+        encoded = value.encode('utf-8')
+        _write_varint(header, len(encoded))
+        header += encoded
+
+    return bytes(header + stream)
+
+
+def decode_template(data: bytes):
+    """
+    Rebuild the template tree of encode_template. Intrinsic functions and macros are looked up by
+    their YAML tag among the registered CloudFormationObject classes.
+    """
+    from cfn import yaml_extensions
+
+    data = memoryview(data)
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError('Not an encoded template')
+    if data[len(MAGIC)] != VERSION:
+        raise ValueError(f'Unsupported encoding version {data[len(MAGIC)]}')
+    pos = len(MAGIC) + 1
+
+    count, pos = _read_varint(data, pos)
+    strings = []
+    for _ in range(count):
+        length, pos = _read_varint(data, pos)
+        strings.append(str(data[pos:pos + length], 'utf-8'))
+        pos += length
+
+    classes = {cls.tag: cls for cls in yaml_extensions._object_classes}
+
+    # frames of containers being filled: [container, remaining members, pending map key]
+    stack = []
+    while True:
+        tag = data[pos]
+        pos += 1
+
+        if tag == _STR:
+            index, pos = _read_varint(data, pos)
+            value = strings[index]
+        elif tag == _MAP or tag == _LIST:
+            count, pos = _read_varint(data, pos)
+            container = {} if tag == _MAP else []
+            if count:
+                stack.append([container, count * 2 if tag == _MAP else count, None])
+                continue
+            value = container
+        elif tag == _FUNCTION:
+            index, pos = _read_varint(data, pos)
+            cls = classes.get(strings[index])
+            if cls is None:
+                raise ValueError(f'Unknown tag {strings[index]}')
+            stack.append([cls, 1, None])
+            continue
+        elif tag == _NULL:
+            value = None
+        elif tag == _TRUE:
+            value = True
+        elif tag == _FALSE:
+            value = False
+        elif tag == _INT:
+            value, pos = _read_varint(data, pos)
+            value = value >> 1 if not value & 1 else -(value >> 1) - 1
+        elif tag == _FLOAT:
+            value, = _float.unpack_from(data, pos)
+            pos += _float.size
+        elif tag == _BYTES:
+            length, pos = _read_varint(data, pos)
+            value = bytes(data[pos:pos + length])
+            pos += length
+        elif tag == _DATETIME or tag == _DATE:
+            index, pos = _read_varint(data, pos)
+            parse = datetime.datetime if tag == _DATETIME else datetime.date
+            value = parse.fromisoformat(strings[index])
+        else:
+            raise ValueError(f'Unknown node tag {tag} at offset {pos - 1}')
+
+        # attach the value to its container, completing containers on the way up
+        while stack:
+            frame = stack[-1]
+            container = frame[0]
+            frame[1] -= 1
+            if isinstance(container, list):
+                container.append(value)
+            elif isinstance(container, dict):
+                if frame[1] % 2:
+                    frame[2] = value
+                else:
+                    container[frame[2]] = value
+            else:
+                frame[0] = container = container(value)
+
+            if frame[1]:
+                break
+            stack.pop()
+            value = container
+        else:
+            root = value
+            break
+
+    if pos != len(data):
+        raise ValueError(f'Unexpected data at offset {pos}')
+    return root
+
+
+def load_cfn_encoded(file_path: str, evaluate_macros: bool = False, macro_state: tuple = None) -> bytes:
+    """
+    Load the template and return it encoded. Meant to run in a worker process, since the result
+    can be pickled and decodes faster than the template parses; macro_state of the caller (see
+    cfn.macros.macro_state) makes macros evaluate as they would in the calling process.
+    """
+    if macro_state is None:
+        return encode_template(load_cfn(file_path, evaluate_macros=evaluate_macros))
+
+    with restored_macro_state(macro_state):
+        return encode_template(load_cfn(file_path, evaluate_macros=evaluate_macros))
+
+
+def _write_varint(stream: bytearray, value: int):
+    while value >= 0x80:
+        stream.append(value & 0x7f | 0x80)
+        value >>= 7
+    stream.append(value)
+
+
+def _read_varint(data, pos: int) -> tuple[int, int]:
+    byte = data[pos]
+    pos += 1
+    if byte < 0x80:
+        return byte, pos
+
+    value, shift = byte & 0x7f, 7
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
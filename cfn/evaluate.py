@@ -0,0 +1,291 @@
+import threading
+from collections import OrderedDict
+from typing import Union
+
+from cfn.references import SUB_PLACEHOLDER
+from cfn.traversal import DESCEND, iter_nodes, rebuild
+from cfn.yaml_extensions import CloudFormationObject
+
+_functions = frozenset(['Ref', 'Fn::And', 'Fn::Base64', 'Fn::Equals', 'Fn::FindInMap', 'Fn::GetAtt',
+                        'Fn::GetAZs', 'Fn::If', 'Fn::ImportValue', 'Fn::Join', 'Fn::Not', 'Fn::Or', 'Fn::Select',
+                        'Fn::Split', 'Fn::Sub', 'Fn::Condition'])
+
+# functions whose operands may be condition references in the JSON form {'Condition': name}
+_condition_functions = frozenset(['Fn::And', 'Fn::If', 'Fn::Not', 'Fn::Or'])
+
+NO_VALUE = 'AWS::NoValue'
+
+# Evaluators are shared by all stacks instantiated with the same parameters, conditions and
+# mappings, so their memoized results are reused across them, also by the worker threads of scan.
+_evaluators_max_size = 256
+_evaluators: OrderedDict = OrderedDict()
+_evaluators_lock = threading.Lock()
+
+# memoized results per evaluator, bounded as evaluators live as long as the process
+_memo_max_size = 4096
+
+
+def evaluator_for(parameters: dict,
+                  conditions: dict = None,
+                  mappings: dict = None,
+                  parameter_types: dict = None) -> 'Evaluator':
+    key = (freeze(parameters), freeze(conditions or {}), freeze(mappings or {}), freeze(parameter_types or {}))
+    with _evaluators_lock:
+        evaluator = _evaluators.get(key)
+        if evaluator is None:
+            evaluator = _evaluators[key] = Evaluator(parameters, conditions, mappings, parameter_types)
+            if len(_evaluators) > _evaluators_max_size:
+                _evaluators.popitem(last=False)
+        else:
+            _evaluators.move_to_end(key)
+        return evaluator
+
+
+class Evaluator(object):
+    """
+    Substitutes known parameter values into expressions and folds the intrinsic functions whose
+    inputs are static: Fn::Join, Fn::Sub, Fn::If, Fn::Equals, Fn::And, Fn::Or, Fn::Not, Fn::Select,
+    Fn::FindInMap and condition references. Everything else is kept as it is.
+
+    Parameter values are taken verbatim, they are expected to be already evaluated in the scope
+    they come from. Static values of list parameters (CommaDelimitedList and List<...> types) are
+    split into lists, as CloudFormation does. Results are memoized per expression.
+
+    The JSON form of a condition reference, {'Condition': name}, is folded only as an operand of
+    Fn::And, Fn::If, Fn::Not, Fn::Or and as a condition definition, elsewhere it may be an
+    ordinary property, e.g. the Condition of an IAM policy statement.
+    """
+
+    def __init__(self, parameters: dict, conditions: dict = None, mappings: dict = None, parameter_types: dict = None):
+        self.parameters = parameters
+        self.conditions = conditions or {}
+        self.mappings = mappings or {}
+        self.parameter_types = parameter_types or {}
+        self._memo: OrderedDict = OrderedDict()
+        self._memo_lock = threading.Lock()
+        self._condition_values = {}
+        # the guard against cyclic conditions must not be seen by other threads
+        self._conditions_lock = threading.RLock()
+
+    def evaluate(self, expr):
+        """
+        Return a folded copy of the expression. Properties and list members folded to
+        Ref AWS::NoValue are removed.
+        """
+        return rebuild(expr, enter=self._evaluate_node, leave=_drop_no_values)
+
+    def _evaluate_node(self, expr):
+        function = _as_function(expr)
+        if function is None:
+            return DESCEND
+
+        key = freeze(expr)
+        with self._memo_lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return rebuild(self._memo[key])
+
+        result = self._evaluate_function(expr, *function)
+
+        with self._memo_lock:
+            self._memo[key] = result
+            if len(self._memo) > _memo_max_size:
+                self._memo.popitem(last=False)
+
+        return rebuild(result)
+
+    def condition(self, name: str) -> Union[bool, None]:
+        """
+        Return the value of the named condition, or None when it is not known statically.
+        """
+        if name not in self.conditions:
+            return None
+        with self._conditions_lock:
+            if name not in self._condition_values:
+                # guards against cyclic conditions
+                self._condition_values[name] = None
+                value = self._evaluate_condition_operand(self.conditions[name])
+                self._condition_values[name] = value if isinstance(value, bool) else None
+            return self._condition_values[name]
+
+    def _evaluate_function(self, expr, name: str, data):
+        match name:
+            case 'Ref' if isinstance(data, str) and data in self.parameters:
+                return self._parameter_value(data)
+            case 'Fn::Condition' if isinstance(data, str):
+                value = self.condition(data)
+                if value is not None:
+                    return value
+                return expr
+            case 'Fn::If' if isinstance(data, list) and len(data) == 3 and isinstance(data[0], str):
+                value = self.condition(data[0])
+                if value is not None:
+                    return self.evaluate(data[1] if value else data[2])
+
+        data = self._evaluate_arguments(name, data)
+
+        match name:
+            case 'Fn::Join' if _is_static_list(data, 2) and isinstance(data[0], str) and _is_static_list(data[1]):
+                if all(_is_static_scalar(member) for member in data[1]):
+                    return data[0].join(_to_str(member) for member in data[1])
+            case 'Fn::Sub':
+                return self._evaluate_sub(expr, data)
+            case 'Fn::Equals' if _is_static_list(data, 2):
+                return _to_str(data[0]) == _to_str(data[1])
+            case 'Fn::Not' if isinstance(data, list) and len(data) == 1 and isinstance(data[0], bool):
+                return not data[0]
+            case 'Fn::And' if isinstance(data, list):
+                if any(value is False for value in data):
+                    return False
+                if all(value is True for value in data):
+                    return True
+            case 'Fn::Or' if isinstance(data, list):
+                if any(value is True for value in data):
+                    return True
+                if all(value is False for value in data):
+                    return False
+            case 'Fn::Select' if _is_static_list(data, 2) and isinstance(data[1], list):
+                index = data[0]
+                if isinstance(index, str) and index.isdigit():
+                    index = int(index)
+                if isinstance(index, int) and 0 <= index < len(data[1]):
+                    return data[1][index]
+            case 'Fn::FindInMap' if _is_static_list(data, 3) and all(isinstance(key, str) for key in data):
+                value = self.mappings.get(data[0], {}).get(data[1], {}).get(data[2])
+                if value is not None:
+                    return value
+
+        return _rebuild_function(expr, name, data)
+
+    def _parameter_value(self, name: str):
+        value = self.parameters[name]
+        if self._is_list_parameter(name) and isinstance(value, str):
+            return value.split(',')
+        return value
+
+    def _is_list_parameter(self, name: str) -> bool:
+        parameter_type = self.parameter_types.get(name)
+        return isinstance(parameter_type, str) and \
+            (parameter_type == 'CommaDelimitedList' or parameter_type.startswith('List<'))
+
+    def _evaluate_arguments(self, name: str, data):
+        # Ref AWS::NoValue is a valid argument, e.g. of Fn::If, so it is kept on this level
+        evaluate = self._evaluate_condition_operand if name in _condition_functions else self.evaluate
+        if isinstance(data, list):
+            return [evaluate(member) for member in data]
+        return evaluate(data)
+
+    def _evaluate_condition_operand(self, expr):
+        if isinstance(expr, dict) and len(expr) == 1 and isinstance(expr.get('Condition'), str):
+            value = self.condition(expr['Condition'])
+            return expr if value is None else value
+        return self.evaluate(expr)
+
+    def _evaluate_sub(self, expr, data):
+        if isinstance(data, list):
+            sub_expr, variables = data[0], dict(data[1]) if len(data) > 1 else {}
+        else:
+            sub_expr, variables = data, {}
+
+        if not isinstance(sub_expr, str):
+            return _rebuild_function(expr, 'Fn::Sub', data)
+
+        def substitute(m):
+            placeholder = m.group(1)
+            if placeholder.startswith('!'):
+                return m.group(0)
+
+            # list parameters cannot be used in Fn::Sub, their placeholders are kept as they are
+            if placeholder in variables:
+                value = variables[placeholder]
+            elif placeholder in self.parameters and not self._is_list_parameter(placeholder):
+                value = self.parameters[placeholder]
+                if not _is_static_scalar(value):
+                    # the parameter is not known, so its expression is moved to the variable map,
+                    # unless it is a reference of the same name
+                    if _as_function(value) != ('Ref', placeholder):
+                        variables[placeholder] = value
+                    return m.group(0)
+            else:
+                return m.group(0)
+
+            return _to_str(value) if _is_static_scalar(value) else m.group(0)
+
+        sub_expr = SUB_PLACEHOLDER.sub(substitute, sub_expr)
+        variables = {key: value for key, value in variables.items() if '${' + key + '}' in sub_expr}
+
+        if not any(not m.group(1).startswith('!') for m in SUB_PLACEHOLDER.finditer(sub_expr)):
+            return SUB_PLACEHOLDER.sub(lambda m: '${' + m.group(1)[1:] + '}', sub_expr)
+        elif variables:
+            return _rebuild_function(expr, 'Fn::Sub', [sub_expr, variables])
+        else:
+            return _rebuild_function(expr, 'Fn::Sub', sub_expr)
+
+
+def freeze(obj):
+    """
+    Return a hashable key that is equal for structurally equal expressions.
+    """
+    return rebuild(obj, enter=_freeze_leaf, leave=_freeze_container)
+
+
+def _freeze_leaf(obj):
+    if isinstance(obj, (CloudFormationObject, dict, list, tuple)):
+        return DESCEND
+    return type(obj), obj
+
+
+def _freeze_container(obj, copy):
+    if isinstance(obj, CloudFormationObject):
+        return 'fn', obj.name, copy.data
+    elif isinstance(obj, dict):
+        return 'dict', tuple(copy.items())
+    else:
+        return 'list', tuple(copy)
+
+
+def _drop_no_values(obj, copy):
+    if isinstance(copy, dict):
+        return {key: value for key, value in copy.items() if not _is_no_value(value)}
+    elif isinstance(copy, list):
+        return [value for value in copy if not _is_no_value(value)]
+    return copy
+
+
+def _as_function(expr) -> Union[tuple, None]:
+    if isinstance(expr, CloudFormationObject):
+        return (expr.name, expr.data) if expr.name in _functions else None
+    if isinstance(expr, dict) and len(expr) == 1:
+        name, data = next(iter(expr.items()))
+        if name in _functions:
+            return name, data
+    return None
+
+
+def _rebuild_function(expr, name: str, data):
+    if isinstance(expr, CloudFormationObject):
+        return expr.__class__(data)
+    return {name: data}
+
+
+def _is_no_value(value) -> bool:
+    function = _as_function(value)
+    return function is not None and function == ('Ref', NO_VALUE)
+
+
+def _is_static_scalar(value) -> bool:
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def _is_static(value) -> bool:
+    return all(_as_function(node) is None for node in iter_nodes(value))
+
+
+def _is_static_list(value, length: int = None) -> bool:
+    return isinstance(value, list) and (length is None or len(value) == length) and _is_static(value)
+
+
+def _to_str(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value) if _is_static_scalar(value) else value
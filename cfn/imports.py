@@ -0,0 +1,126 @@
+import json
+import os
+from typing import NamedTuple, Union
+
+IMPORT_IDENTIFIERS_FILE = os.path.join(os.path.dirname(__file__), 'data', 'import_identifiers.json')
+
+_identifiers: Union[dict, None] = None
+_aliases: Union[dict, None] = None
+
+
+class ImportDescriptors(NamedTuple):
+    # entries of Metadata.ResourcesForImport of the flattened template
+    resources_for_import: list
+    # content of the --resources-to-import file of an IMPORT change set
+    resources_to_import: list
+    # logical IDs of resources that need an import, but whose identifiers are not known statically,
+    # Metadata.UnresolvedResourcesForImport of the flattened template
+    unresolved: list
+
+    @classmethod
+    def from_metadata(cls, metadata: dict) -> 'ImportDescriptors':
+        """
+        Rebuild descriptors from the Metadata of a flattened template.
+        """
+        descriptors = cls([], [], list(metadata.get('UnresolvedResourcesForImport') or []))
+        for item in metadata.get('ResourcesForImport') or []:
+            descriptors._add(item['LogicalId'], item['ResourceType'], item['ResourceIdentifier'])
+        return descriptors
+
+    def _add(self, resource_name: str, resource_type: str, resource_identifier: dict):
+        # only resources whose identifiers are all known are described, the others are listed
+        # by name in unresolved
+        if not all(isinstance(value, str) for value in resource_identifier.values()):
+            self.unresolved.append(resource_name)
+            return
+
+        self.resources_for_import.append({
+            'LogicalId': resource_name,
+            'ResourceType': resource_type,
+            'ResourceIdentifier': resource_identifier,
+        })
+        self.resources_to_import.append({
+            'ResourceType': import_resource_type(resource_type),
+            'LogicalResourceId': resource_name,
+            'ResourceIdentifier': resource_identifier,
+        })
+
+
+def load_import_identifiers(file_path: str = None):
+    """
+    Load the table of identifiers of importable resource types. The bundled table is loaded once,
+    tables loaded from file_path extend and override it.
+    """
+    global _identifiers, _aliases
+
+    if _identifiers is None:
+        _identifiers, _aliases = {}, {}
+        if file_path not in (None, IMPORT_IDENTIFIERS_FILE):
+            load_import_identifiers(IMPORT_IDENTIFIERS_FILE)
+
+    with open(file_path or IMPORT_IDENTIFIERS_FILE, 'r') as f:
+        table = json.load(f)
+
+    _identifiers.update(table.get('types', {}))
+    _aliases.update(table.get('aliases', {}))
+
+
+def register_import_identifiers(resource_type: str, identifiers: dict):
+    """
+    Register identifiers of a resource type, a mapping of identifier names to the (dotted) path of
+    the property holding its value, or None when the value is assigned by CloudFormation.
+    """
+    _ensure_loaded()
+    _identifiers[resource_type] = identifiers
+
+
+def import_resource_type(resource_type: str) -> str:
+    _ensure_loaded()
+    return _aliases.get(resource_type, resource_type)
+
+
+def describe_imports(resources: list) -> ImportDescriptors:
+    """
+    Describe imports of retargeted resources in a single pass over flattened resources, given as
+    (resource_name, effective_def, original_def, meta) tuples.
+    """
+    _ensure_loaded()
+
+    descriptors = ImportDescriptors([], [], [])
+    for resource_name, resource_def, _, meta in resources:
+        if not meta.get('was_retargeted', False):
+            continue
+
+        resource_type = resource_def.get('Type')
+        effective_type = _aliases.get(resource_type, resource_type)
+        identifiers = _identifiers.get(effective_type)
+        if identifiers is None:
+            continue
+
+        properties = resource_def.get('Properties') or {}
+        resource_identifier = {key: _property(properties, path) for key, path in identifiers.items()}
+        descriptors._add(resource_name, resource_type, resource_identifier)
+
+    return descriptors
+
+
+def write_resources_to_import(descriptors: ImportDescriptors, file_path: str):
+    with open(file_path, 'w') as f:
+        json.dump(descriptors.resources_to_import, f, indent=2)
+
+
+def _ensure_loaded():
+    if _identifiers is None:
+        load_import_identifiers()
+
+
+def _property(properties: dict, path: Union[str, None]):
+    if path is None:
+        return None
+
+    value = properties
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
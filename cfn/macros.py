@@ -2,20 +2,48 @@ import json
 import os
 import uuid
 from contextlib import contextmanager
+from contextvars import ContextVar
 
 import yaml
 
-_include_rel_dir = os.curdir
-_rel_dir_stack = []
+from cfn.file_io import content_digest, open_buffer, read_text
+from cfn.memory import measure
 
+# The include directory is kept per execution context, so templates can be
+# loaded concurrently from worker threads and asyncio tasks.
+_rel_dir_stack: ContextVar[tuple] = ContextVar('rel_dir_stack', default=(os.curdir,))
 
-def load_file(file_name):
+
+# Macro::GenerateUUID returns random UUIDs unless seeded, seeded UUIDs are derived from the position
+# of the macro in the template, given relative to the directory of the root template
+_uuid_seed = os.environ.get('CFUTIL_UUID_SEED')
+
+
+def _include_rel_dir() -> str:
+    return _rel_dir_stack.get()[-1]
+
+
+def include_dir() -> str:
+    return _include_rel_dir()
+
+
+def _root_dir() -> str:
+    # the first directory pushed is the one of the root template
+    stack = _rel_dir_stack.get()
+    return stack[1] if len(stack) > 1 else stack[0]
+
+
+def _include_path(file_name):
     if os.path.isabs(file_name):
-        with open(file_name, "r") as f:
-            return f.read(file_name)
+        return file_name
     else:
-        with open(os.path.join(_include_rel_dir, file_name), "r") as f:
-            return f.read()
+        return os.path.join(_include_rel_dir(), file_name)
+
+
+def load_file(file_name):
+    file_path = _include_path(file_name)
+    with measure('include', file_path):
+        return read_text(file_path)
 
 
 def include_string_constructor(
@@ -28,40 +56,87 @@ def include_string_constructor(
 def include_json_string_from_yaml_file_constructor(
         loader_context: yaml.SafeLoader, node: yaml.nodes.ScalarNode
 ) -> str:
-    file_path = loader_context.construct_scalar(node)
-    raw = load_file(file_path)
-    yaml_content = yaml.load(raw, Loader=yaml.SafeLoader)
+    file_path = _include_path(loader_context.construct_scalar(node))
+    with measure('include', file_path):
+        with open_buffer(file_path) as buffer:
+            yaml_content = yaml.load(buffer, Loader=yaml.SafeLoader)
+        return json.dumps(yaml_content)
+
 
-    return json.dumps(yaml_content)
+def include_file_cache_key(
+        loader_context: yaml.SafeLoader, node: yaml.nodes.ScalarNode
+):
+    # keyed by content, so copies of a file included from several templates share the result
+    file_path = _include_path(loader_context.construct_scalar(node))
+    try:
+        return content_digest(file_path)
+    except OSError:
+        return None
 
 
 def generate_uuid_constructor(
         loader_context: yaml.SafeLoader, node: yaml.nodes.ScalarNode
 ) -> str:
-    return str(uuid.uuid4())
+    if _uuid_seed is None:
+        return str(uuid.uuid4())
+
+    template_path = os.path.relpath(os.path.abspath(loader_context.name), os.path.abspath(_root_dir()))
+    mark = node.start_mark
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'{_uuid_seed}:{template_path}:{mark.line}:{mark.column}'))
+
+
+def set_uuid_seed(seed):
+    """
+    Make Macro::GenerateUUID deterministic. UUIDs are then derived from the seed, the template path
+    relative to the directory of the root template and the position of the macro, so they do not
+    depend on the working directory. None restores random UUIDs.
+    """
+    global _uuid_seed
+    _uuid_seed = None if seed is None else str(seed)
+
+
+def uuid_seeded() -> bool:
+    return _uuid_seed is not None
+
+
+def macro_state() -> tuple:
+    """
+    Return the state macros are evaluated with, the include directories and the UUID seed, to
+    evaluate them the same way in a worker process (see restored_macro_state).
+    """
+    return _rel_dir_stack.get(), _uuid_seed
+
+
+@contextmanager
+def restored_macro_state(state: tuple):
+    rel_dirs, uuid_seed = state
+    # the seed is process-wide, which is fine in a worker process serving one caller
+    set_uuid_seed(uuid_seed)
+    token = _rel_dir_stack.set(rel_dirs)
+    try:
+        yield
+    finally:
+        _rel_dir_stack.reset(token)
 
 
 def change_rel_dir(new_dir):
-    global _include_rel_dir
-    _include_rel_dir = new_dir
+    _rel_dir_stack.set((*_rel_dir_stack.get()[:-1], new_dir))
 
 
 def push_rel_dir(new_dir):
-    global _rel_dir_stack
-    global _include_rel_dir
-    _rel_dir_stack.append(new_dir)
-    _include_rel_dir = new_dir
+    _rel_dir_stack.set((*_rel_dir_stack.get(), new_dir))
 
 
 def pop_rel_dir():
-    global _rel_dir_stack
-    global _include_rel_dir
-    _include_rel_dir = _rel_dir_stack.pop()
-    return _include_rel_dir
+    stack = _rel_dir_stack.get()
+    _rel_dir_stack.set(stack[:-1])
+    return stack[-1]
 
 
 @contextmanager
 def rel_dir_path(new_dir):
     push_rel_dir(new_dir)
-    yield
-    pop_rel_dir()
+    try:
+        yield
+    finally:
+        pop_rel_dir()
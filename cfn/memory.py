@@ -0,0 +1,171 @@
+"""
+Memory footprint of flattening, traced with tracemalloc.
+
+The stages of the engine (loading templates and include files, copying, sanitizing resources and
+dumping) are wrapped in measure(), which is a no-op unless a MemoryTracer is active in the current
+execution context. Every measurement is attributed to its stage and to the template or include
+file it works on, so the report shows which nested stack or include file used the memory.
+"""
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import NamedTuple, Union
+
+DEFAULT_TOP_SITES = 10
+
+_tracer: ContextVar[Union['MemoryTracer', None]] = ContextVar('memory_tracer', default=None)
+
+
+class MemoryUsage(NamedTuple):
+    calls: int = 0
+    # the highest number of bytes allocated on top of the memory in use when a call started
+    peak: int = 0
+    # bytes allocated by all calls and still in use when they returned
+    retained: int = 0
+
+    def add(self, peak: int, retained: int) -> 'MemoryUsage':
+        return MemoryUsage(self.calls + 1, max(self.peak, peak), self.retained + retained)
+
+
+class AllocationSite(NamedTuple):
+    location: str
+    size: int
+    count: int
+
+
+class MemoryReport(NamedTuple):
+    # bytes on top of the memory in use when tracing started
+    peak: int
+    stages: dict
+    templates: dict
+    includes: dict
+    top_sites: list
+
+
+class MemoryTracer(object):
+    """
+    Context manager tracing the memory of flattens run inside of it, in the same thread or asyncio
+    task, including the executor jobs of the asyncio API. tracemalloc is started if it is not
+    running yet, and report is set on exit.
+
+    The peak of tracemalloc is process-wide, so measurements of several threads are taken one at
+    a time, which serializes the measured stages while tracing.
+    """
+
+    def __init__(self, top_sites: int = DEFAULT_TOP_SITES):
+        self.top_sites = top_sites
+        self.report: Union[MemoryReport, None] = None
+        self._stages: dict[str, MemoryUsage] = {}
+        self._templates: dict[str, MemoryUsage] = {}
+        self._includes: dict[str, MemoryUsage] = {}
+        # [memory in use at the start, highest peak of finished inner measurements] of the tracer
+        # and of every open measurement
+        self._frames: list[list[int]] = []
+        self._started = False
+        self._snapshot = None
+        self._token = None
+        self._lock = threading.RLock()
+
+    def __enter__(self) -> 'MemoryTracer':
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+        self._snapshot = _snapshot()
+        tracemalloc.reset_peak()
+        self._frames.append([tracemalloc.get_traced_memory()[0], 0])
+        self._token = _tracer.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _tracer.reset(self._token)
+        start, inner_peak = self._frames.pop()
+        peak = max(tracemalloc.get_traced_memory()[1], inner_peak) - start
+        # allocations made while tracing and still in use
+        statistics = [stat for stat in _snapshot().compare_to(self._snapshot, 'lineno') if stat.size_diff > 0]
+        if self._started:
+            tracemalloc.stop()
+
+        self.report = MemoryReport(
+            peak=peak,
+            stages=dict(self._stages),
+            templates=dict(self._templates),
+            includes=dict(self._includes),
+            top_sites=[
+                AllocationSite(f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                               stat.size_diff, stat.count_diff)
+                for stat in statistics[:self.top_sites]
+            ],
+        )
+
+    @contextmanager
+    def measure(self, stage: str, file_path: Union[str, None] = None):
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak is reset for this measurement, the enclosing one keeps its peak so far
+            self._frames[-1][1] = max(self._frames[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._frames.append([current, 0])
+            try:
+                yield
+            finally:
+                start, inner_peak = self._frames.pop()
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, inner_peak)
+                self._frames[-1][1] = max(self._frames[-1][1], peak)
+
+                retained = current - start
+                self._stages[stage] = self._stages.get(stage, MemoryUsage()).add(peak - start, retained)
+                if file_path is not None:
+                    usages = self._includes if stage == 'include' else self._templates
+                    file_path = os.path.abspath(file_path)
+                    usages[file_path] = usages.get(file_path, MemoryUsage()).add(peak - start, retained)
+
+
+def measure(stage: str, file_path: str = None):
+    """
+    Measure the enclosed block as a stage working on file_path, if memory is being traced.
+    """
+    tracer = _tracer.get()
+    return nullcontext() if tracer is None else tracer.measure(stage, file_path)
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+
+def format_memory_report(report: MemoryReport) -> str:
+    lines = [f'Peak memory: {_format_size(report.peak)}']
+
+    for title, usages in [('Stage', report.stages),
+                          ('Template', report.templates),
+                          ('Include file', report.includes)]:
+        if not usages:
+            continue
+        lines.append('')
+        lines.append(f'{title:<48} {"calls":>7} {"peak":>11} {"retained":>11}')
+        for name, usage in sorted(usages.items(), key=lambda item: -item[1].peak):
+            if os.path.isabs(name):
+                name = os.path.relpath(name)
+            lines.append(f'{name:<48} {usage.calls:>7} {_format_size(usage.peak):>11} '
+                         f'{_format_size(usage.retained):>11}')
+
+    if report.top_sites:
+        lines.append('')
+        lines.append('Top allocation sites:')
+        for site in report.top_sites:
+            lines.append(f'{_format_size(site.size):>11} in {site.count:>7} blocks  {site.location}')
+
+    return '\n'.join(lines)
+
+
+def _format_size(size: int) -> str:
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
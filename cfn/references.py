@@ -0,0 +1,69 @@
+"""
+References of intrinsic functions to parameters, resources and their attributes.
+"""
+import re
+from typing import Iterator, Union
+
+from cfn.traversal import functions
+
+# placeholders of Fn::Sub, ${!...} placeholders are literals
+SUB_PLACEHOLDER = re.compile(r'\$\{([^}]*)}')
+
+
+def sub_placeholders(data) -> Iterator[str]:
+    """
+    Yield the placeholders of Fn::Sub data that are neither literals nor variables of its map.
+    """
+    if isinstance(data, list):
+        expression = data[0] if data else ''
+        variables = data[1] if len(data) > 1 and isinstance(data[1], dict) else {}
+    else:
+        expression, variables = data, {}
+
+    if not isinstance(expression, str):
+        return
+
+    for m in SUB_PLACEHOLDER.finditer(expression):
+        placeholder = m.group(1).strip()
+        if not placeholder.startswith('!') and placeholder not in variables:
+            yield placeholder
+
+
+def function_references(name: str, data) -> Iterator[tuple[str, Union[str, None]]]:
+    """
+    Yield (target, attribute) of every reference of Ref, Fn::GetAtt or Fn::Sub. The attribute is
+    None for a reference of a parameter, pseudo parameter or resource, and the attribute name
+    for a reference of a resource attribute.
+    """
+    match name:
+        case 'Ref' if isinstance(data, str):
+            target, *attribute = data.split('.', 1)
+            yield target, attribute[0] if attribute else None
+        case 'Fn::GetAtt':
+            if isinstance(data, str):
+                target, *attribute = data.split('.', 1)
+            else:
+                target, *attribute = data or [None]
+            if isinstance(target, str):
+                yield target, '.'.join(str(member) for member in attribute)
+        case 'Fn::Sub':
+            for placeholder in sub_placeholders(data):
+                target, *attribute = placeholder.split('.', 1)
+                yield target, attribute[0] if attribute else None
+
+
+def resource_references(obj, resources) -> set:
+    """
+    Return the names of the resources obj refers to by DependsOn, Ref, Fn::GetAtt and Fn::Sub,
+    among the names in resources. obj is a resource definition or any part of a template, e.g. an
+    output.
+    """
+    found = set()
+
+    depends_on = obj.get('DependsOn', []) if isinstance(obj, dict) else []
+    found.update([depends_on] if isinstance(depends_on, str) else depends_on)
+
+    for name, data in functions(obj):
+        found.update(target for target, _ in function_references(name, data))
+
+    return {name for name in found if isinstance(name, str) and name in resources}
@@ -1,17 +1,29 @@
+import asyncio
+import contextvars
+import functools
 import itertools
 import os.path
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from importlib.metadata import entry_points
 from io import IOBase
-from typing import Union, Iterable, IO
+from typing import Union, Iterable, IO, NamedTuple, Callable
 
 import six
 import yaml
 from yaml import SafeLoader, SafeDumper
 from yaml.constructor import ConstructorError
 
+from cfn.file_io import open_buffer
 from cfn.macros import (include_json_string_from_yaml_file_constructor,
                         include_string_constructor,
+                        include_file_cache_key,
                         generate_uuid_constructor,
+                        uuid_seeded,
+                        include_dir as macros_include_dir,
+                        macro_state,
                         rel_dir_path as macros_ref_dir)
 
 
@@ -32,26 +44,9 @@ class CloudFormationObject(object):
 
     def to_json(self):
         """Return the JSON equivalent"""
+        from cfn.traversal import rebuild
 
-        def convert(obj):
-            return obj.to_json() if isinstance(obj, CloudFormationObject) else obj
-
-        if isinstance(self.data, dict):
-            data = {key: convert(value) for key, value in six.iteritems(self.data)}
-        elif isinstance(self.data, (list, tuple)):
-            data = [convert(value) for value in self.data]
-        else:
-            data = self.data
-
-        name = self.name
-
-        if name == 'Fn::GetAtt' and isinstance(data, six.string_types):
-            data = data.split('.')
-        elif name == 'Ref' and '.' in data:
-            name = 'Fn::GetAtt'
-            data = data.split('.')
-
-        return {name: data}
+        return rebuild(self, leave=_json_function)
 
     @classmethod
     def construct(cls, loader, node):
@@ -97,12 +92,41 @@ class CloudFormationObject(object):
         return isinstance(other, self.__class__) and other.data == self.data
 
 
+def _json_function(node, copy):
+    if not isinstance(copy, CloudFormationObject):
+        return copy
+
+    name, data = copy.name, copy.data
+
+    if name == 'Fn::GetAtt' and isinstance(data, six.string_types):
+        data = data.split('.')
+    elif name == 'Ref' and '.' in data:
+        name = 'Fn::GetAtt'
+        data = data.split('.')
+
+    return {name: data}
+
+
 class CfnLoader(SafeLoader):
     pass
 
 
 class CfnDumper(SafeDumper):
-    pass
+    # CloudFormation rejects YAML anchors and aliases, so objects shared in the tree, e.g. memoized
+    # macro results or nested templates loaded once, are written out in full.
+    def ignore_aliases(self, data):
+        return True
+
+
+class CfnAliasDumper(CfnDumper):
+    # Strings are aliased only when they are the very same object (see cfn.dedupe) and long
+    # enough to make the alias pay off.
+    alias_min_string_length = 128
+
+    def ignore_aliases(self, data):
+        if isinstance(data, str):
+            return len(data) < self.alias_min_string_length
+        return SafeDumper.ignore_aliases(self, data)
 
 
 class CfnMacroLoader(CfnLoader):
@@ -131,64 +155,219 @@ _functions = [
     ('Fn::Sub', 'Sub', CloudFormationObject.SEQUENCE_OR_SCALAR),
 ]
 
+
+class MacroDefinition(NamedTuple):
+    """
+    A macro evaluated by CfnMacroLoader.
+
+    A pure macro has no side effects and its result depends only on its node and on the
+    cache_key, so results are memoized and it may be evaluated from several threads at once. The
+    default cache key is the node value and the include directory. Memoized results are shared, so
+    they should be immutable. A deterministic macro returns the same result for the same template
+    on every run, so builds using it can be cached; deterministic may be a callable when that
+    depends on configuration.
+    """
+    name: str
+    tag: str
+    type: str
+    constructor: Callable
+    pure: bool = False
+    deterministic: Union[bool, Callable[[], bool]] = False
+    cache_key: Union[Callable, None] = None
+
+    def is_deterministic(self) -> bool:
+        return self.deterministic() if callable(self.deterministic) else self.deterministic
+
+
+MACRO_PLUGINS_GROUP = 'cfutil.macros'
+
 _macros = [
-    ('Macro::IncludeString', 'IncludeString', CloudFormationObject.SCALAR, include_string_constructor),
-    ('Macro::IncludeJsonStringFromYamlFile', 'IncludeJsonStringFromYamlFile', CloudFormationObject.SCALAR,
-     include_json_string_from_yaml_file_constructor),
-    ('Macro::GenerateUUID', 'GenerateUUID', CloudFormationObject.SCALAR, generate_uuid_constructor),
+    MacroDefinition('Macro::IncludeString', 'IncludeString', CloudFormationObject.SCALAR,
+                    include_string_constructor,
+                    pure=True, deterministic=True, cache_key=include_file_cache_key),
+    MacroDefinition('Macro::IncludeJsonStringFromYamlFile', 'IncludeJsonStringFromYamlFile',
+                    CloudFormationObject.SCALAR,
+                    include_json_string_from_yaml_file_constructor,
+                    pure=True, deterministic=True, cache_key=include_file_cache_key),
+    MacroDefinition('Macro::GenerateUUID', 'GenerateUUID', CloudFormationObject.SCALAR,
+                    generate_uuid_constructor,
+                    deterministic=uuid_seeded),
 ]
 
+_macro_registry: dict[str, MacroDefinition] = {}
+_macro_plugins_loaded = False
+
+_macro_results_max_size = 1024
+_macro_results: OrderedDict = OrderedDict()
+_macro_results_lock = threading.Lock()
+
 
 def _init(safe=False):
     global _object_classes
     _object_classes = []
-    for name_, tag_, type_, *args_ in itertools.chain(_functions, [_ref], _macros):
-        if not tag_.startswith('!'):
-            tag_ = '!{}'.format(tag_)
-        tag_ = six.u(tag_)
+    for name_, tag_, type_ in itertools.chain(_functions, [_ref]):
+        _register_object(name_, tag_, type_)
+
+    for macro in _macros:
+        register_macro(macro)
+
+
+def _register_object(name_, tag_, type_, macro_=None):
+    if not tag_.startswith('!'):
+        tag_ = '!{}'.format(tag_)
+    tag_ = six.u(tag_)
 
-        class Object(CloudFormationObject):
-            name = name_
-            tag = tag_
-            type = type_
-            macro = None if len(args_) == 0 else args_[0]
+    class Object(CloudFormationObject):
+        name = name_
+        tag = tag_
+        type = type_
+        macro = macro_
 
-        obj_cls_name = re.search(r'\w+$', tag_).group(0)
-        if six.PY2:
-            obj_cls_name = str(obj_cls_name)
-        Object.__name__ = obj_cls_name
+    obj_cls_name = re.search(r'\w+$', tag_).group(0)
+    if six.PY2:
+        obj_cls_name = str(obj_cls_name)
+    Object.__name__ = obj_cls_name
 
-        _object_classes.append(Object)
-        globals()[obj_cls_name] = Object
+    _object_classes.append(Object)
+    globals()[obj_cls_name] = Object
 
-        for loader in [CfnLoader, CfnMacroLoader]:
-            loader.add_constructor(tag_, Object.construct)
+    for loader in [CfnLoader, CfnMacroLoader]:
+        loader.add_constructor(tag_, Object.construct)
 
-        for dumper in [CfnDumper]:
-            dumper.add_representer(Object, Object.represent)
+    for dumper in [CfnDumper, CfnAliasDumper]:
+        dumper.add_representer(Object, Object.represent)
+
+    return Object
+
+
+def register_macro(macro: MacroDefinition):
+    """
+    Register a macro, replacing a macro of the same name. Plugins register their macros from a
+    function published in the cfutil.macros entry point group, which is called with this function.
+    """
+    _macro_registry[macro.name] = macro
+    _register_object(macro.name, macro.tag, macro.type,
+                     _memoized_macro(macro) if macro.pure else macro.constructor)
+
+
+def registered_macros() -> list[MacroDefinition]:
+    _load_macro_plugins()
+    return list(_macro_registry.values())
+
+
+def macros_deterministic() -> bool:
+    """
+    Return True if templates evaluated with all registered macros are reproducible.
+    """
+    return all(macro.is_deterministic() for macro in registered_macros())
+
+
+def _load_macro_plugins():
+    global _macro_plugins_loaded
+    if _macro_plugins_loaded:
+        return
+    _macro_plugins_loaded = True
+
+    for entry_point in entry_points(group=MACRO_PLUGINS_GROUP):
+        entry_point.load()(register_macro)
+
+
+def _memoized_macro(macro: MacroDefinition):
+    def construct(loader, node):
+        if macro.cache_key is not None:
+            key = macro.cache_key(loader, node)
+        elif isinstance(node, yaml.ScalarNode):
+            key = (node.value, macros_include_dir())
+        else:
+            key = None
+
+        if key is None:
+            return macro.constructor(loader, node)
+
+        key = (macro.name, key)
+        with _macro_results_lock:
+            if key in _macro_results:
+                _macro_results.move_to_end(key)
+                return _macro_results[key]
+
+        result = macro.constructor(loader, node)
+
+        with _macro_results_lock:
+            _macro_results[key] = result
+            if len(_macro_results) > _macro_results_max_size:
+                _macro_results.popitem(last=False)
+
+        return result
+
+    return construct
 
 
 def load_cfn(file: Union[str, IO], evaluate_macros=False) -> dict:
     if isinstance(file, str):
-        with open(file, 'r') as f:
-            return load_cfn(f, evaluate_macros=evaluate_macros)
-
-    if not isinstance(file, IOBase):
+        # a large file is memory-mapped and streamed by the loader without copying it
+        with open_buffer(file) as buffer:
+            return _load_cfn(buffer, file, evaluate_macros)
+    elif isinstance(file, IOBase):
+        # noinspection PyUnresolvedReferences
+        return _load_cfn(file, file.name, evaluate_macros)
+    else:
         raise TypeError('file must be a file path or IO object')
 
-    # noinspection PyUnresolvedReferences
-    file_path = file.name
+
+def _load_cfn(stream, file_path: str, evaluate_macros: bool) -> dict:
     loader_base = os.path.dirname(file_path)
 
     if evaluate_macros:
+        _load_macro_plugins()
         with macros_ref_dir(loader_base):
-            return yaml.load(file, Loader=CfnMacroLoader)
+            return _load_yaml(stream, file_path, CfnMacroLoader)
     else:
-        return yaml.load(file, Loader=CfnLoader)
-
-
-def dump_cfn(obj: dict) -> str:
-    return yaml.dump(obj, Dumper=CfnDumper)
+        return _load_yaml(stream, file_path, CfnLoader)
+
+
+def _load_yaml(stream, name: str, loader_cls):
+    loader = loader_cls(stream)
+    # keep the file name in error marks, even when parsing from a buffer
+    loader.name = name
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+
+async def load_cfn_async(file: Union[str, IO], evaluate_macros=False, executor: Executor = None) -> dict:
+    """
+    Asynchronous counterpart of load_cfn. Reading and parsing runs in the executor (default
+    executor of the running loop when not given) in the context of the caller, so the event loop
+    is not blocked.
+
+    Parsing holds the GIL, so templates parse one at a time in a thread executor. A
+    ProcessPoolExecutor parses them in parallel: the template is loaded in a worker process and
+    shipped back encoded by cfn.encoding, which takes a file path. Macros then run with the include
+    directories and UUID seed of the caller, but outside of its context, e.g. its memory tracer.
+    """
+    loop = asyncio.get_running_loop()
+    if not isinstance(executor, ProcessPoolExecutor):
+        return await loop.run_in_executor(executor, functools.partial(contextvars.copy_context().run,
+                                                                      load_cfn, file, evaluate_macros=evaluate_macros))
+
+    if not isinstance(file, str):
+        raise TypeError('file must be a file path to be loaded in a process executor')
+
+    from cfn.encoding import decode_template, load_cfn_encoded
+
+    encoded = await loop.run_in_executor(executor, functools.partial(load_cfn_encoded, file,
+                                                                     evaluate_macros=evaluate_macros,
+                                                                     macro_state=macro_state()))
+    return await loop.run_in_executor(None, decode_template, encoded)
+
+
+def dump_cfn(obj: dict, aliases: bool = False) -> str:
+    """
+    Dump the template as YAML. With aliases, shared subtrees are written as anchors and aliases,
+    which tools other than CloudFormation accept.
+    """
+    return yaml.dump(obj, Dumper=CfnAliasDumper if aliases else CfnDumper)
 
 
 _init()
@@ -0,0 +1,191 @@
+import argparse
+import hashlib
+import sys
+from typing import NamedTuple
+
+from cfn.traversal import DESCEND, children, path_keys, rebuild
+from cfn.yaml_extensions import CloudFormationObject, load_cfn
+
+_MISSING = object()
+
+
+class Change(NamedTuple):
+    path: str
+    old: object = _MISSING
+    new: object = _MISSING
+
+    def __str__(self):
+        if self.old is _MISSING:
+            return f'{self.path}: + {_format(self.new)}'
+        elif self.new is _MISSING:
+            return f'{self.path}: - {_format(self.old)}'
+        return f'{self.path}: {_format(self.old)} -> {_format(self.new)}'
+
+
+class TemplateDiff(NamedTuple):
+    added: list
+    removed: list
+    modified: dict
+    # changes of other sections than Resources
+    sections: list
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified or self.sections)
+
+
+def hook_command(parser, subparsers):
+    def cmd(args):
+        old = load_cfn(args.old, evaluate_macros=args.macros)
+        new = load_cfn(args.new, evaluate_macros=args.macros)
+
+        diff = diff_templates(old, new)
+        print_diff(diff)
+        if diff:
+            sys.exit(1)
+
+    parser_diff = subparsers.add_parser('diff', help='diff help')
+    parser_diff.add_argument('old', type=str, help='old template file')
+    parser_diff.add_argument('new', type=str, help='new template file')
+    parser_diff.set_defaults(func=cmd)
+
+    parser_diff.add_argument('--macros',
+                             action=argparse.BooleanOptionalAction,
+                             help='evaluate macros')
+
+
+def print_diff(diff: TemplateDiff, file=None):
+    file = file or sys.stdout
+    for resource_name in diff.added:
+        print(f'+ {resource_name}', file=file)
+    for resource_name in diff.removed:
+        print(f'- {resource_name}', file=file)
+    for resource_name, changes in diff.modified.items():
+        print(f'~ {resource_name}', file=file)
+        for change in changes:
+            print(f'    {change}', file=file)
+    for change in diff.sections:
+        print(f'~ {change}', file=file)
+
+
+def diff_templates(old: dict, new: dict) -> TemplateDiff:
+    """
+    Compare two templates structurally.
+
+    Every subtree is identified by a Merkle digest of its content, so unchanged resources and
+    unchanged parts of modified resources are skipped by a single comparison of digests. Changes
+    are reported with their property paths, intrinsic functions are part of the path, e.g.
+    Properties.TableName.Fn::Sub.0.
+    """
+    digests = _Digests()
+
+    old_resources = old.get('Resources') or {}
+    new_resources = new.get('Resources') or {}
+
+    added = [name for name in new_resources if name not in old_resources]
+    removed = [name for name in old_resources if name not in new_resources]
+    modified = {}
+    for name, old_def in old_resources.items():
+        if name not in new_resources:
+            continue
+        new_def = new_resources[name]
+        if digests.digest(old_def) != digests.digest(new_def):
+            modified[name] = _diff(old_def, new_def, digests, ())
+
+    sections = []
+    for section in sorted(set(old) | set(new), key=str):
+        if section == 'Resources':
+            continue
+        sections.extend(_diff(old.get(section, _MISSING), new.get(section, _MISSING), digests, (section,)))
+
+    return TemplateDiff(added, removed, modified, sections)
+
+
+class _Digests(object):
+    """
+    Merkle digests of template subtrees, computed bottom-up and memoized for the lifetime of the
+    compared trees.
+    """
+
+    def __init__(self):
+        self._memo = {}
+        # keeps the digested nodes alive, so their ids stay unique
+        self._nodes = []
+
+    def digest(self, obj) -> bytes:
+        return rebuild(obj, enter=self._enter, leave=self._container)
+
+    def _enter(self, node):
+        digest = self._memo.get(id(node))
+        if digest is not None:
+            return digest
+        if isinstance(node, (dict, list, tuple, CloudFormationObject)):
+            return DESCEND
+        return _leaf_digest(node)
+
+    def _container(self, node, copy) -> bytes:
+        if isinstance(copy, dict):
+            members = sorted(copy.items(), key=lambda item: str(item[0]))
+        elif isinstance(copy, CloudFormationObject):
+            members = [(copy.name, copy.data)]
+        else:
+            members = enumerate(copy)
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update(_container_tag(node))
+        for key, digest in members:
+            h.update(_leaf_digest(key))
+            h.update(digest)
+
+        digest = self._memo[id(node)] = h.digest()
+        self._nodes.append(node)
+        return digest
+
+
+def _diff(old, new, digests: _Digests, path: tuple) -> list[Change]:
+    changes = []
+    stack = [(old, new, path)]
+    while stack:
+        old_node, new_node, node_path = stack.pop()
+
+        if old_node is _MISSING or new_node is _MISSING:
+            if old_node is not new_node:
+                changes.append(Change(_render_path(node_path), old_node, new_node))
+            continue
+
+        if digests.digest(old_node) == digests.digest(new_node):
+            continue
+
+        old_children = children(old_node)
+        new_children = children(new_node)
+        if old_children is None or new_children is None or _container_tag(old_node) != _container_tag(new_node):
+            changes.append(Change(_render_path(node_path), old_node, new_node))
+            continue
+
+        old_members, new_members = dict(old_children), dict(new_children)
+        keys = list(old_members) + [key for key in new_members if key not in old_members]
+        for key in reversed(keys):
+            stack.append((old_members.get(key, _MISSING), new_members.get(key, _MISSING), (key, node_path)))
+
+    return changes
+
+
+def _container_tag(node) -> bytes:
+    if isinstance(node, dict):
+        return b'd'
+    elif isinstance(node, (list, tuple)):
+        return b'l'
+    return b'f:' + node.name.encode('utf-8')
+
+
+def _leaf_digest(node) -> bytes:
+    return f'{type(node).__name__}:{node!r}'.encode('utf-8')
+
+
+def _render_path(path: tuple) -> str:
+    return '.'.join(str(key) for key in path_keys(path))
+
+
+def _format(value) -> str:
+    if isinstance(value, CloudFormationObject):
+        return str(value)
+    return repr(value)
@@ -1,18 +1,70 @@
 import argparse
-import copy
+import asyncio
+import contextlib
+import contextvars
+import fnmatch
+import functools
 import os
 import re
-from typing import Union, Tuple
-
-from cfn.macros import rel_dir_path
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Union, Callable, Iterator, NamedTuple
+
+from cfn.file_io import read_text
+from cfn.imports import describe_imports, write_resources_to_import
+from cfn.macros import macro_state, rel_dir_path
+from cfn.memory import measure
+from cfn.references import SUB_PLACEHOLDER
+from cfn.traversal import iter_nodes, rebuild
 from cfn.yaml_extensions import CloudFormationObject
 
+# resource types and nested stack locations found by a scan of the template text, in block and
+# flow style, with or without quotes
+_header_type = re.compile(r'''(?<![\w])["']?Type["']?\s*:\s*["']?([\w:.\-]+)''')
+_header_location = re.compile(r'''(?<![\w])["']?Location["']?\s*:\s*["']?([^"'\s#,}]+\.yaml)''')
+
+_NESTED_STACK_TYPES = frozenset(['AWS::CloudFormation::Stack', 'AWS::Serverless::Application'])
+
 
 def hook_command(parser, subparsers):
     def cmd(args):
-        template = flatten_cloudformation_template(args.template,
-                                                   evaluate_macros=args.macros)
-        print(_dump_yaml(template))
+        if args.uuid_seed is not None:
+            from cfn.macros import set_uuid_seed
+            set_uuid_seed(args.uuid_seed)
+
+        tracer = contextlib.nullcontext()
+        if args.memory_report:
+            from cfn.memory import MemoryTracer
+            tracer = MemoryTracer()
+
+        resource_filter = None
+        if args.include_type or args.include_id:
+            resource_filter = ResourceFilter(types=tuple(args.include_type or ()),
+                                             ids=tuple(args.include_id or ()),
+                                             closure=args.include_references)
+
+        with tracer:
+            template = flatten_cloudformation_template(args.template,
+                                                       evaluate_macros=args.macros,
+                                                       fold_constants=args.fold_constants,
+                                                       resource_filter=resource_filter,
+                                                       dedupe=args.dedupe)
+            if args.validate:
+                from commands.validate import validate_template, report_issues
+                report_issues(validate_template(template))
+            if args.import_file:
+                from cfn.imports import ImportDescriptors
+                descriptors = ImportDescriptors.from_metadata(template['Metadata'])
+                write_resources_to_import(descriptors, args.import_file)
+                for resource_name in descriptors.unresolved:
+                    print(f'Identifier of {resource_name} is not known statically, it is left out of '
+                          f'{args.import_file}', file=sys.stderr)
+            output = dump_yaml(template, aliases=args.dedupe and args.aliases)
+
+        print(output)
+        if args.memory_report:
+            from cfn.memory import format_memory_report
+            print(format_memory_report(tracer.report), file=sys.stderr)
 
     parser_flatten = subparsers.add_parser('flatten', help='flatten help')
     parser_flatten.add_argument('template', type=str, help='template file')
@@ -21,62 +73,290 @@ def hook_command(parser, subparsers):
     parser_flatten.add_argument('--macros',
                                 action=argparse.BooleanOptionalAction,
                                 help='evaluate macros')
+    parser_flatten.add_argument('--uuid-seed',
+                                type=str,
+                                help='generate deterministic UUIDs derived from the seed')
+    parser_flatten.add_argument('--fold-constants',
+                                action=argparse.BooleanOptionalAction,
+                                default=False,
+                                help='substitute nested stack parameters and fold static intrinsic functions')
+    parser_flatten.add_argument('--validate',
+                                action=argparse.BooleanOptionalAction,
+                                default=False,
+                                help='check the flattened template for dangling references')
+    parser_flatten.add_argument('--import-file',
+                                type=str,
+                                help='write resources to import of an IMPORT change set to this file')
+    parser_flatten.add_argument('--dedupe',
+                                action=argparse.BooleanOptionalAction,
+                                default=False,
+                                help='share identical subtrees and strings of the flattened template while it '
+                                     'is built, which lowers its memory, but not the size of the output '
+                                     'without --aliases')
+    parser_flatten.add_argument('--aliases',
+                                action=argparse.BooleanOptionalAction,
+                                default=False,
+                                help='with --dedupe, write shared subtrees as YAML anchors and aliases, '
+                                     'which CloudFormation does not accept')
+    parser_flatten.add_argument('--memory-report',
+                                action=argparse.BooleanOptionalAction,
+                                default=False,
+                                help='trace memory per stage, nested template and include file and '
+                                     'print the report to stderr')
+    parser_flatten.add_argument('--include-type',
+                                action='append',
+                                help='keep only resources of this type, a shell-style pattern, e.g. '
+                                     'AWS::DynamoDB::*; may be repeated')
+    parser_flatten.add_argument('--include-id',
+                                action='append',
+                                help='keep only resources whose flattened logical ID starts with this prefix; '
+                                     'may be repeated')
+    parser_flatten.add_argument('--include-references',
+                                action=argparse.BooleanOptionalAction,
+                                default=False,
+                                help='keep also resources referenced by the included ones')
+
+
+DEFAULT_MAX_CONCURRENCY = 16
+
 
+class ResourceFilter(NamedTuple):
+    """
+    Selects the flattened resources by type, given as shell-style patterns, or by prefix of their
+    flattened logical ID. With closure, resources referenced by selected ones in the same template
+    are kept as well.
+
+    Nested stacks that cannot contain a selected resource are pruned before they are loaded. Their
+    resource types are found by a scan of the template text, see _nested_resource_types.
+    """
+    types: tuple = ()
+    ids: tuple = ()
+    closure: bool = False
+
+    def matches(self, resource_name: str, resource_type: str) -> bool:
+        return self._matches_type(resource_type) or any(resource_name.startswith(prefix) for prefix in self.ids)
+
+    def may_match_nested(self, naming_prefix: str, template_file_path: str) -> bool:
+        types = _nested_resource_types(template_file_path)
+        if types is None or any(self._matches_type(resource_type) for resource_type in types):
+            return True
+        if not self.ids:
+            return False
+        if types & _NESTED_STACK_TYPES:
+            # resources of deeper nested stacks are prefixed with their own stack names
+            return True
+        return any(prefix.startswith(naming_prefix) or naming_prefix.startswith(prefix) for prefix in self.ids)
+
+    def _matches_type(self, resource_type: str) -> bool:
+        return any(fnmatch.fnmatchcase(resource_type, pattern) for pattern in self.types)
+
+
+def flatten_cloudformation_template(template_file_path: str,
+                                    evaluate_macros=False,
+                                    fold_constants=False,
+                                    resource_filter: ResourceFilter = None,
+                                    dedupe=False) -> dict:
+    template = load_template(template_file_path, evaluate_macros=evaluate_macros)
+    return flatten_loaded_template(template_file_path, template, load_template,
+                                   fold_constants=fold_constants,
+                                   resource_filter=resource_filter,
+                                   dedupe=dedupe)
+
+
+async def flatten_cloudformation_template_async(template_file_path: str,
+                                                evaluate_macros=False,
+                                                fold_constants=False,
+                                                resource_filter: ResourceFilter = None,
+                                                dedupe=False,
+                                                executor: Executor = None,
+                                                max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                                                timeout: float = None) -> dict:
+    """
+    Asynchronous counterpart of flatten_cloudformation_template.
+
+    The whole tree of nested templates is read and parsed concurrently in the executor, at most
+    max_concurrency templates at a time, and then flattened by the same engine as the synchronous
+    API. The coroutine can be cancelled, and it raises asyncio.TimeoutError when it does not finish
+    within timeout seconds.
+
+    Parsing holds the GIL, so a thread executor only overlaps I/O. With a ProcessPoolExecutor
+    templates are parsed in parallel and shipped back encoded (see load_cfn_async), their loads
+    are then not reported to the memory tracer, and the loaded tree is flattened in the default
+    executor of the loop.
+    """
+
+    async def flatten():
+        loader = _AsyncTemplateTreeLoader(executor, asyncio.Semaphore(max_concurrency), resource_filter)
+        template = await loader.load(template_file_path, evaluate_macros=evaluate_macros)
+        await loader.load_nested(template_file_path, template)
+
+        loop = asyncio.get_running_loop()
+        # jobs run in the context of the caller, e.g. with its memory tracer
+        flatten_executor = None if isinstance(executor, ProcessPoolExecutor) else executor
+        return await loop.run_in_executor(flatten_executor,
+                                          functools.partial(contextvars.copy_context().run,
+                                                            flatten_loaded_template,
+                                                            template_file_path,
+                                                            template,
+                                                            loader.get,
+                                                            fold_constants=fold_constants,
+                                                            resource_filter=resource_filter,
+                                                            dedupe=dedupe))
+
+    return await asyncio.wait_for(flatten(), timeout)
+
+
+def flatten_loaded_template(template_file_path: str,
+                            template: dict,
+                            load_template: Callable[[str], dict],
+                            fold_constants: bool = False,
+                            resource_filter: ResourceFilter = None,
+                            dedupe: bool = False) -> dict:
+    """
+    Flatten the template loaded from template_file_path. Nested templates are loaded with
+    load_template, e.g. from a cache. The template itself is not modified.
+
+    With dedupe, identical subtrees and strings are shared as every resource is sanitized (see
+    cfn.dedupe), so the result must be treated as immutable.
+    """
+    sharing = None
+    if dedupe:
+        from cfn.dedupe import SubtreeSharing
+        sharing = SubtreeSharing()
 
-def flatten_cloudformation_template(template_file_path: str, evaluate_macros=False) -> dict:
-    template = _load_template(template_file_path, evaluate_macros=evaluate_macros)
-    template_copy = copy.deepcopy(template)
+    with measure('copy', template_file_path):
+        template_copy = rebuild(template)
     resources = process_cloudformation_resources('root', template_copy, {
         'master_template_location': template_file_path,
+        'load_template': load_template,
+        'fold_constants': fold_constants,
+        'resource_filter': resource_filter,
+        'sharing': sharing,
     })
 
     template_copy['Resources'] = {}
     template_copy['Metadata'] = {} if template_copy.get('Metadata') is None else template_copy['Metadata']
-    template_copy['Metadata']['ResourcesForImport'] = []
 
     for resource_name, effective_def, original_def, meta in resources:
-        # TODO: put information about retargeted resources into metadata
-        # structure
-        # ResourceForImport:
-        #   - LogicalId: RetargetedId
-        #     ResourceType: ResourceType
-        #     ResourceIdentifier:
-        #       TableName|ResourceName: Name
         template_copy['Resources'][resource_name] = effective_def
 
-        is_required_for_import, import_def = _describe_import(resource_name, effective_def, original_def, meta)
-        if is_required_for_import:
-            template_copy['Metadata']['ResourcesForImport'].append(import_def)
+    descriptors = describe_imports(resources)
+    template_copy['Metadata']['ResourcesForImport'] = descriptors.resources_for_import
+    if descriptors.unresolved:
+        template_copy['Metadata']['UnresolvedResourcesForImport'] = descriptors.unresolved
+
+    if sharing is not None:
+        for key, value in template_copy.items():
+            if key != 'Resources':
+                template_copy[key] = sharing.share(value)
 
     return template_copy
 
 
-def _dump_yaml(template: dict) -> str:
+def dump_yaml(template: dict, aliases: bool = False) -> str:
+    """
+    Dump the flattened template as YAML, see cfn.yaml_extensions.dump_cfn.
+    """
     from cfn.yaml_extensions import dump_cfn
-    return dump_cfn(template)
+
+    with measure('dump'):
+        return dump_cfn(template, aliases=aliases)
 
 
 def process_cloudformation_resources(template_name: str,
                                      template: dict,
                                      context: dict) -> list:
+    """
+    Return the sanitized resources of the template and of all its nested stacks, in template
+    order. Nested stacks are expanded with an explicit stack of templates, so long chains of nested
+    stacks do not hit the recursion limit.
+    """
     processed_resources = []
 
-    template_resources: dict = template.get('Resources', {})
-    for resource_name, resource_def in template_resources.items():
+    stack = [(_template_resources(template, context), context.get('master_template_location'))]
+    while stack:
+        resources, _ = stack[-1]
+        item = next(resources, None)
+        if item is None:
+            stack.pop()
+            continue
+
+        resource_name, resource_def, resource_context = item
         if _needs_flattening(resource_def):
-            flattened_resources = _flatten_resource(resource_name,
-                                                    resource_def,
-                                                    context)
-            processed_resources.extend(flattened_resources)
+            nested_template_def, nested_context = _flatten_resource(resource_name,
+                                                                    resource_def,
+                                                                    resource_context)
+            nested_template_location = nested_context['master_template_location']
+            if any(location == nested_template_location for _, location in stack):
+                raise ValueError(f'Nested stack locations form a cycle: {nested_template_location}')
+            stack.append((_template_resources(nested_template_def, nested_context), nested_template_location))
         else:
-            sanitized_resource = _sanitize_resource(resource_name,
-                                                    resource_def,
-                                                    context)
+            with measure('sanitize', resource_context.get('master_template_location')):
+                sanitized_resource = _sanitize_resource(resource_name,
+                                                        resource_def,
+                                                        resource_context)
             processed_resources.append(sanitized_resource)
 
     return processed_resources
 
 
+def _template_resources(template: dict, context: dict) -> Iterator[tuple[str, dict, dict]]:
+    if context.get('fold_constants', False):
+        context = {**context, 'evaluator': _get_evaluator(template, context)}
+
+    template_resources: dict = template.get('Resources', {})
+
+    resource_filter = context.get('resource_filter')
+    selected = None if resource_filter is None else _select_resources(template_resources, context)
+
+    for resource_name, resource_def in template_resources.items():
+        if 'evaluator' in context and context['evaluator'].condition(resource_def.get('Condition')) is False:
+            # statically unreachable
+            continue
+
+        if selected is not None:
+            if _needs_flattening(resource_def):
+                if not resource_filter.may_match_nested(_get_naming_prefix(resource_name),
+                                                        _nested_template_location(resource_def, context)):
+                    continue
+            elif resource_name not in selected:
+                continue
+
+        yield resource_name, resource_def, context
+
+
+def _select_resources(template_resources: dict, context: dict) -> set:
+    from cfn.references import resource_references
+
+    resource_filter: ResourceFilter = context['resource_filter']
+    naming_prefix = context.get('naming_prefix', '')
+
+    resources = {name: resource_def for name, resource_def in template_resources.items()
+                 if not _needs_flattening(resource_def)}
+    selected = {name for name, resource_def in resources.items()
+                if resource_filter.matches(f'{naming_prefix}{name}', resource_def.get('Type', ''))}
+
+    if resource_filter.closure:
+        pending = list(selected)
+        while pending:
+            for dependency in resource_references(resources[pending.pop()], resources):
+                if dependency not in selected:
+                    selected.add(dependency)
+                    pending.append(dependency)
+
+    return selected
+
+
+def _get_evaluator(template: dict, context: dict):
+    from cfn.evaluate import evaluator_for
+
+    # only nested stacks have known parameter values, the root ones are given at deploy time
+    return evaluator_for(context.get('parameters', {}),
+                         template.get('Conditions') or {},
+                         template.get('Mappings') or {},
+                         context.get('parameter_types', {}))
+
+
 def _needs_flattening(resource_def: dict) -> bool:
     """
     This function checks whether current resource is a pointer to nested resource, that
@@ -103,7 +383,10 @@ def _needs_flattening(resource_def: dict) -> bool:
 
 def _flatten_resource(resource_name: str,
                       resource_def: dict,
-                      context: dict) -> list:
+                      context: dict) -> tuple[dict, dict]:
+    """
+    Return the nested template of the resource and the context to flatten it in.
+    """
     resource_type = resource_def.get('Type', '')
 
     match resource_type:
@@ -121,13 +404,59 @@ def _flatten_resource(resource_name: str,
 
 def _flatten_serverless_application(resource_name: str,
                                     resource_def: dict,
-                                    context: dict) -> list:
+                                    context: dict) -> tuple[dict, dict]:
     return _flatten_nested_stack(resource_name, resource_def, context)
 
 
 def _flatten_nested_stack(resource_name: str,
                           resource_def: dict,
-                          context: dict) -> list:
+                          context: dict) -> tuple[dict, dict]:
+    nested_template_location = _nested_template_location(resource_def, context)
+
+    load = context.get('load_template', load_template)
+    nested_template_def = load(nested_template_location)
+
+    resource_properties = resource_def.get('Properties', {})
+    nested_application_parameters = resource_properties.get('Parameters', {})
+    nested_parameter_types = {}
+
+    if context.get('fold_constants', False):
+        # parameter values are substituted into the nested template, so they are retargeted (and
+        # folded) in the context of the parent template, and the defaults of the nested template
+        # stand in for the values not given
+        _, parameters_def, _, _ = _sanitize_resource(resource_name,
+                                                     {'Properties': nested_application_parameters},
+                                                     context)
+        nested_parameters_def = {
+            parameter_name: parameter_def
+            for parameter_name, parameter_def in (nested_template_def.get('Parameters') or {}).items()
+            if isinstance(parameter_def, dict)
+        }
+        nested_application_parameters = {
+            parameter_name: parameter_def['Default']
+            for parameter_name, parameter_def in nested_parameters_def.items()
+            if 'Default' in parameter_def
+        }
+        nested_application_parameters.update(parameters_def['Properties'])
+        # list parameters are split by the evaluator
+        nested_parameter_types = {parameter_name: parameter_def.get('Type')
+                                  for parameter_name, parameter_def in nested_parameters_def.items()}
+
+    nested_context = {
+        'master_template_location': nested_template_location,
+        'parameters': nested_application_parameters,
+        'parameter_types': nested_parameter_types,
+        'naming_prefix': _get_naming_prefix(resource_name),
+        'load_template': load,
+        'fold_constants': context.get('fold_constants', False),
+        'resource_filter': context.get('resource_filter'),
+        'sharing': context.get('sharing'),
+    }
+
+    return nested_template_def, nested_context
+
+
+def _nested_template_location(resource_def: dict, context: dict) -> str:
     master_template_location = context.get('master_template_location', None)
     if not master_template_location:
         raise ValueError('master_template_location is required when flattening nested Serverless::Application')
@@ -138,6 +467,10 @@ def _flatten_nested_stack(resource_name: str,
     if not nested_application_location.endswith('.yaml'):
         raise ValueError(f'Nested application location should end with .yaml, got {nested_application_location}')
 
+    return _resolve_nested_location(master_template_location, nested_application_location)
+
+
+def _resolve_nested_location(master_template_location: str, nested_application_location: str) -> str:
     nested_template_location = os.path.abspath(
         os.path.join(os.path.abspath(os.path.dirname(master_template_location)),
                      nested_application_location,
@@ -146,21 +479,65 @@ def _flatten_nested_stack(resource_name: str,
     if nested_template_location.endswith('.out.yaml'):
         nested_template_location = nested_template_location[:-9] + '.yaml'
 
-    nested_template_def = _load_template(nested_template_location)
+    return nested_template_location
 
-    nested_application_parameters = resource_properties.get('Parameters', {})
 
-    nested_context = {
-        'master_template_location': nested_template_location,
-        'parameters': nested_application_parameters,
-        'naming_prefix': _get_naming_prefix(resource_name),
-    }
+def _nested_resource_types(template_file_path: str) -> Union[frozenset, None]:
+    """
+    Return the resource types of the template and of all templates it nests, found by a scan of
+    their text instead of parsing them, or None if they cannot be determined that way. The scan may
+    find more types than there are, e.g. from Type properties, but never less.
+    """
+    types = set()
+    pending, seen = [template_file_path], set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+
+        try:
+            stat = os.stat(current)
+        except OSError:
+            return None
+        header_types, locations, nested_stacks = _scan_template_header(current, stat.st_mtime_ns, stat.st_size)
+        if nested_stacks > len(locations):
+            # some nested stack is not given by a plain local location
+            return None
+
+        types |= header_types
+        pending.extend(_resolve_nested_location(current, location) for location in locations)
+
+    return frozenset(types)
+
+
+def nested_template_locations(template_file_path: str, load: Callable[[str], dict] = None) -> list[str]:
+    """
+    Return the locations of the templates nested by the template. They are found by a scan of the
+    template text, the template is loaded, with load when given, only if the scan finds fewer locations
+    than nested stacks, e.g. for a stack given by TemplateURL.
+    """
+    stat = os.stat(template_file_path)
+    _, locations, nested_stacks = _scan_template_header(template_file_path, stat.st_mtime_ns, stat.st_size)
+    if nested_stacks <= len(locations):
+        return [_resolve_nested_location(template_file_path, location) for location in locations]
+
+    template = (load or load_template)(template_file_path)
+    context = {'master_template_location': template_file_path}
+    return [
+        _nested_template_location(resource_def, context)
+        for resource_def in (template.get('Resources') or {}).values()
+        if isinstance(resource_def, dict) and _needs_flattening(resource_def)
+    ]
 
-    nested_resources = process_cloudformation_resources(resource_name,
-                                                        nested_template_def,
-                                                        nested_context)
 
-    return nested_resources
+@functools.lru_cache(maxsize=1024)
+def _scan_template_header(template_file_path: str, mtime_ns: int, size: int) -> tuple[frozenset, tuple, int]:
+    text = read_text(template_file_path)
+    types = _header_type.findall(text)
+    return (frozenset(types),
+            tuple(_header_location.findall(text)),
+            sum(1 for resource_type in types if resource_type in _NESTED_STACK_TYPES))
 
 
 def _sanitize_resource(resource_name: str,
@@ -170,96 +547,27 @@ def _sanitize_resource(resource_name: str,
 
     sanitized_resource_name = f'{naming_prefix}{resource_name}'
 
-    resource_properties = copy.deepcopy(resource_def.get('Properties', {}))
+    resource_properties = rebuild(resource_def.get('Properties', {}))
+
+    parameters = context.get('parameters', {})
+    for node in iter_nodes(resource_properties):
+        if isinstance(node, CloudFormationObject):
+            _retarget_function(node, naming_prefix, parameters)
+
+    new_def = {key: None if key == 'Properties' else rebuild(value) for key, value in resource_def.items()}
+
+    evaluator = context.get('evaluator')
+    if evaluator is not None:
+        resource_properties = evaluator.evaluate(resource_properties)
+        if evaluator.condition(new_def.get('Condition')) is True:
+            del new_def['Condition']
 
-    def ref_from_param_context(key: str) -> tuple[bool, Union[str, None]]:
-        parameters = context.get('parameters', {})
-        if key in parameters:
-            return True, parameters[key]
-        else:
-            return False, None
-
-    def process_cfn_element(element):
-        match element:
-            case CloudFormationObject(name='Ref'):
-                def process_ref():
-                    ref = element.data
-                    is_ref_from_context, ref_value_from_context = ref_from_param_context(ref)
-                    if is_ref_from_context:
-                        element.data = element.data
-                    else:
-                        element.data = f'{naming_prefix}{ref}'
-
-                process_ref()
-            case CloudFormationObject(name='Fn::Sub'):
-                def process_sub():
-                    sub_context = element.data[1] if isinstance(element.data, list) else {}
-                    sub_expr = element.data[0] if isinstance(element.data, list) else str(element.data)
-
-                    def ref_pointer_from_context(key: str, local_context: dict) -> tuple[bool, Union[str, None]]:
-                        if key in local_context:
-                            return True, key
-                        else:
-                            return False, None
-
-                    pm = None
-                    retargeted_sub_expr = ''
-                    for m in re.finditer(r'(?<!\\)\$\{[a-zA-Z_.]+}', sub_expr):
-                        expr = sub_expr[m.start() + 2:m.end() - 1]
-                        pointer, *rest = expr.split('.', 1)
-                        is_pointer_from_sub_context, ref_pointer_from_sub_context = ref_pointer_from_context(pointer,
-                                                                                                             sub_context)
-                        is_pointer_from_param_context, ref_pointer_from_param_context = ref_pointer_from_context(
-                            pointer, context.get('parameters', {}))
-                        if is_pointer_from_sub_context:
-                            retargeted_pointer = ref_pointer_from_sub_context
-                        elif is_pointer_from_param_context:
-                            retargeted_pointer = ref_pointer_from_param_context
-                        else:
-                            retargeted_pointer = f'{naming_prefix}{pointer}'
-
-                        retargeted_expr = '.'.join([retargeted_pointer, *rest])
-                        retargeted_sub_expr += sub_expr[
-                                               pm.end() if pm is not None else 0:m.start()] + '${' + retargeted_expr + '}'
-                        pm = m
-
-                    _walk_dict(sub_context)
-
-                process_sub()
-            case CloudFormationObject(name='Fn::GetAtt'):
-                def process_get_att():
-                    pointer = element.data
-                    target_resource_name, attr_name = pointer.split('.')
-                    is_ref_from_context, ref_value_from_context = ref_from_param_context(target_resource_name)
-                    element.data = f'{naming_prefix}{ref_value_from_context}.{attr_name}'
-
-                process_get_att()
-
-    def _walk_dict(obj: dict):
-        for key, value in obj.items():
-            match value:
-                case CloudFormationObject():
-                    process_cfn_element(element=value)
-                case dict():
-                    _walk_dict(value)
-                case list():
-                    _walk_list(value)
-
-    def _walk_list(obj: list):
-        for member in obj:
-            match member:
-                case dict():
-                    _walk_dict(member)
-                case list():
-                    _walk_list(member)
-                case CloudFormationObject():
-                    process_cfn_element(element=member)
-
-    _walk_dict(resource_properties)
-
-    new_def = copy.deepcopy(resource_def)
     new_def['Properties'] = resource_properties
 
+    sharing = context.get('sharing')
+    if sharing is not None:
+        new_def = sharing.share(new_def)
+
     return (
         sanitized_resource_name,
         new_def,
@@ -273,44 +581,144 @@ def _sanitize_resource(resource_name: str,
     )
 
 
-def _load_template(template_file_path: str, evaluate_macros: bool = False) -> dict:
+def _retarget_function(element: CloudFormationObject, naming_prefix: str, parameters: dict):
+    match element:
+        case CloudFormationObject(name='Ref'):
+            ref = element.data
+            if ref not in parameters and not ref.startswith('AWS::'):
+                element.data = f'{naming_prefix}{ref}'
+        case CloudFormationObject(name='Fn::Sub'):
+            sub_context = element.data[1] if isinstance(element.data, list) else {}
+            sub_expr = element.data[0] if isinstance(element.data, list) else str(element.data)
+
+            pm = None
+            retargeted_sub_expr = ''
+            for m in SUB_PLACEHOLDER.finditer(sub_expr):
+                expr = m.group(1)
+                if expr.startswith('!') or ':' in expr:
+                    # literals and pseudo parameters
+                    continue
+                pointer, *rest = expr.split('.', 1)
+                if pointer in sub_context or pointer in parameters:
+                    retargeted_pointer = pointer
+                else:
+                    retargeted_pointer = f'{naming_prefix}{pointer}'
+
+                retargeted_expr = '.'.join([retargeted_pointer, *rest])
+                retargeted_sub_expr += sub_expr[pm.end() if pm is not None else 0:m.start()] + '${' + retargeted_expr + '}'
+                pm = m
+
+            retargeted_sub_expr += sub_expr[pm.end() if pm is not None else 0:]
+            if isinstance(element.data, list):
+                element.data[0] = retargeted_sub_expr
+            else:
+                element.data = retargeted_sub_expr
+        case CloudFormationObject(name='Fn::GetAtt'):
+            pointer = element.data
+            if isinstance(pointer, list):
+                target_resource_name, *attr_path = pointer
+                element.data = [f'{naming_prefix}{target_resource_name}', *attr_path]
+            else:
+                target_resource_name, attr_name = pointer.split('.', 1)
+                element.data = f'{naming_prefix}{target_resource_name}.{attr_name}'
+
+
+def load_template(template_file_path: str, evaluate_macros: bool = False, executor: Executor = None) -> dict:
+    """
+    Load the template, parsed in a worker of the executor when given. Parsing holds the GIL, so a
+    ProcessPoolExecutor parses templates loaded from several threads in parallel; they are shipped
+    back encoded by cfn.encoding and the memory tracer only sees them decoded.
+    """
     from cfn.yaml_extensions import load_cfn
 
-    with rel_dir_path(os.path.dirname(template_file_path)):
-        with open(template_file_path, 'r') as template_file:
-            template_def = load_cfn(template_file, evaluate_macros=evaluate_macros)
+    with rel_dir_path(os.path.dirname(template_file_path)), measure('load', template_file_path):
+        if executor is None:
+            return load_cfn(template_file_path, evaluate_macros=evaluate_macros)
 
-    return template_def
+        from cfn.encoding import decode_template, load_cfn_encoded
 
+        encoded = executor.submit(load_cfn_encoded, template_file_path,
+                                  evaluate_macros=evaluate_macros,
+                                  macro_state=macro_state()).result()
+        return decode_template(encoded)
 
-def _describe_import(resource_name: str,
-                     resource_def: dict,
-                     original_def: dict,
-                     meta: dict) -> Tuple[bool, Union[dict, None]]:
-    resource_handlers = {
-        'AWS::Serverless::Function': lambda: ('FunctionName', resource_def['Properties'].get('FunctionName')),
-        'AWS::Lambda::Function': lambda: ('FunctionName', resource_def['Properties'].get('FunctionName')),
-        'AWS::DynamoDB::Table': lambda: ('TableName', resource_def['Properties'].get('TableName')),
-    }
 
-    is_retargeted = meta.get('was_retargeted', False)
-    if not is_retargeted:
-        return False, None
+async def _load_template_async(template_file_path: str,
+                               evaluate_macros: bool = False,
+                               executor: Executor = None) -> dict:
+    if isinstance(executor, ProcessPoolExecutor):
+        from cfn.yaml_extensions import load_cfn_async
 
-    resource_type = resource_def.get('Type')
-    resource_handler = resource_handlers.get(resource_type)
+        with rel_dir_path(os.path.dirname(template_file_path)):
+            return await load_cfn_async(template_file_path, evaluate_macros=evaluate_macros, executor=executor)
 
-    if resource_handler is None:
-        return False, None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(contextvars.copy_context().run,
+                                                                  load_template,
+                                                                  template_file_path,
+                                                                  evaluate_macros=evaluate_macros))
 
-    resource_id_key, resource_id_value = resource_handler()
-    return True, {
-        'LogicalId': resource_name,
-        'ResourceType': resource_type,
-        'ResourceIdentifier': {
-            resource_id_key: resource_id_value,
-        },
-    }
+
+class _AsyncTemplateTreeLoader(object):
+    """
+    Loads all nested templates a template points to. Every nested template is scheduled as soon
+    as its parent is parsed, so independent subtrees are loaded concurrently, and each of them is
+    loaded only once, even if it is shared.
+    """
+
+    def __init__(self,
+                 executor: Union[Executor, None],
+                 semaphore: asyncio.Semaphore,
+                 resource_filter: ResourceFilter = None):
+        self.executor = executor
+        self.semaphore = semaphore
+        self.resource_filter = resource_filter
+        self.templates: dict[str, asyncio.Task] = {}
+
+    async def load(self, template_file_path: str, evaluate_macros: bool = False) -> dict:
+        async with self.semaphore:
+            return await _load_template_async(template_file_path,
+                                              evaluate_macros=evaluate_macros,
+                                              executor=self.executor)
+
+    async def load_nested(self, template_file_path: str, template: dict):
+        pending = self._schedule_nested(template_file_path, template)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    nested_template_location, nested_template = task.result()
+                    pending |= self._schedule_nested(nested_template_location, nested_template)
+        except BaseException:
+            for task in self.templates.values():
+                task.cancel()
+            raise
+
+    def get(self, template_file_path: str) -> dict:
+        _, template = self.templates[template_file_path].result()
+        return template
+
+    def _schedule_nested(self, template_file_path: str, template: dict) -> set:
+        context = {'master_template_location': template_file_path}
+        scheduled = set()
+        for resource_name, resource_def in template.get('Resources', {}).items():
+            if not _needs_flattening(resource_def):
+                continue
+
+            nested_template_location = _nested_template_location(resource_def, context)
+            if self.resource_filter is not None and \
+                    not self.resource_filter.may_match_nested(_get_naming_prefix(resource_name),
+                                                              nested_template_location):
+                continue
+            if nested_template_location not in self.templates:
+                task = asyncio.create_task(self._load_located(nested_template_location))
+                self.templates[nested_template_location] = task
+                scheduled.add(task)
+
+        return scheduled
+
+    async def _load_located(self, template_file_path: str) -> tuple[str, dict]:
+        return template_file_path, await self.load(template_file_path)
 
 
 def _get_naming_prefix(resource_name: str) -> str:
@@ -0,0 +1,347 @@
+import argparse
+import os
+import re
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Union
+
+from cfn.references import SUB_PLACEHOLDER, resource_references
+from cfn.traversal import as_function, iter_nodes, rebuild
+from cfn.yaml_extensions import CloudFormationObject, dump_cfn
+
+# CloudFormation quotas
+MAX_RESOURCES = 500
+MAX_OUTPUTS = 200
+# templates uploaded to S3, direct template bodies are limited to 51,200 bytes
+MAX_TEMPLATE_SIZE = 1_000_000
+
+# The resource size is estimated from the length of its keys and scalars, the estimate is scaled
+# by this factor to cover YAML indentation and quoting.
+_SIZE_ESTIMATE_FACTOR = 1.5
+
+_shared_sections = ['AWSTemplateFormatVersion', 'Description', 'Transform', 'Parameters', 'Mappings',
+                    'Conditions', 'Globals']
+
+
+def hook_command(parser, subparsers):
+    def cmd(args):
+        from commands.flatten import flatten_cloudformation_template
+        template = flatten_cloudformation_template(args.template,
+                                                   evaluate_macros=args.macros,
+                                                   fold_constants=args.fold_constants)
+        export_prefix = args.export_prefix or os.path.basename(os.path.dirname(os.path.abspath(args.template)))
+        parts = partition_template(template,
+                                   export_prefix=export_prefix,
+                                   max_resources=args.max_resources,
+                                   max_template_size=args.max_template_size)
+        for file_path in write_partitions(parts, args.output_dir):
+            print(file_path)
+
+    parser_partition = subparsers.add_parser('partition', help='partition help')
+    parser_partition.add_argument('template', type=str, help='template file')
+    parser_partition.add_argument('output_dir', type=str, help='directory the partitions are written to')
+    parser_partition.set_defaults(func=cmd)
+
+    parser_partition.add_argument('--macros',
+                                  action=argparse.BooleanOptionalAction,
+                                  help='evaluate macros')
+    parser_partition.add_argument('--fold-constants',
+                                  action=argparse.BooleanOptionalAction,
+                                  default=False,
+                                  help='substitute nested stack parameters and fold static intrinsic functions')
+    parser_partition.add_argument('--export-prefix',
+                                  type=str,
+                                  help='prefix of names of exports between partitions, '
+                                       'defaults to the name of the template directory')
+    parser_partition.add_argument('--max-resources',
+                                  type=int,
+                                  default=MAX_RESOURCES,
+                                  help='maximum number of resources per partition')
+    parser_partition.add_argument('--max-template-size',
+                                  type=int,
+                                  default=MAX_TEMPLATE_SIZE,
+                                  help='maximum size of a partition in bytes')
+
+
+def partition_template(template: dict,
+                       export_prefix: str,
+                       max_resources: int = MAX_RESOURCES,
+                       max_template_size: int = MAX_TEMPLATE_SIZE) -> list[dict]:
+    """
+    Split a (flattened) template into the fewest templates that fit into the CloudFormation limits.
+
+    Connected components of the resource dependency graph are never split unless they do not fit
+    into a single template on their own, so cross-stack references are only needed for large
+    components. Those are cut along their topological order. Partitions are returned in deployment
+    order: a partition imports values exported by the preceding ones only.
+    """
+    resources = template.get('Resources') or {}
+    dependencies = {name: resource_references(resource_def, resources) for name, resource_def in resources.items()}
+
+    shared_size = _estimate_size({section: template[section] for section in _shared_sections if section in template})
+    capacity = max_template_size - shared_size
+    sizes = {name: _estimate_size({name: resource_def}) for name, resource_def in resources.items()}
+
+    units = []
+    for component in _components(resources, dependencies):
+        units.extend(_split_component(component, dependencies, sizes, max_resources, capacity))
+
+    assignment = _pack(units, dependencies, sizes, max_resources, capacity)
+    return _build_partitions(template, assignment, dependencies, export_prefix)
+
+
+def write_partitions(parts: list[dict], output_dir: str, executor: Executor = None) -> list[str]:
+    """
+    Write partitions to output_dir in parallel and return their paths in deployment order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    file_paths = [os.path.join(output_dir, f'part-{index:03d}.yaml') for index in range(len(parts))]
+
+    def write(file_path, part):
+        with open(file_path, 'w') as f:
+            f.write(dump_cfn(part, aliases=False))
+        return file_path
+
+    if executor is None:
+        with ThreadPoolExecutor() as own_executor:
+            return list(own_executor.map(write, file_paths, parts))
+    return list(executor.map(write, file_paths, parts))
+
+
+def _estimate_size(obj) -> int:
+    size = 0
+    for node in iter_nodes(obj):
+        if isinstance(node, CloudFormationObject):
+            size += len(node.tag) + 1
+        elif isinstance(node, dict):
+            size += 2 * len(node) + sum(len(str(key)) for key in node)
+        elif isinstance(node, list):
+            size += 2 * len(node)
+        else:
+            size += len(str(node)) + 1
+    return int(size * _SIZE_ESTIMATE_FACTOR)
+
+
+def _components(resources: dict, dependencies: dict) -> list[list]:
+    parents = {name: name for name in resources}
+
+    def find(name):
+        while parents[name] != name:
+            parents[name] = parents[parents[name]]
+            name = parents[name]
+        return name
+
+    for name, names in dependencies.items():
+        for dependency in names:
+            parents[find(name)] = find(dependency)
+
+    components = {}
+    for name in resources:
+        components.setdefault(find(name), []).append(name)
+    return list(components.values())
+
+
+def _topological_order(names: list, dependencies: dict) -> list:
+    # depth-first post-order keeps dependent resources next to each other
+    order, visited = [], set()
+    for root in names:
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, iter(sorted(dependencies[root])))]
+        while stack:
+            name, pending = stack[-1]
+            dependency = next((d for d in pending if d not in visited), None)
+            if dependency is None:
+                stack.pop()
+                order.append(name)
+            else:
+                visited.add(dependency)
+                stack.append((dependency, iter(sorted(dependencies[dependency]))))
+    return order
+
+
+def _split_component(component: list, dependencies: dict, sizes: dict, max_resources: int, capacity: int) -> list:
+    if len(component) <= max_resources and sum(sizes[name] for name in component) <= capacity:
+        return [component]
+
+    units, unit, unit_size = [], [], 0
+    for name in _topological_order(component, dependencies):
+        if sizes[name] > capacity:
+            raise ValueError(f'Resource {name} does not fit into a template of {capacity} bytes')
+        if len(unit) == max_resources or unit_size + sizes[name] > capacity:
+            units.append(unit)
+            unit, unit_size = [], 0
+        unit.append(name)
+        unit_size += sizes[name]
+    units.append(unit)
+    return units
+
+
+def _pack(units: list, dependencies: dict, sizes: dict, max_resources: int, capacity: int) -> dict:
+    """
+    First-fit packing of units into partitions. Units of a split component come in topological
+    order, and a unit is never placed before a partition it depends on.
+    """
+    assignment = {}
+    partitions = []
+
+    # large units first, but keep the order of units of the same component
+    order = sorted(range(len(units)), key=lambda index: -sum(sizes[name] for name in units[index]))
+    order = _respect_dependencies(order, units, dependencies)
+
+    for index in order:
+        unit = units[index]
+        unit_size = sum(sizes[name] for name in unit)
+        first = max((assignment[d] for name in unit for d in dependencies[name] if d in assignment), default=0)
+
+        for partition_index in range(first, len(partitions)):
+            count, size = partitions[partition_index]
+            if count + len(unit) <= max_resources and size + unit_size <= capacity:
+                break
+        else:
+            partition_index = len(partitions)
+            partitions.append((0, 0))
+
+        count, size = partitions[partition_index]
+        partitions[partition_index] = (count + len(unit), size + unit_size)
+        for name in unit:
+            assignment[name] = partition_index
+
+    return assignment
+
+
+def _respect_dependencies(order: list, units: list, dependencies: dict) -> list:
+    unit_of = {name: index for index, unit in enumerate(units) for name in unit}
+    result, placed = [], set()
+
+    for index in order:
+        stack = [index]
+        while stack:
+            current = stack[-1]
+            pending = [unit_of[d] for name in units[current] for d in dependencies[name]
+                       if unit_of[d] not in placed and unit_of[d] != current and unit_of[d] not in stack]
+            if pending:
+                stack.append(pending[0])
+            else:
+                stack.pop()
+                if current not in placed:
+                    placed.add(current)
+                    result.append(current)
+
+    return result
+
+
+def _build_partitions(template: dict, assignment: dict, dependencies: dict, export_prefix: str) -> list[dict]:
+    count = max(assignment.values(), default=0) + 1
+    parts = [{section: template[section] for section in _shared_sections if section in template}
+             for _ in range(count)]
+    for part in parts:
+        part['Resources'] = {}
+
+    exports = [{} for _ in range(count)]
+
+    def import_value(name: str, attribute: Union[str, None]):
+        output_name = _output_name(name, attribute)
+        export_name = f'{export_prefix}-{output_name}'
+        exports[assignment[name]][output_name] = (name, attribute, export_name)
+        return _function('Fn::ImportValue', export_name)
+
+    resource_imports = {}
+    for name, resource_def in (template.get('Resources') or {}).items():
+        index = assignment[name]
+        remote = {d for d in dependencies[name] if assignment[d] != index}
+        parts[index]['Resources'][name] = _retarget(resource_def, remote, import_value) if remote else resource_def
+        resource_imports[name] = index
+
+    import_metadata = (template.get('Metadata') or {}).get('ResourcesForImport')
+    unresolved_metadata = (template.get('Metadata') or {}).get('UnresolvedResourcesForImport')
+    for index, part in enumerate(parts):
+        metadata = {key: value for key, value in (template.get('Metadata') or {}).items()
+                    if key not in ('ResourcesForImport', 'UnresolvedResourcesForImport')}
+        if import_metadata is not None:
+            metadata['ResourcesForImport'] = [item for item in import_metadata
+                                              if resource_imports.get(item.get('LogicalId')) == index]
+        if unresolved_metadata:
+            unresolved = [name for name in unresolved_metadata if resource_imports.get(name) == index]
+            if unresolved:
+                metadata['UnresolvedResourcesForImport'] = unresolved
+        if metadata:
+            part['Metadata'] = metadata
+
+    if template.get('Outputs'):
+        resources = template.get('Resources') or {}
+        last = count - 1
+        outputs = {}
+        for output_name, output_def in template['Outputs'].items():
+            remote = {d for d in resource_references(output_def, resources) if assignment[d] != last}
+            outputs[output_name] = _retarget(output_def, remote, import_value) if remote else output_def
+        parts[last]['Outputs'] = outputs
+
+    for index, part_exports in enumerate(exports):
+        if not part_exports:
+            continue
+        outputs = parts[index].setdefault('Outputs', {})
+        for output_name, (name, attribute, export_name) in part_exports.items():
+            value = _function('Ref', name) if attribute is None else _function('Fn::GetAtt', f'{name}.{attribute}')
+            outputs[output_name] = {'Value': value, 'Export': {'Name': export_name}}
+        if len(outputs) > MAX_OUTPUTS:
+            raise ValueError(f'Partition {index} needs {len(outputs)} outputs, at most {MAX_OUTPUTS} are allowed')
+
+    return parts
+
+
+def _retarget(obj, remote: set, import_value):
+    """
+    Return a copy of obj in which references to remote resources are replaced by imports.
+    """
+
+    def rewrite(name: str, data):
+        match name:
+            case 'Ref' if isinstance(data, str) and data.split('.', 1)[0] in remote:
+                target, *attribute = data.split('.', 1)
+                return import_value(target, attribute[0] if attribute else None)
+            case 'Fn::GetAtt':
+                target, attribute = data.split('.', 1) if isinstance(data, str) else (data[0], '.'.join(data[1:]))
+                if target in remote:
+                    return import_value(target, attribute)
+            case 'Fn::Sub':
+                expression = data[0] if isinstance(data, list) else data
+                variables = dict(data[1]) if isinstance(data, list) and len(data) > 1 else {}
+
+                def substitute(m):
+                    target, *attribute = m.group(1).split('.', 1)
+                    if m.group(1) in variables or target not in remote:
+                        # literals, ${!...}, are never remote
+                        return m.group(0)
+                    variable = _output_name(target, attribute[0] if attribute else None)
+                    variables[variable] = import_value(target, attribute[0] if attribute else None)
+                    return '${' + variable + '}'
+
+                expression = SUB_PLACEHOLDER.sub(substitute, expression)
+                return _function('Fn::Sub', [expression, variables] if variables else expression)
+        return None
+
+    def leave(node, copy):
+        function = as_function(copy)
+        if function is not None:
+            return rewrite(*function) or copy
+        return copy
+
+    result = rebuild(obj, leave=leave)
+    if isinstance(result, dict) and 'DependsOn' in result:
+        depends_on = result['DependsOn']
+        depends_on = [d for d in ([depends_on] if isinstance(depends_on, str) else depends_on) if d not in remote]
+        if depends_on:
+            result['DependsOn'] = depends_on
+        else:
+            del result['DependsOn']
+    return result
+
+
+def _output_name(name: str, attribute: Union[str, None]) -> str:
+    return re.sub(r'[^A-Za-z0-9]', '', name + (attribute or ''))
+
+
+def _function(name: str, data):
+    from cfn import yaml_extensions
+    return getattr(yaml_extensions, name.split('::')[-1])(data)
@@ -1,8 +1,8 @@
 import argparse
-import copy
 import os
 
 from cfn.macros import rel_dir_path
+from cfn.traversal import rebuild
 
 
 def hook_command(parser, subparsers):
@@ -30,7 +30,7 @@ def _process_template(template_path: str, evaluate_macros: bool = False) -> dict
 
 
 def _mark_resources_as_retained(template: dict) -> dict:
-    template_copy = copy.deepcopy(template)
+    template_copy = rebuild(template)
 
     for resource_name, resource_def in template_copy.get('Resources', {}).items():
         if _is_stateful_resource(resource_def):
@@ -43,8 +43,7 @@ def _load_template(template_file_path: str, evaluate_macros: bool = False) -> di
     from cfn.yaml_extensions import load_cfn
 
     with rel_dir_path(os.path.dirname(template_file_path)):
-        with open(template_file_path, 'r') as template_file:
-            template_def = load_cfn(template_file, evaluate_macros=evaluate_macros)
+        template_def = load_cfn(template_file_path, evaluate_macros=evaluate_macros)
 
     return template_def
 
@@ -0,0 +1,366 @@
+import argparse
+import contextlib
+import multiprocessing
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple, Union
+
+DEFAULT_TEMPLATE_FILE_NAME = 'template.yaml'
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+# Parsed templates take roughly this many times more memory than their source.
+_TEMPLATE_MEMORY_FACTOR = 10
+
+
+class ScanResult(NamedTuple):
+    template_path: str
+    resources: int = 0
+    output_path: Union[str, None] = None
+    issues: tuple = ()
+    error: Union[str, None] = None
+
+
+def hook_command(parser, subparsers):
+    def cmd(args):
+        results = scan_templates(args.root,
+                                 template_file_name=args.template_file_name,
+                                 output_dir=args.output_dir,
+                                 evaluate_macros=args.macros,
+                                 fold_constants=args.fold_constants,
+                                 validate=args.validate,
+                                 max_workers=args.workers,
+                                 parse_processes=args.parse_processes,
+                                 cache_size=args.cache_size * 1024 * 1024)
+
+        failed = False
+        for result in results:
+            if result.error is not None:
+                failed = True
+                print(f'{result.template_path}: {result.error}', file=sys.stderr)
+                continue
+
+            print(f'{result.template_path}: {result.resources} resources'
+                  + (f' -> {result.output_path}' if result.output_path else ''))
+            for issue in result.issues:
+                failed = True
+                print(f'{result.template_path}: {issue}', file=sys.stderr)
+
+        if failed:
+            sys.exit(1)
+
+    parser_scan = subparsers.add_parser('scan', help='scan help')
+    parser_scan.add_argument('root', type=str, help='directory to scan for templates')
+    parser_scan.set_defaults(func=cmd)
+
+    parser_scan.add_argument('--template-file-name',
+                             type=str,
+                             default=DEFAULT_TEMPLATE_FILE_NAME,
+                             help='file name of templates')
+    parser_scan.add_argument('--output-dir',
+                             type=str,
+                             help='write flattened root templates to this directory')
+    parser_scan.add_argument('--macros',
+                             action=argparse.BooleanOptionalAction,
+                             help='evaluate macros')
+    parser_scan.add_argument('--fold-constants',
+                             action=argparse.BooleanOptionalAction,
+                             default=False,
+                             help='substitute nested stack parameters and fold static intrinsic functions')
+    parser_scan.add_argument('--validate',
+                             action=argparse.BooleanOptionalAction,
+                             default=False,
+                             help='check the flattened templates for dangling references')
+    parser_scan.add_argument('--workers',
+                             type=int,
+                             default=None,
+                             help='number of worker threads')
+    parser_scan.add_argument('--parse-processes',
+                             type=int,
+                             default=None,
+                             help='number of processes parsing templates, one per CPU by default, '
+                                  '0 parses them in the worker threads')
+    parser_scan.add_argument('--cache-size',
+                             type=int,
+                             default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                             help='memory budget of the template cache in MiB')
+
+
+class TemplateCache(object):
+    """
+    Thread-safe, memory-bounded cache of parsed templates shared by all workers of a scan.
+
+    A template requested by several workers at once is parsed only once. Templates are keyed by
+    content, so identical copies are parsed once and a template changed on disk is parsed again;
+    macros include files relative to the template, so with macros the path is part of the key.
+    Templates are weighted by an estimate of their memory footprint and the least recently used
+    ones are evicted when the budget is exceeded. Templates are parsed in the executor when given
+    (see commands.flatten.load_template), or else in the requesting thread.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE, executor: Executor = None):
+        self.max_size = max_size
+        self.executor = executor
+        self.size = 0
+        self.parsed = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template_file_path: str, evaluate_macros: bool = False) -> dict:
+        from cfn.file_io import content_digest
+        from commands.flatten import load_template
+
+        key = (content_digest(template_file_path), evaluate_macros,
+               os.path.abspath(template_file_path) if evaluate_macros else None)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                future = entry[0]
+            else:
+                future = Future()
+                self._entries[key] = (future, 0)
+
+        if entry is not None:
+            return future.result()
+
+        try:
+            template = load_template(template_file_path, evaluate_macros=evaluate_macros, executor=self.executor)
+        except BaseException as e:
+            with self._lock:
+                self._entries.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        weight = os.path.getsize(template_file_path) * _TEMPLATE_MEMORY_FACTOR
+        with self._lock:
+            self.parsed += 1
+            if key in self._entries:
+                self._entries[key] = (future, weight)
+                self.size += weight
+                self._evict()
+        future.set_result(template)
+        return template
+
+    def _evict(self):
+        while self.size > self.max_size and len(self._entries) > 1:
+            key, (future, weight) = next(iter(self._entries.items()))
+            if weight == 0 and not future.done():
+                # still being parsed
+                self._entries.move_to_end(key)
+                continue
+            del self._entries[key]
+            self.size -= weight
+
+
+def discover_templates(root: str, template_file_name: str = DEFAULT_TEMPLATE_FILE_NAME) -> list[str]:
+    found = []
+    for dir_path, dir_names, file_names in os.walk(os.path.abspath(root)):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+        if template_file_name in file_names:
+            found.append(os.path.join(dir_path, template_file_name))
+    return found
+
+
+def build_template_graph(template_paths: list[str],
+                         cache: TemplateCache,
+                         graph: dict[str, list[str]] = None) -> dict[str, list[str]]:
+    """
+    Return the nested stack locations of each template, including templates found only through
+    the locations. An existing graph is extended in place.
+
+    Locations are found by a scan of the template text, so templates are not parsed here, but
+    only by the workers. A template is parsed through the cache only if the scan finds fewer
+    locations than nested stacks.
+    """
+    graph = {} if graph is None else graph
+    pending = list(template_paths)
+    while pending:
+        template_path = pending.pop()
+        if template_path in graph:
+            continue
+
+        graph[template_path] = _nested_locations(template_path, cache)
+        pending.extend(graph[template_path])
+
+    return graph
+
+
+def _nested_locations(template_path: str, cache: TemplateCache) -> list[str]:
+    from commands.flatten import nested_template_locations
+
+    try:
+        return nested_template_locations(template_path, load=cache.get)
+    except OSError:
+        # reported by the templates nesting it
+        return []
+
+
+def scan_templates(root: str,
+                   template_file_name: str = DEFAULT_TEMPLATE_FILE_NAME,
+                   output_dir: str = None,
+                   evaluate_macros: bool = False,
+                   fold_constants: bool = False,
+                   validate: bool = False,
+                   max_workers: int = None,
+                   parse_processes: Union[int, None] = 0,
+                   cache_size: int = DEFAULT_CACHE_SIZE,
+                   cache: TemplateCache = None) -> list[ScanResult]:
+    """
+    Flatten every root template under root, a template no other template nests.
+
+    The graph of nested stack locations is split into connected components, which are processed
+    once each on a pool of worker threads. Within a component the templates are loaded in
+    topological order, nested ones first, through a cache shared by all workers, so a nested
+    template shared by several roots is parsed only once.
+
+    Parsing holds the GIL, so the worker threads only overlap I/O and flattening. With
+    parse_processes, templates are parsed in parallel on a pool of that many processes, one per CPU
+    for None, unless a cache is given, which parses them in its own executor.
+    """
+    with contextlib.ExitStack() as stack:
+        if cache is None:
+            executor = None
+            if parse_processes != 0:
+                # spawned, as forking the threads of the scan could inherit locks held by them
+                executor = stack.enter_context(ProcessPoolExecutor(parse_processes,
+                                                                   multiprocessing.get_context('spawn')))
+            cache = TemplateCache(cache_size, executor)
+
+        return _scan_templates(root, template_file_name, output_dir, evaluate_macros, fold_constants,
+                               validate, max_workers, cache)
+
+
+def _scan_templates(root: str,
+                    template_file_name: str,
+                    output_dir: Union[str, None],
+                    evaluate_macros: bool,
+                    fold_constants: bool,
+                    validate: bool,
+                    max_workers: Union[int, None],
+                    cache: TemplateCache) -> list[ScanResult]:
+    root = os.path.abspath(root)
+
+    results = []
+    graph = {}
+    for template_path in discover_templates(root, template_file_name):
+        try:
+            build_template_graph([template_path], cache, graph)
+        except Exception as e:
+            results.append(ScanResult(template_path, error=str(e)))
+            graph[template_path] = []
+
+    failed = {result.template_path for result in results}
+    components = [component for component in _components(graph) if not failed & set(component)]
+
+    def process(component: list[str]) -> list[ScanResult]:
+        return _process_component(component, graph, cache, root, output_dir,
+                                  evaluate_macros, fold_constants, validate)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for component_results in executor.map(process, components):
+            results.extend(component_results)
+
+    return sorted(results, key=lambda result: result.template_path)
+
+
+def _components(graph: dict) -> list[list[str]]:
+    neighbours = {template_path: set(nested) for template_path, nested in graph.items()}
+    for template_path, nested in graph.items():
+        for nested_path in nested:
+            neighbours.setdefault(nested_path, set()).add(template_path)
+
+    components, visited = [], set()
+    for template_path in sorted(neighbours):
+        if template_path in visited:
+            continue
+        visited.add(template_path)
+        component, stack = [], [template_path]
+        while stack:
+            current = stack.pop()
+            component.append(current)
+            for neighbour in neighbours[current]:
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    stack.append(neighbour)
+        components.append(component)
+
+    return components
+
+
+def _topological_order(component: list[str], graph: dict) -> list[str]:
+    # nested templates first
+    remaining = {template_path: len(set(graph.get(template_path, []))) for template_path in component}
+    parents = {}
+    for template_path in component:
+        for nested_path in set(graph.get(template_path, [])):
+            parents.setdefault(nested_path, []).append(template_path)
+
+    ready = sorted(template_path for template_path, count in remaining.items() if count == 0)
+    order = []
+    while ready:
+        template_path = ready.pop()
+        order.append(template_path)
+        for parent in parents.get(template_path, []):
+            remaining[parent] -= 1
+            if remaining[parent] == 0:
+                ready.append(parent)
+
+    if len(order) != len(component):
+        raise ValueError('Nested stack locations form a cycle: ' +
+                         ', '.join(sorted(set(component) - set(order))))
+    return order
+
+
+def _process_component(component: list[str],
+                       graph: dict,
+                       cache: TemplateCache,
+                       root: str,
+                       output_dir: Union[str, None],
+                       evaluate_macros: bool,
+                       fold_constants: bool,
+                       validate: bool) -> list[ScanResult]:
+    from commands.flatten import dump_yaml, flatten_loaded_template
+
+    try:
+        order = _topological_order(component, graph)
+    except ValueError as e:
+        return [ScanResult(template_path, error=str(e)) for template_path in sorted(component)]
+
+    nested = {nested_path for template_path in component for nested_path in graph.get(template_path, [])}
+    results = []
+    for template_path in order:
+        if template_path in nested:
+            try:
+                cache.get(template_path)
+            except Exception:
+                # reported by the templates nesting it
+                pass
+            continue
+
+        try:
+            template = flatten_loaded_template(template_path,
+                                               cache.get(template_path, evaluate_macros=evaluate_macros),
+                                               cache.get,
+                                               fold_constants=fold_constants)
+        except Exception as e:
+            results.append(ScanResult(template_path, error=str(e)))
+            continue
+
+        issues = ()
+        if validate:
+            from commands.validate import validate_template
+            issues = tuple(validate_template(template))
+
+        output_path = None
+        if output_dir is not None:
+            output_path = os.path.join(os.path.abspath(output_dir), os.path.relpath(template_path, root))
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'w') as f:
+                f.write(dump_yaml(template, aliases=False))
+
+        results.append(ScanResult(template_path, len(template['Resources']), output_path, issues))
+
+    return results
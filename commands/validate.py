@@ -0,0 +1,162 @@
+import argparse
+import sys
+from typing import NamedTuple
+
+from cfn.references import function_references
+from cfn.traversal import as_function, path_keys, walk
+
+PSEUDO_PARAMETERS = frozenset([
+    'AWS::AccountId',
+    'AWS::NotificationARNs',
+    'AWS::NoValue',
+    'AWS::Partition',
+    'AWS::Region',
+    'AWS::StackId',
+    'AWS::StackName',
+    'AWS::URLSuffix',
+])
+
+
+class ValidationIssue(NamedTuple):
+    path: str
+    function: str
+    target: str
+    message: str
+
+    def __str__(self):
+        return f'{self.path}: {self.function} {self.target}: {self.message}'
+
+
+def hook_command(parser, subparsers):
+    def cmd(args):
+        if args.flatten:
+            from commands.flatten import flatten_cloudformation_template
+            template = flatten_cloudformation_template(args.template, evaluate_macros=args.macros)
+        else:
+            from cfn.yaml_extensions import load_cfn
+            template = load_cfn(args.template, evaluate_macros=args.macros)
+
+        report_issues(validate_template(template))
+
+    parser_validate = subparsers.add_parser('validate', help='validate help')
+    parser_validate.add_argument('template', type=str, help='template file')
+    parser_validate.set_defaults(func=cmd)
+
+    parser_validate.add_argument('--macros',
+                                 action=argparse.BooleanOptionalAction,
+                                 help='evaluate macros')
+    parser_validate.add_argument('--flatten',
+                                 action=argparse.BooleanOptionalAction,
+                                 default=False,
+                                 help='flatten the template before validation')
+
+
+def report_issues(issues: list):
+    """
+    Print issues to stderr and exit with non-zero status when there are any.
+    """
+    if not issues:
+        return
+
+    for issue in issues:
+        print(issue, file=sys.stderr)
+    sys.exit(1)
+
+
+def validate_template(template: dict) -> list[ValidationIssue]:
+    """
+    Find every dangling or ambiguous reference of the template in a single pass.
+
+    Targets of Ref, Fn::GetAtt, Fn::Sub placeholders, DependsOn, conditions and Fn::FindInMap are
+    looked up in hash indexes of resources, parameters, pseudo-parameters, conditions and mappings.
+    """
+    return _Validator(template).validate()
+
+
+class _Validator(object):
+    def __init__(self, template: dict):
+        self.template = template
+        self.resources = _section_keys(template, 'Resources')
+        self.parameters = _section_keys(template, 'Parameters')
+        self.conditions = _section_keys(template, 'Conditions')
+        self.mappings = _section_keys(template, 'Mappings')
+        self.issues = []
+
+    def validate(self) -> list[ValidationIssue]:
+        for name in self.resources & self.parameters:
+            self._issue((name, ('Resources',)), 'Ref', name, 'logical ID is both a resource and a parameter')
+
+        for name, resource_def in (self.template.get('Resources') or {}).items():
+            if isinstance(resource_def, dict):
+                self._validate_resource_attributes((name, ('Resources',)), resource_def)
+
+        for name, output_def in (self.template.get('Outputs') or {}).items():
+            if isinstance(output_def, dict) and isinstance(output_def.get('Condition'), str):
+                self._validate_condition(('Condition', (name, ('Outputs',))), 'Condition', output_def['Condition'])
+
+        for section in ['Resources', 'Outputs', 'Conditions']:
+            if section in self.template:
+                self._walk(self.template[section], (section,))
+
+        return self.issues
+
+    def _validate_resource_attributes(self, path: tuple, resource_def: dict):
+        condition = resource_def.get('Condition')
+        if isinstance(condition, str):
+            self._validate_condition(('Condition', path), 'Condition', condition)
+
+        depends_on = resource_def.get('DependsOn', [])
+        for target in [depends_on] if isinstance(depends_on, str) else depends_on:
+            if isinstance(target, str) and target not in self.resources:
+                self._issue(('DependsOn', path), 'DependsOn', target, 'resource does not exist')
+
+    def _walk(self, obj, path: tuple):
+        # Paths are rendered only for reported issues, so the walk stays linear in the size of the
+        # template.
+        for node, node_path in walk(obj, path):
+            function = as_function(node)
+            if function is None and path == ('Conditions',) and isinstance(node, dict) and \
+                    len(node) == 1 and 'Condition' in node:
+                # {"Condition": ...} is a condition reference only inside of the Conditions section
+                function = 'Condition', node['Condition']
+            if function is not None:
+                self._validate_function(node_path, *function)
+
+    def _validate_function(self, path: tuple, name: str, data):
+        match name:
+            case 'Ref' | 'Fn::GetAtt' | 'Fn::Sub':
+                for target, attribute in function_references(name, data):
+                    if attribute is None:
+                        self._validate_ref(path, target, name)
+                    else:
+                        self._validate_get_att(path, name, target)
+            case 'Fn::If' if isinstance(data, list) and data and isinstance(data[0], str):
+                self._validate_condition(path, name, data[0])
+            case 'Fn::Condition' | 'Condition' if isinstance(data, str):
+                self._validate_condition(path, name, data)
+            case 'Fn::FindInMap' if isinstance(data, list) and data and isinstance(data[0], str):
+                if data[0] not in self.mappings:
+                    self._issue(path, name, data[0], 'mapping does not exist')
+
+    def _validate_ref(self, path: tuple, target: str, function: str = 'Ref'):
+        if target not in self.parameters and target not in self.resources and target not in PSEUDO_PARAMETERS:
+            self._issue(path, function, target, 'neither a parameter nor a resource')
+
+    def _validate_get_att(self, path: tuple, function: str, target: str):
+        if target not in self.resources:
+            self._issue(path, function, target, 'resource does not exist')
+
+    def _validate_condition(self, path: tuple, function: str, condition: str):
+        if condition not in self.conditions:
+            self._issue(path, function, condition, 'condition does not exist')
+
+    def _issue(self, path: tuple, function: str, target: str, message: str):
+        self.issues.append(ValidationIssue(_render_path(path), function, target, message))
+
+
+def _section_keys(template: dict, section: str) -> set:
+    return set(template.get(section) or {})
+
+
+def _render_path(path: tuple) -> str:
+    return '.'.join(str(key) for key in path_keys(path))
@@ -0,0 +1,121 @@
+"""
+Reference implementation of flatten for the tests: a plain recursive walk over deep copies of the
+templates, in the manner of the original implementation, kept apart from the optimized engine of
+commands.flatten. It shares nothing with that engine but the YAML loaders.
+"""
+import copy
+import os
+import re
+
+import yaml
+
+from cfn.macros import rel_dir_path
+from cfn.yaml_extensions import CfnLoader, CfnMacroLoader, CloudFormationObject
+
+_STACK_TYPES = ('AWS::CloudFormation::Stack', 'AWS::Serverless::Application')
+
+_placeholder = re.compile(r'\$\{([^}]*)}')
+
+
+def reference_flatten(template_path: str, evaluate_macros: bool = False) -> tuple[dict, set]:
+    """
+    Return the flattened template, without the import metadata, and the names of the flattened
+    resources whose condition is statically false once the parameter values given to nested
+    stacks, or their defaults, are substituted. Only conditions of the form
+    Fn::Equals [Ref Parameter, value] are evaluated.
+    """
+    template = _load(template_path, evaluate_macros)
+
+    resources, unreachable = {}, set()
+    _flatten(template_path, template, '', {}, {}, resources, unreachable)
+
+    flattened = copy.deepcopy(template)
+    flattened['Resources'] = resources
+    flattened['Metadata'] = flattened.get('Metadata') or {}
+    return flattened, unreachable
+
+
+def _load(template_path: str, evaluate_macros: bool) -> dict:
+    with rel_dir_path(os.path.dirname(template_path)), open(template_path, 'r') as f:
+        return yaml.load(f, Loader=CfnMacroLoader if evaluate_macros else CfnLoader)
+
+
+def _flatten(template_path, template, prefix, parameters, values, resources, unreachable):
+    conditions = template.get('Conditions') or {}
+
+    for name, resource_def in template.get('Resources', {}).items():
+        properties = resource_def.get('Properties', {})
+
+        if resource_def.get('Type') in _STACK_TYPES and properties.get('Location', '').endswith('.yaml'):
+            nested_path = os.path.abspath(os.path.join(os.path.dirname(template_path), properties['Location']))
+            if nested_path.endswith('.out.yaml'):
+                nested_path = nested_path[:-9] + '.yaml'
+            # macros are evaluated in the root template only
+            nested_template = _load(nested_path, False)
+
+            nested_parameters = properties.get('Parameters', {})
+            nested_values = {
+                parameter_name: parameter_def['Default']
+                for parameter_name, parameter_def in (nested_template.get('Parameters') or {}).items()
+                if 'Default' in parameter_def and parameter_name not in nested_parameters
+            }
+            for parameter_name, value in nested_parameters.items():
+                if isinstance(value, str):
+                    nested_values[parameter_name] = value
+                elif isinstance(value, CloudFormationObject) and value.name == 'Ref' and value.data in values:
+                    nested_values[parameter_name] = values[value.data]
+
+            _flatten(nested_path, nested_template, name, nested_parameters, nested_values, resources, unreachable)
+            continue
+
+        new_def = copy.deepcopy(resource_def)
+        new_def['Properties'] = _retarget(copy.deepcopy(properties), prefix, parameters)
+        resources[prefix + name] = new_def
+
+        condition = conditions.get(resource_def.get('Condition'))
+        if condition is not None and _condition_value(condition, values) is False:
+            unreachable.add(prefix + name)
+
+
+def _retarget(obj, prefix: str, parameters: dict):
+    if isinstance(obj, dict):
+        for key in obj:
+            obj[key] = _retarget(obj[key], prefix, parameters)
+    elif isinstance(obj, list):
+        for i in range(len(obj)):
+            obj[i] = _retarget(obj[i], prefix, parameters)
+    elif isinstance(obj, CloudFormationObject):
+        if obj.name == 'Ref':
+            if obj.data not in parameters and not obj.data.startswith('AWS::'):
+                obj.data = prefix + obj.data
+        elif obj.name == 'Fn::GetAtt':
+            if isinstance(obj.data, list):
+                obj.data = [prefix + obj.data[0]] + obj.data[1:]
+            else:
+                obj.data = prefix + obj.data
+        elif obj.name == 'Fn::Sub':
+            variables = obj.data[1] if isinstance(obj.data, list) and len(obj.data) > 1 else {}
+
+            def retarget_placeholder(m):
+                placeholder = m.group(1)
+                if placeholder.startswith('!') or ':' in placeholder or \
+                        placeholder.split('.')[0] in variables or placeholder.split('.')[0] in parameters:
+                    return m.group(0)
+                return '${' + prefix + placeholder + '}'
+
+            if isinstance(obj.data, list):
+                obj.data[0] = _placeholder.sub(retarget_placeholder, obj.data[0])
+                _retarget(variables, prefix, parameters)
+            else:
+                obj.data = _placeholder.sub(retarget_placeholder, obj.data)
+        else:
+            _retarget(obj.data, prefix, parameters)
+    return obj
+
+
+def _condition_value(condition, values: dict):
+    if isinstance(condition, CloudFormationObject) and condition.name == 'Fn::Equals':
+        left, right = condition.data
+        if isinstance(left, CloudFormationObject) and left.name == 'Ref' and left.data in values:
+            return values[left.data] == right
+    return None
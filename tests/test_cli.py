@@ -8,3 +8,30 @@ def test_run_retain():
     args = 'test retain fixtures/sam_stack_cf/template.yaml --macros'
     from app.cli import run
     run(*args.split(' '))
+
+
+def test_run_validate():
+    args = 'test validate fixtures/sam_stack_cf/template.yaml'
+    from app.cli import run
+    run(*args.split(' '))
+
+
+def test_run_flatten_memory_report(capsys):
+    args = 'test flatten fixtures/with_macros_01/template.yaml --macros --memory-report'
+    from app.cli import run
+    run(*args.split(' '))
+
+    captured = capsys.readouterr()
+    assert 'Resources:' in captured.out
+    assert 'Peak memory:' in captured.err
+    assert 'text.txt' in captured.err
+
+
+def test_run_flatten_include_type(capsys):
+    args = 'test flatten fixtures/sam_stack_cf/template.yaml --include-type AWS::DynamoDB::* --include-id Sub'
+    from app.cli import run
+    run(*args.split(' '))
+
+    captured = capsys.readouterr()
+    assert 'Table000001:' in captured.out
+    assert 'SubStack' in captured.out
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+test_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_share_subtrees():
+    from cfn.dedupe import share_subtrees
+    from cfn.yaml_extensions import CloudFormationObject
+
+    policy = {'Statement': [{'Effect': 'Allow', 'Action': ['s3:GetObject'], 'Resource': '*'}]}
+    content = '{"type": "object"}' * 10
+    template = {
+        'Resources': {
+            'A': {'Type': 'AWS::IAM::Policy', 'Properties': {'PolicyDocument': dict(policy), 'Content': content}},
+            'B': {'Type': 'AWS::IAM::Policy', 'Properties': {'PolicyDocument': dict(policy), 'Content': content[:]}},
+        },
+    }
+
+    got = share_subtrees(template, min_size=4)
+
+    assert got == template
+    a, b = got['Resources']['A']['Properties'], got['Resources']['B']['Properties']
+    assert a['PolicyDocument'] is b['PolicyDocument']
+    assert a['Content'] is b['Content']
+    assert not isinstance(got['Resources']['A'], CloudFormationObject)
+
+
+@pytest.mark.parametrize('template_file_path', [
+    'sam_stack_cf/template.yaml',
+    'complex_cf_01/template.yaml',
+])
+def test_dump_shared_subtrees(template_file_path):
+    template_path = os.path.abspath(os.path.join(test_fixtures, template_file_path))
+
+    from cfn.dedupe import share_subtrees
+    from cfn.yaml_extensions import dump_cfn, CfnLoader
+    from commands.flatten import flatten_cloudformation_template
+    import yaml
+
+    template = flatten_cloudformation_template(template_path, evaluate_macros=True)
+    shared = share_subtrees(template)
+
+    with_aliases = dump_cfn(shared, aliases=True)
+    without_aliases = dump_cfn(shared)
+
+    assert without_aliases == dump_cfn(template)
+    assert '&id' not in without_aliases
+    assert len(with_aliases) <= len(without_aliases)
+    assert yaml.load(with_aliases, Loader=CfnLoader) == template
+
+
+def test_flatten_dedupe(tmp_path):
+    (tmp_path / 'nested.yaml').write_text(
+        'Resources:\n'
+        '  Policy:\n'
+        '    Type: AWS::IAM::ManagedPolicy\n'
+        '    Properties:\n'
+        '      PolicyDocument:\n'
+        '        Statement:\n'
+        '          - Effect: Allow\n'
+        '            Action: [s3:GetObject, s3:PutObject, s3:DeleteObject]\n'
+        '            Resource: [arn:aws:s3:::bucket/a, arn:aws:s3:::bucket/b]\n'
+        '            Condition:\n'
+        '              StringEquals:\n'
+        '                aws:RequestedRegion: [eu-west-1, eu-central-1]\n')
+    (tmp_path / 'template.yaml').write_text(
+        'Resources:\n'
+        '  First:\n'
+        '    Type: AWS::CloudFormation::Stack\n'
+        '    Properties:\n'
+        '      Location: nested.yaml\n'
+        '  Second:\n'
+        '    Type: AWS::CloudFormation::Stack\n'
+        '    Properties:\n'
+        '      Location: nested.yaml\n')
+
+    from commands.flatten import flatten_cloudformation_template
+    from cfn.yaml_extensions import dump_cfn
+
+    template_path = str(tmp_path / 'template.yaml')
+    expected = flatten_cloudformation_template(template_path)
+    got = flatten_cloudformation_template(template_path, dedupe=True)
+
+    assert got == expected
+    assert got['Resources']['FirstPolicy']['Properties']['PolicyDocument'] is \
+           got['Resources']['SecondPolicy']['Properties']['PolicyDocument']
+    assert expected['Resources']['FirstPolicy']['Properties']['PolicyDocument'] is not \
+           expected['Resources']['SecondPolicy']['Properties']['PolicyDocument']
+    # the deployable output is the same, only the one with aliases shrinks
+    assert dump_cfn(got) == dump_cfn(expected)
+    assert len(dump_cfn(got, aliases=True)) < len(dump_cfn(expected))
@@ -0,0 +1,109 @@
+import copy
+import time
+
+import pytest
+import yaml
+
+_old_template = '''
+Parameters:
+  Stage:
+    Type: String
+Resources:
+  Bucket:
+    Type: AWS::S3::Bucket
+    Properties:
+      BucketName: !Sub "${Stage}-bucket"
+      Tags:
+        - Key: Team
+          Value: orders
+  Queue:
+    Type: AWS::SQS::Queue
+  Topic:
+    Type: AWS::SNS::Topic
+'''
+
+_new_template = '''
+Parameters:
+  Stage:
+    Type: String
+    Default: dev
+Resources:
+  Bucket:
+    Type: AWS::S3::Bucket
+    Properties:
+      BucketName: !Sub "${Stage}-data"
+      Tags:
+        - Key: Team
+          Value: invoices
+  Queue:
+    Type: AWS::SQS::Queue
+  Table:
+    Type: AWS::DynamoDB::Table
+'''
+
+
+def test_diff_templates():
+    from commands.diff import diff_templates, Change
+    from cfn.yaml_extensions import CfnLoader
+
+    diff = diff_templates(yaml.load(_old_template, Loader=CfnLoader), yaml.load(_new_template, Loader=CfnLoader))
+
+    assert diff.added == ['Table']
+    assert diff.removed == ['Topic']
+    assert diff.modified == {
+        'Bucket': [
+            Change('Properties.BucketName.Fn::Sub', '${Stage}-bucket', '${Stage}-data'),
+            Change('Properties.Tags.0.Value', 'orders', 'invoices'),
+        ],
+    }
+    assert diff.sections == [Change('Parameters.Stage.Default', new='dev')]
+
+
+def test_diff_templates_intrinsic_changed():
+    from commands.diff import diff_templates, Change
+    from cfn.yaml_extensions import CfnLoader
+
+    old = yaml.load('Resources:\n  A:\n    Type: T\n    Properties:\n      Name: !Ref B\n', Loader=CfnLoader)
+    new = yaml.load('Resources:\n  A:\n    Type: T\n    Properties:\n      Name: !GetAtt B.Arn\n', Loader=CfnLoader)
+
+    diff = diff_templates(old, new)
+
+    assert [(change.path, str(change.old), str(change.new)) for change in diff.modified['A']] == [
+        ('Properties.Name', '!Ref B', '!GetAtt B.Arn'),
+    ]
+
+
+def test_diff_templates_unchanged():
+    from commands.diff import diff_templates
+    from cfn.yaml_extensions import CfnLoader
+
+    template = yaml.load(_old_template, Loader=CfnLoader)
+
+    assert not diff_templates(template, copy.deepcopy(template))
+
+
+@pytest.mark.benchmark
+def test_diff_templates_scale():
+    from commands.diff import diff_templates
+    from cfn import yaml_extensions
+
+    template = {'Resources': {
+        f'Function{i}': {
+            'Type': 'AWS::Lambda::Function',
+            'Properties': {
+                'FunctionName': yaml_extensions.Sub(f'${{AWS::StackName}}-{i}'),
+                'Role': yaml_extensions.GetAtt(f'Role{i % 10}.Arn'),
+                'Environment': {'Variables': {'TABLE': yaml_extensions.Ref('Table'), 'INDEX': str(i)}},
+            },
+        }
+        for i in range(10000)
+    }}
+    changed = copy.deepcopy(template)
+    changed['Resources']['Function42']['Properties']['Environment']['Variables']['INDEX'] = 'changed'
+
+    start = time.perf_counter()
+    diff = diff_templates(template, changed)
+    elapsed = time.perf_counter() - start
+
+    assert list(diff.modified) == ['Function42']
+    assert elapsed < 1
@@ -0,0 +1,135 @@
+import datetime
+import os
+import time
+
+import pytest
+
+test_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _intrinsics() -> list:
+    from cfn import yaml_extensions
+
+    data = {
+        yaml_extensions.CloudFormationObject.SCALAR: 'Table.Arn',
+        yaml_extensions.CloudFormationObject.SEQUENCE: ['IsProd', {'Key': 'value'}, [1, 2.5, None]],
+        yaml_extensions.CloudFormationObject.SEQUENCE_OR_SCALAR: ['${Table}-${Name}', {'Name': 'x'}],
+    }
+    return [cls(data[cls.type]) for cls in yaml_extensions._object_classes]
+
+
+def test_encode_template_intrinsics():
+    from cfn import yaml_extensions
+    from cfn.encoding import decode_template, encode_template
+
+    intrinsics = _intrinsics()
+    tags = {obj.tag for obj in intrinsics}
+    assert {f'!{tag}' for _, tag, _ in yaml_extensions._functions} | {'!Ref'} <= tags
+
+    got = decode_template(encode_template(intrinsics))
+
+    assert got == intrinsics
+    assert [type(obj) for obj in got] == [type(obj) for obj in intrinsics]
+
+
+@pytest.mark.parametrize('obj', [
+    None,
+    'value',
+    0,
+    -1,
+    2 ** 100,
+    -2 ** 70,
+    1.5,
+    float('inf'),
+    True,
+    False,
+    b'\x00\xff',
+    datetime.date(2024, 2, 29),
+    datetime.datetime(2024, 2, 29, 12, 30, 5, 17),
+    [],
+    {},
+    {1: 'int key', 'nested': [{}, [], [[None]]], 'unicode': 'žluťoučký kůň', 'flag': False},
+])
+def test_encode_template_values(obj):
+    from cfn.encoding import decode_template, encode_template
+
+    got = decode_template(encode_template(obj))
+
+    assert got == obj
+    assert type(got) is type(obj)
+
+
+@pytest.mark.parametrize('template_file_path, evaluate_macros', [
+    ('sam_stack_cf/template.yaml', False),
+    ('complex_cf_01/template.yaml', False),
+    ('with_macros_01/template.yaml', True),
+    ('complex_cf_01/flattened.yaml', False),
+])
+def test_encode_template_fixtures(template_file_path, evaluate_macros):
+    from cfn.encoding import decode_template, encode_template
+    from cfn.yaml_extensions import dump_cfn, load_cfn
+
+    template = load_cfn(os.path.join(test_fixtures, template_file_path), evaluate_macros=evaluate_macros)
+
+    got = decode_template(encode_template(template))
+
+    assert got == template
+    assert dump_cfn(got, aliases=False) == dump_cfn(template, aliases=False)
+
+
+def test_encode_template_deep():
+    from cfn.encoding import decode_template, encode_template
+    from cfn.yaml_extensions import Ref
+
+    obj = leaf = {}
+    for _ in range(10000):
+        leaf['Next'] = [{'Ref': Ref('X')}]
+        leaf = leaf['Next'][0]
+
+    got = decode_template(encode_template(obj))
+
+    for _ in range(10000):
+        assert got['Next'][0]['Ref'] == Ref('X')
+        got = got['Next'][0]
+    assert got == {'Ref': Ref('X')}
+
+
+@pytest.mark.parametrize('data, message', [
+    (b'YAML', 'Not an encoded template'),
+    (b'CFNT\x02\x00\x00', 'Unsupported encoding version'),
+    (b'CFNT\x01\x01\x05!Nope\x08\x00\x00', 'Unknown tag !Nope'),
+    (b'CFNT\x01\x00\x00\x00', 'Unexpected data'),
+])
+def test_decode_template_invalid(data, message):
+    from cfn.encoding import decode_template
+
+    with pytest.raises(ValueError, match=message):
+        decode_template(data)
+
+
+def test_encode_template_unsupported():
+    from cfn.encoding import encode_template
+
+    with pytest.raises(TypeError):
+        encode_template({'Value': object()})
+
+
+@pytest.mark.benchmark
+def test_decode_template_faster_than_yaml():
+    from cfn.encoding import decode_template, encode_template
+    from cfn.yaml_extensions import load_cfn
+
+    template_path = os.path.join(test_fixtures, 'complex_cf_01/flattened.yaml')
+    template = load_cfn(template_path)
+    encoded = encode_template(template)
+
+    start = time.perf_counter()
+    load_cfn(template_path)
+    parse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decode_template(encoded)
+    decode_time = time.perf_counter() - start
+
+    assert decode_time * 5 < parse_time
+    assert len(encoded) < os.path.getsize(template_path)
@@ -0,0 +1,203 @@
+import os
+
+import pytest
+
+test_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _evaluator():
+    from cfn.evaluate import Evaluator
+    from cfn.yaml_extensions import Ref, Equals, Condition, Not
+
+    return Evaluator(
+        parameters={'Stage': 'prod', 'Name': 'orders', 'Table': Ref('ParentTable')},
+        conditions={
+            'IsProd': Equals([Ref('Stage'), 'prod']),
+            'IsDev': Not([Condition('IsProd')]),
+            'IsRegional': Equals([Ref('AWS::Region'), 'eu-west-1']),
+        },
+        mappings={'Sizes': {'prod': {'Memory': 1024}}},
+    )
+
+
+def test_evaluate():
+    from cfn.yaml_extensions import Ref, Join, Sub, If, Select, FindInMap, GetAtt
+
+    evaluator = _evaluator()
+    got = evaluator.evaluate({
+        'Join': Join(['-', [Ref('Name'), Ref('Stage'), 1]]),
+        'PartialJoin': Join(['-', [Ref('Name'), Ref('AWS::Region')]]),
+        'Sub': Sub('${Name}-${Stage}-${!Literal}'),
+        'PartialSub': Sub('${Name}-${Table}-${AWS::Region}'),
+        'SubVariables': Sub(['${Prefix}-${Name}', {'Prefix': Join(['', ['a', 'b']])}]),
+        'If': If(['IsProd', 'yes', 'no']),
+        'Dropped': If(['IsDev', 'yes', Ref('AWS::NoValue')]),
+        'UnknownIf': If(['IsRegional', 'yes', Ref('AWS::NoValue')]),
+        'Select': Select(['1', ['a', Ref('Stage')]]),
+        'FindInMap': FindInMap(['Sizes', Ref('Stage'), 'Memory']),
+        'List': [Ref('Table'), If(['IsDev', 'x', Ref('AWS::NoValue')]), GetAtt('Resource.Arn')],
+        'JsonJoin': {'Fn::Join': ['', [{'Ref': 'Name'}, '!']]},
+    })
+
+    assert got == {
+        'Join': 'orders-prod-1',
+        'PartialJoin': Join(['-', ['orders', Ref('AWS::Region')]]),
+        'Sub': 'orders-prod-${Literal}',
+        'PartialSub': Sub(['orders-${Table}-${AWS::Region}', {'Table': Ref('ParentTable')}]),
+        'SubVariables': 'ab-orders',
+        'If': 'yes',
+        'UnknownIf': If(['IsRegional', 'yes', Ref('AWS::NoValue')]),
+        'Select': 'prod',
+        'FindInMap': 1024,
+        'List': [Ref('ParentTable'), GetAtt('Resource.Arn')],
+        'JsonJoin': 'orders!',
+    }
+
+    assert evaluator.condition('IsProd') is True
+    assert evaluator.condition('IsDev') is False
+    assert evaluator.condition('IsRegional') is None
+    assert evaluator.condition('Missing') is None
+
+
+def test_evaluator_memoized():
+    from cfn.evaluate import evaluator_for
+    from cfn.yaml_extensions import Ref, Join
+
+    evaluator = evaluator_for({'Name': 'orders'})
+    assert evaluator_for({'Name': 'orders'}) is evaluator
+    assert evaluator_for({'Name': 'invoices'}) is not evaluator
+
+    expr = Join(['-', [Ref('Name'), 'table']])
+    first = evaluator.evaluate({'A': expr})
+    assert len(evaluator._memo) > 0
+    memo_size = len(evaluator._memo)
+    assert evaluator.evaluate({'B': Join(['-', [Ref('Name'), 'table']])}) == {'B': first['A']}
+    assert len(evaluator._memo) == memo_size
+
+
+@pytest.mark.parametrize('template_file_path', [
+    'sam_stack_cf/template.yaml',
+    'complex_cf_01/template.yaml',
+])
+def test_flatten_fold_constants(template_file_path):
+    template_path = os.path.abspath(os.path.join(test_fixtures, template_file_path))
+
+    from commands.flatten import flatten_cloudformation_template
+    from commands.validate import validate_template
+    got = flatten_cloudformation_template(template_path, evaluate_macros=True, fold_constants=True)
+
+    assert validate_template(got) == []
+
+
+def test_flatten_fold_conditions():
+    template_path = os.path.abspath(os.path.join(test_fixtures, 'conditional_cf/template.yaml'))
+
+    from commands.flatten import flatten_cloudformation_template
+    from cfn.yaml_extensions import Ref, Sub
+    got = flatten_cloudformation_template(template_path, fold_constants=True)
+
+    assert sorted(got['Resources']) == ['Bucket', 'NestedLogs', 'NestedTable']
+    assert got['Resources']['NestedTable'] == {
+        'Type': 'AWS::DynamoDB::Table',
+        'Properties': {
+            'TableName': Sub('orders-${Stage}-table'),
+            'ProvisionedThroughput': {'ReadCapacityUnits': 10},
+            'Tags': [{'Key': 'Bucket', 'Value': Ref('Bucket')}],
+        },
+    }
+
+
+def test_flatten_fold_list_parameters(tmp_path):
+    (tmp_path / 'nested.yaml').write_text(
+        'Parameters:\n'
+        '  Subnets: {Type: CommaDelimitedList, Default: "subnet-a,subnet-b"}\n'
+        '  Zones: {Type: "List<AWS::EC2::AvailabilityZone::Name>"}\n'
+        'Resources:\n'
+        '  Cluster:\n'
+        '    Type: AWS::ElastiCache::SubnetGroup\n'
+        '    Properties:\n'
+        '      SubnetIds: !Ref Subnets\n'
+        '      Zones: !Ref Zones\n'
+        '      First: !Select [0, !Ref Subnets]\n'
+        '      Description: !Sub "in ${Subnets}"\n')
+    (tmp_path / 'template.yaml').write_text(
+        'Resources:\n'
+        '  Cache:\n'
+        '    Type: AWS::CloudFormation::Stack\n'
+        '    Properties:\n'
+        '      Location: nested.yaml\n'
+        '      Parameters:\n'
+        '        Zones: eu-west-1a,eu-west-1b\n')
+
+    from commands.flatten import flatten_cloudformation_template
+    from cfn.yaml_extensions import Sub
+    got = flatten_cloudformation_template(str(tmp_path / 'template.yaml'), fold_constants=True)
+
+    assert got['Resources']['CacheCluster']['Properties'] == {
+        'SubnetIds': ['subnet-a', 'subnet-b'],
+        'Zones': ['eu-west-1a', 'eu-west-1b'],
+        'First': 'subnet-a',
+        'Description': Sub('in ${Subnets}'),
+    }
+
+
+def test_evaluator_for_threads(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import OrderedDict
+    from cfn import evaluate
+    from cfn.evaluate import evaluator_for
+    from cfn.yaml_extensions import Equals, Ref
+
+    monkeypatch.setattr(evaluate, '_evaluators', OrderedDict())
+    monkeypatch.setattr(evaluate, '_evaluators_max_size', 4)
+
+    def condition(i: int):
+        evaluator = evaluator_for({'Stage': f'stage-{i % 8}'}, {'IsProd': Equals([Ref('Stage'), 'stage-0'])})
+        return evaluator.condition('IsProd')
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        got = list(executor.map(condition, range(2000)))
+
+    assert got == [i % 8 == 0 for i in range(2000)]
+    assert len(evaluate._evaluators) == 4
+
+
+def test_evaluate_json_condition_references():
+    from cfn.evaluate import Evaluator
+    from cfn.yaml_extensions import If
+
+    evaluator = Evaluator(
+        parameters={'Stage': 'prod'},
+        conditions={
+            'IsProd': {'Fn::Equals': [{'Ref': 'Stage'}, 'prod']},
+            'IsDev': {'Fn::Not': [{'Condition': 'IsProd'}]},
+            'IsProdAlias': {'Condition': 'IsProd'},
+        },
+    )
+    statement = {'Effect': 'Allow', 'Condition': {'StringEquals': {'aws:RequestedRegion': 'eu-west-1'}}}
+
+    assert evaluator.condition('IsDev') is False
+    assert evaluator.condition('IsProdAlias') is True
+    assert evaluator.evaluate({
+        'Statement': [statement],
+        'Named': {'Condition': 'IsProd'},
+        'If': If(['IsUnknown', {'Fn::And': [{'Condition': 'IsProd'}, {'Condition': 'IsDev'}]}, 'x']),
+    }) == {
+        'Statement': [statement],
+        'Named': {'Condition': 'IsProd'},
+        'If': If(['IsUnknown', False, 'x']),
+    }
+
+
+def test_evaluator_memo_bounded(monkeypatch):
+    from cfn import evaluate
+    from cfn.evaluate import Evaluator
+    from cfn.yaml_extensions import Join, Ref
+
+    monkeypatch.setattr(evaluate, '_memo_max_size', 8)
+
+    evaluator = Evaluator(parameters={'Name': 'orders'})
+    got = [evaluator.evaluate(Join(['-', [Ref('Name'), str(i)]])) for i in range(100)]
+
+    assert got == [f'orders-{i}' for i in range(100)]
+    assert len(evaluator._memo) == 8
@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize('size', [
+    0,
+    1024,
+    4 * 1024 * 1024,
+])
+def test_read(tmp_path, size):
+    content = (b'Resources: {}\n' * (size // 14 + 1))[:size]
+    file_path = str(tmp_path / 'file.yaml')
+    with open(file_path, 'wb') as f:
+        f.write(content)
+
+    from cfn.file_io import content_digest, open_buffer, read_text
+
+    with open_buffer(file_path) as buffer:
+        assert buffer[:] == content
+    assert read_text(file_path) == content.decode('utf-8')
+    assert content_digest(file_path) == hashlib.sha256(content).hexdigest()
+
+
+def test_content_digest_changed_file(tmp_path):
+    file_path = str(tmp_path / 'file.yaml')
+    with open(file_path, 'w') as f:
+        f.write('Resources: {}\n')
+
+    from cfn.file_io import content_digest
+
+    digest = content_digest(file_path)
+    assert content_digest(os.path.relpath(file_path)) == digest
+
+    with open(file_path, 'w') as f:
+        f.write('Resources:\n  Queue: {}\n')
+    assert content_digest(file_path) != digest
+
+
+def test_load_cfn_memory_mapped(tmp_path, monkeypatch):
+    file_path = str(tmp_path / 'template.yaml')
+    with open(file_path, 'w') as f:
+        f.write('Resources:\n  Queue:\n    Properties:\n      QueueName: !Ref Name\n')
+
+    from cfn import file_io
+    from cfn.yaml_extensions import load_cfn
+
+    expected = load_cfn(file_path)
+    monkeypatch.setattr(file_io, 'MMAP_THRESHOLD', 0)
+    assert load_cfn(file_path) == expected
+
+
+@pytest.mark.parametrize('content, expected', [
+    (b'a\r\nb\r\n', 'a\nb\n'),
+    (b'a\rb\n\r\n', 'a\nb\n\n'),
+    (b'a\nb', 'a\nb'),
+])
+def test_read_text_universal_newlines(tmp_path, content, expected):
+    file_path = str(tmp_path / 'file.txt')
+    with open(file_path, 'wb') as f:
+        f.write(content)
+
+    from cfn.file_io import read_text
+    from cfn.macros import load_file
+
+    assert read_text(file_path) == expected
+    with open(file_path, 'r') as f:
+        assert load_file(file_path) == f.read()
+
+
+def test_load_file_absolute_path():
+    file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'fixtures', 'with_macros_01', 'text.txt'))
+
+    from cfn.macros import load_file
+    with open(file_path, 'r') as f:
+        assert load_file(file_path) == f.read()
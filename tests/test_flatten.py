@@ -5,35 +5,65 @@ import pytest
 test_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
 
 
+def _load_golden(file_path: str) -> dict:
+    # golden outputs are written by dump_yaml, test_golden_matches_reference checks them against
+    # the reference implementation
+    from cfn.yaml_extensions import load_cfn
+    return load_cfn(os.path.join(test_fixtures, file_path))
+
+
 @pytest.mark.parametrize('template_file_path, expected', [
     (
             'sam_stack_cf/template.yaml',
-            None,
+            'sam_stack_cf/flattened.yaml',
     ),
 ])
 def test_process_cloudformation_resources(template_file_path, expected):
-    from commands.flatten import _load_template
+    from commands.flatten import load_template
 
     template_path = os.path.abspath(os.path.join(test_fixtures, template_file_path))
-    template_def = _load_template(template_path)
+    template_def = load_template(template_path)
 
     from commands.flatten import process_cloudformation_resources
     got = process_cloudformation_resources('root', template_def, {
         'master_template_location': template_path,
     })
 
-    if expected is not None:
-        assert got == expected
+    expected = _load_golden(expected)
+    assert sorted(resource_name for resource_name, *_ in got) == list(expected['Resources'])
+    assert {resource_name: resource_def for resource_name, resource_def, *_ in got} == expected['Resources']
+
+
+@pytest.mark.parametrize('template_file_path, expected', [
+    (
+            'sam_stack_cf/template.yaml',
+            'sam_stack_cf/flattened.yaml',
+    ),
+    (
+            'complex_cf_01/template.yaml',
+            'complex_cf_01/flattened.yaml',
+    ),
+])
+def test_golden_matches_reference(template_file_path, expected):
+    template_path = os.path.abspath(os.path.join(test_fixtures, template_file_path))
+
+    from tests.reference import reference_flatten
+    got, _ = reference_flatten(template_path)
+
+    golden = _load_golden(expected)
+    golden['Metadata'].pop('ResourcesForImport')
+    golden['Metadata'].pop('UnresolvedResourcesForImport', None)
+    assert got == golden
 
 
 @pytest.mark.parametrize('template_file_path, expected', [
     (
             'sam_stack_cf/template.yaml',
-            None,
+            'sam_stack_cf/flattened.yaml',
     ),
     (
             'complex_cf_01/template.yaml',
-            None,
+            'complex_cf_01/flattened.yaml',
     ),
 ])
 def test_flatten_cloudformation_template(template_file_path, expected):
@@ -42,22 +72,232 @@ def test_flatten_cloudformation_template(template_file_path, expected):
     from commands.flatten import flatten_cloudformation_template
     got = flatten_cloudformation_template(template_path)
 
-    if expected is not None:
-        assert got == expected
+    assert got == _load_golden(expected)
 
 
 @pytest.mark.parametrize('template_file_path, expected', [
     (
             'sam_stack_cf/template.yaml',
-            None,
+            'sam_stack_cf/flattened.yaml',
     ),
 ])
 def test_dump_yaml(template_file_path, expected):
     template_path = os.path.abspath(os.path.join(test_fixtures, template_file_path))
 
-    from commands.flatten import _dump_yaml, flatten_cloudformation_template
+    from commands.flatten import dump_yaml, flatten_cloudformation_template
     processed = flatten_cloudformation_template(template_path)
-    got = _dump_yaml(processed)
+    got = dump_yaml(processed)
+
+    with open(os.path.join(test_fixtures, expected), 'r') as f:
+        assert got == f.read()
+
+
+@pytest.mark.parametrize('template_file_path', [
+    'sam_stack_cf/template.yaml',
+    'complex_cf_01/template.yaml',
+])
+@pytest.mark.parametrize('evaluate_macros', [True, False])
+def test_flatten_cloudformation_template_async(template_file_path, evaluate_macros):
+    import asyncio
+
+    template_path = os.path.abspath(os.path.join(test_fixtures, template_file_path))
+
+    from commands.flatten import flatten_cloudformation_template, flatten_cloudformation_template_async
+    expected = flatten_cloudformation_template(template_path, evaluate_macros=evaluate_macros)
+    got = asyncio.run(flatten_cloudformation_template_async(template_path,
+                                                            evaluate_macros=evaluate_macros,
+                                                            max_concurrency=2))
+
+    assert got == expected
+
+
+@pytest.mark.parametrize('evaluate_macros', [True, False])
+def test_flatten_cloudformation_template_async_process_executor(evaluate_macros):
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+
+    template_path = os.path.abspath(os.path.join(test_fixtures, 'sam_stack_cf/template.yaml'))
+
+    from commands.flatten import flatten_cloudformation_template, flatten_cloudformation_template_async
+    expected = flatten_cloudformation_template(template_path, evaluate_macros=evaluate_macros)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        got = asyncio.run(flatten_cloudformation_template_async(template_path,
+                                                                evaluate_macros=evaluate_macros,
+                                                                executor=executor))
+
+    assert got == expected
+
+
+def test_flatten_cloudformation_template_async_timeout():
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Event
+
+    template_path = os.path.abspath(os.path.join(test_fixtures, 'sam_stack_cf/template.yaml'))
+
+    from commands.flatten import flatten_cloudformation_template_async
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        blocker = Event()
+        executor.submit(blocker.wait)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                asyncio.run(flatten_cloudformation_template_async(template_path,
+                                                                  executor=executor,
+                                                                  timeout=0.05))
+        finally:
+            blocker.set()
+
+
+def _write_filter_tree(root):
+    (root / 'queues').mkdir()
+    (root / 'queues' / 'template.yaml').write_text(
+        'Resources:\n'
+        '  Queue:\n'
+        '    Type: AWS::SQS::Queue\n')
+    (root / 'tables').mkdir()
+    (root / 'tables' / 'template.yaml').write_text(
+        'Resources:\n'
+        '  Table: {Type: "AWS::DynamoDB::Table"}\n'
+        '  Stream:\n'
+        '    Type: AWS::Lambda::EventSourceMapping\n'
+        '    Properties:\n'
+        '      EventSourceArn: !GetAtt Table.StreamArn\n')
+    (root / 'template.yaml').write_text(
+        'Resources:\n'
+        '  Role:\n'
+        '    Type: AWS::IAM::Role\n'
+        '  Function:\n'
+        '    Type: AWS::Lambda::Function\n'
+        '    Properties:\n'
+        '      Role: !GetAtt Role.Arn\n'
+        '  Queues:\n'
+        '    Type: AWS::CloudFormation::Stack\n'
+        '    Properties:\n'
+        '      Location: queues/template.yaml\n'
+        '  Tables:\n'
+        '    Type: AWS::Serverless::Application\n'
+        '    Properties:\n'
+        '      Location: ./tables/template.yaml\n')
+    return str(root / 'template.yaml')
+
+
+@pytest.mark.parametrize('resource_filter, expected_resources, expected_loads', [
+    (dict(types=('AWS::DynamoDB::*',)), ['TablesTable'], ['template.yaml', 'tables/template.yaml']),
+    (dict(types=('AWS::Lambda::*',)), ['Function', 'TablesStream'], ['template.yaml', 'tables/template.yaml']),
+    (dict(types=('AWS::Lambda::*',), closure=True), ['Function', 'Role', 'TablesStream', 'TablesTable'],
+     ['template.yaml', 'tables/template.yaml']),
+    (dict(ids=('Queues',)), ['QueuesQueue'], ['template.yaml', 'queues/template.yaml']),
+    (dict(ids=('Role',)), ['Role'], ['template.yaml']),
+    (dict(types=('AWS::SNS::Topic',)), [], ['template.yaml']),
+])
+def test_flatten_cloudformation_template_resource_filter(tmp_path, monkeypatch,
+                                                         resource_filter, expected_resources, expected_loads):
+    from commands import flatten
+    from commands.flatten import ResourceFilter, flatten_cloudformation_template
+
+    template_path = _write_filter_tree(tmp_path)
+    loads = []
+    load_template = flatten.load_template
+
+    def counting_load_template(template_file_path, *args, **kwargs):
+        loads.append(os.path.relpath(template_file_path, tmp_path))
+        return load_template(template_file_path, *args, **kwargs)
+
+    monkeypatch.setattr(flatten, 'load_template', counting_load_template)
+
+    got = flatten_cloudformation_template(template_path, resource_filter=ResourceFilter(**resource_filter))
+
+    assert sorted(got['Resources']) == expected_resources
+    assert sorted(loads) == sorted(expected_loads)
+
+
+def test_flatten_cloudformation_template_resource_filter_matches_reference():
+    import asyncio
+
+    template_path = os.path.abspath(os.path.join(test_fixtures, 'complex_cf_01/template.yaml'))
+
+    from commands.flatten import ResourceFilter, flatten_cloudformation_template, \
+        flatten_cloudformation_template_async
+    expected = flatten_cloudformation_template(template_path)
+    resource_filter = ResourceFilter(types=('AWS::DynamoDB::Table', 'AWS::IAM::*'))
+    got = flatten_cloudformation_template(template_path, resource_filter=resource_filter)
+
+    assert got['Resources'] == {resource_name: resource_def
+                                for resource_name, resource_def in expected['Resources'].items()
+                                if resource_def['Type'] == 'AWS::DynamoDB::Table'
+                                or resource_def['Type'].startswith('AWS::IAM::')}
+    assert asyncio.run(flatten_cloudformation_template_async(template_path, resource_filter=resource_filter)) == got
+
+
+def test_dump_yaml_expands_shared_objects(tmp_path):
+    import asyncio
+    from commands.flatten import dump_yaml, flatten_cloudformation_template, \
+        flatten_cloudformation_template_async
+
+    (tmp_path / 'big.txt').write_text('text ' * 100)
+    (tmp_path / 'nested.yaml').write_text(
+        'Resources:\n'
+        '  Function:\n'
+        '    Type: AWS::Lambda::Function\n'
+        '    Properties:\n'
+        '      Code: {ZipFile: !IncludeString big.txt}\n'
+        '      Environment: {Variables: {A: a, B: b, C: c}}\n')
+    (tmp_path / 'template.yaml').write_text(
+        'Resources:\n'
+        '  One: {Type: AWS::CloudFormation::Stack, Properties: {Location: nested.yaml}}\n'
+        '  Two: {Type: AWS::CloudFormation::Stack, Properties: {Location: nested.yaml}}\n'
+        '  Bucket:\n'
+        '    Type: AWS::S3::Bucket\n'
+        '    Metadata: {First: !IncludeString big.txt, Second: !IncludeString big.txt}\n')
+    template_path = str(tmp_path / 'template.yaml')
+
+    expected = dump_yaml(flatten_cloudformation_template(template_path, evaluate_macros=True))
+    got = dump_yaml(asyncio.run(flatten_cloudformation_template_async(template_path, evaluate_macros=True)))
+
+    assert '&id' not in expected
+    assert got == expected
+
+
+@pytest.mark.parametrize('fold_constants', [False, True])
+def test_flatten_nested_parameter_defaults(tmp_path, fold_constants):
+    (tmp_path / 'nested.yaml').write_text(
+        'Parameters:\n'
+        '  Service:\n'
+        '    Type: String\n'
+        '  Stage:\n'
+        '    Type: String\n'
+        '  Delay:\n'
+        '    Type: Number\n'
+        '    Default: 5\n'
+        'Resources:\n'
+        '  Queue:\n'
+        '    Type: AWS::SQS::Queue\n'
+        '    Properties:\n'
+        '      QueueName: !Sub "${Service}-queue"\n'
+        '      Stage: !Ref Stage\n'
+        '      Delay: !Ref Delay\n')
+    (tmp_path / 'template.yaml').write_text(
+        'Parameters:\n'
+        '  Stage:\n'
+        '    Type: String\n'
+        'Resources:\n'
+        '  Cache:\n'
+        '    Type: AWS::CloudFormation::Stack\n'
+        '    Properties:\n'
+        '      Location: nested.yaml\n'
+        '      Parameters:\n'
+        '        Service: orders\n'
+        '        Stage: !Ref Stage\n')
+
+    from commands.flatten import flatten_cloudformation_template
+    from cfn.yaml_extensions import Ref, Sub
+    got = flatten_cloudformation_template(str(tmp_path / 'template.yaml'), fold_constants=fold_constants)
 
-    if expected is not None:
-        assert got == expected
+    if fold_constants:
+        expected = {'QueueName': 'orders-queue', 'Stage': Ref('Stage'), 'Delay': 5}
+    else:
+        # parameters given to the nested stack are kept as references, the others are retargeted
+        # like resources, as the nested defaults are substituted only when folding
+        expected = {'QueueName': Sub('${Service}-queue'), 'Stage': Ref('Stage'), 'Delay': Ref('CacheDelay')}
+    assert got['Resources']['CacheQueue']['Properties'] == expected
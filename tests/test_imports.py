@@ -0,0 +1,81 @@
+import json
+import os
+
+test_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _resource(resource_name, resource_type, properties, was_retargeted=True):
+    return resource_name, {'Type': resource_type, 'Properties': properties}, {}, {'was_retargeted': was_retargeted}
+
+
+def test_describe_imports():
+    from cfn.imports import describe_imports
+    from cfn.yaml_extensions import Ref
+
+    descriptors = describe_imports([
+        _resource('StackTable', 'AWS::DynamoDB::Table', {'TableName': 'orders'}),
+        _resource('StackFunction', 'AWS::Serverless::Function', {'FunctionName': 'handler'}),
+        _resource('StackDatabase', 'AWS::Glue::Database', {'DatabaseInput': {'Name': 'db'}}),
+        _resource('StackQueue', 'AWS::SQS::Queue', {'QueueName': 'queue'}),
+        _resource('StackBucket', 'AWS::S3::Bucket', {'BucketName': Ref('Name')}),
+        _resource('StackCustom', 'Custom::Thing', {'Name': 'custom'}),
+        _resource('RootTable', 'AWS::DynamoDB::Table', {'TableName': 'root'}, was_retargeted=False),
+    ])
+
+    assert descriptors.resources_to_import == [
+        {'ResourceType': 'AWS::DynamoDB::Table', 'LogicalResourceId': 'StackTable',
+         'ResourceIdentifier': {'TableName': 'orders'}},
+        {'ResourceType': 'AWS::Lambda::Function', 'LogicalResourceId': 'StackFunction',
+         'ResourceIdentifier': {'FunctionName': 'handler'}},
+        {'ResourceType': 'AWS::Glue::Database', 'LogicalResourceId': 'StackDatabase',
+         'ResourceIdentifier': {'DatabaseName': 'db'}},
+    ]
+    assert descriptors.unresolved == ['StackQueue', 'StackBucket']
+    assert [item['LogicalId'] for item in descriptors.resources_for_import] == [
+        'StackTable', 'StackFunction', 'StackDatabase']
+    assert descriptors.resources_for_import[1]['ResourceType'] == 'AWS::Serverless::Function'
+
+
+def test_load_import_identifiers(tmp_path, monkeypatch):
+    from cfn import imports
+
+    monkeypatch.setattr(imports, '_identifiers', None)
+    monkeypatch.setattr(imports, '_aliases', None)
+
+    table_file_path = tmp_path / 'identifiers.json'
+    table_file_path.write_text(json.dumps({'types': {'Custom::Thing': {'ThingName': 'Name'}}}))
+    imports.load_import_identifiers(str(table_file_path))
+    imports.register_import_identifiers('Custom::Other', {'OtherId': 'Id'})
+
+    descriptors = imports.describe_imports([
+        _resource('StackThing', 'Custom::Thing', {'Name': 'thing'}),
+        _resource('StackOther', 'Custom::Other', {'Id': 'other'}),
+        _resource('StackTable', 'AWS::DynamoDB::Table', {'TableName': 'orders'}),
+    ])
+
+    assert [item['LogicalResourceId'] for item in descriptors.resources_to_import] == [
+        'StackThing', 'StackOther', 'StackTable']
+
+
+def test_flatten_import_file(tmp_path):
+    template_path = os.path.abspath(os.path.join(test_fixtures, 'conditional_cf/template.yaml'))
+
+    from cfn.imports import ImportDescriptors, write_resources_to_import
+    from commands.flatten import flatten_cloudformation_template
+    template = flatten_cloudformation_template(template_path, fold_constants=True)
+    descriptors = ImportDescriptors.from_metadata(template['Metadata'])
+
+    import_file_path = str(tmp_path / 'import.json')
+    write_resources_to_import(descriptors, import_file_path)
+
+    with open(import_file_path, 'r') as f:
+        assert json.load(f) == [{
+            'ResourceType': 'AWS::Logs::LogGroup',
+            'LogicalResourceId': 'NestedLogs',
+            'ResourceIdentifier': {'LogGroupName': '/orders/prod'},
+        }]
+    assert descriptors.unresolved == ['NestedTable']
+    assert template['Metadata']['UnresolvedResourcesForImport'] == ['NestedTable']
+    assert all(value is not None
+               for item in template['Metadata']['ResourcesForImport']
+               for value in item['ResourceIdentifier'].values())
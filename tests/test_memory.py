@@ -0,0 +1,72 @@
+import os
+import tracemalloc
+
+test_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_memory_tracer():
+    from collections import OrderedDict
+    from unittest import mock
+    from commands.flatten import dump_yaml, flatten_cloudformation_template
+    from cfn import yaml_extensions
+    from cfn.memory import MemoryTracer
+
+    root = os.path.abspath(os.path.join(test_fixtures, 'complex_cf_01', 'template.yaml'))
+    macros = os.path.abspath(os.path.join(test_fixtures, 'with_macros_01', 'template.yaml'))
+
+    # memoized macro results would skip reading the include files
+    with mock.patch.object(yaml_extensions, '_macro_results', OrderedDict()), MemoryTracer(top_sites=5) as tracer:
+        dump_yaml(flatten_cloudformation_template(root))
+        flatten_cloudformation_template(macros, evaluate_macros=True)
+
+    report = tracer.report
+    assert not tracemalloc.is_tracing()
+    assert set(report.stages) == {'load', 'copy', 'sanitize', 'dump', 'include'}
+    assert set(report.templates) == {root, os.path.join(os.path.dirname(root), 'api', 'template.yaml'), macros}
+    assert set(report.includes) == {os.path.join(os.path.dirname(macros), file_name)
+                                    for file_name in ['text.txt', 'data.yaml']}
+    assert report.stages['load'].calls == 3
+    assert report.stages['load'].retained > 0
+    assert 0 < max(usage.peak for usage in report.stages.values()) <= report.peak
+    assert 0 < len(report.top_sites) <= 5
+
+
+def test_memory_tracer_async():
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from commands.flatten import flatten_cloudformation_template_async
+    from cfn.memory import MemoryTracer
+
+    root = os.path.abspath(os.path.join(test_fixtures, 'complex_cf_01', 'template.yaml'))
+
+    with ThreadPoolExecutor(max_workers=4) as executor, MemoryTracer() as tracer:
+        asyncio.run(flatten_cloudformation_template_async(root, executor=executor))
+
+    report = tracer.report
+    assert set(report.stages) == {'load', 'copy', 'sanitize'}
+    assert set(report.templates) == {root, os.path.join(os.path.dirname(root), 'api', 'template.yaml')}
+    assert report.stages['load'].calls == 2
+
+
+def test_memory_tracer_keeps_tracing():
+    from commands.flatten import flatten_cloudformation_template
+    from cfn.memory import MemoryTracer, format_memory_report
+
+    tracemalloc.start()
+    try:
+        with MemoryTracer() as tracer:
+            flatten_cloudformation_template(os.path.join(test_fixtures, 'sam_stack_cf', 'template.yaml'))
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+    assert 'sub_stack' in format_memory_report(tracer.report)
+
+
+def test_measure_without_tracer():
+    from cfn.memory import measure
+
+    with measure('load', 'template.yaml'):
+        pass
+
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+test_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _template(chains: int, length: int) -> dict:
+    from cfn.yaml_extensions import Ref, GetAtt, Sub
+
+    resources = {}
+    for chain in range(chains):
+        for i in range(length):
+            name = f'Chain{chain}Resource{i}'
+            properties = {'Name': name, 'Ports': {80: 'http'}}
+            if i > 0:
+                properties['Previous'] = Ref(f'Chain{chain}Resource{i - 1}')
+                properties['Arn'] = GetAtt(f'Chain{chain}Resource{i - 1}.Arn')
+                properties['Path'] = Sub(f'${{Chain{chain}Resource{i - 1}.Arn}}/${{AWS::Region}}')
+            resources[name] = {'Type': 'AWS::SQS::Queue', 'Properties': properties}
+            if i > 1:
+                resources[name]['DependsOn'] = [f'Chain{chain}Resource{i - 2}']
+
+    return {
+        'Parameters': {'Stage': {'Type': 'String'}},
+        'Resources': resources,
+        'Outputs': {'Last': {'Value': Ref(f'Chain0Resource{length - 1}')}},
+    }
+
+
+def _import_names(obj) -> set:
+    from cfn.traversal import functions
+    return {data for name, data in functions(obj) if name == 'Fn::ImportValue'}
+
+
+@pytest.mark.parametrize('chains, length, max_resources, expected_parts', [
+    (3, 10, 500, 1),
+    (6, 10, 20, 3),
+    (1, 45, 20, 3),
+])
+def test_partition_template(chains, length, max_resources, expected_parts):
+    from commands.partition import partition_template
+    from commands.validate import validate_template
+
+    template = _template(chains, length)
+    parts = partition_template(template, export_prefix='test', max_resources=max_resources)
+
+    assert len(parts) == expected_parts
+    assert sorted(name for part in parts for name in part['Resources']) == sorted(template['Resources'])
+
+    exported = set()
+    for part in parts:
+        assert len(part['Resources']) <= max_resources
+        assert part['Parameters'] == template['Parameters']
+        assert validate_template(part) == []
+        # a partition imports only values exported by the preceding ones
+        assert _import_names(part) <= exported
+        exported |= {output['Export']['Name'] for output in part.get('Outputs', {}).values() if 'Export' in output}
+
+    assert 'Last' in parts[-1]['Outputs']
+
+
+def test_partition_template_size():
+    from commands.partition import partition_template
+    from cfn.yaml_extensions import dump_cfn
+
+    template = _template(1, 40)
+    max_template_size = len(dump_cfn(template)) // 3
+
+    parts = partition_template(template, export_prefix='test', max_template_size=max_template_size)
+
+    assert len(parts) > 3
+    assert all(len(dump_cfn(part, aliases=False)) <= max_template_size for part in parts)
+
+
+def test_write_partitions(tmp_path):
+    from commands.partition import partition_template, write_partitions
+    from cfn.yaml_extensions import load_cfn
+
+    parts = partition_template(_template(2, 10), export_prefix='test', max_resources=10)
+    file_paths = write_partitions(parts, str(tmp_path))
+
+    assert [os.path.basename(file_path) for file_path in file_paths] == ['part-000.yaml', 'part-001.yaml']
+    assert [load_cfn(file_path) for file_path in file_paths] == parts
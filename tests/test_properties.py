@@ -0,0 +1,318 @@
+"""
+Property-based checks of the optimized code paths against the reference implementation,
+tests.reference, on randomly generated trees of nested templates.
+"""
+import copy
+import os
+import random
+import time
+import tracemalloc
+
+import pytest
+import yaml
+
+_seeds = range(12)
+
+_resource_types = ['AWS::S3::Bucket', 'AWS::SQS::Queue', 'AWS::SNS::Topic', 'AWS::DynamoDB::Table',
+                   'AWS::Lambda::Function', 'AWS::IAM::Role']
+
+_stack_types = ['AWS::CloudFormation::Stack', 'AWS::Serverless::Application']
+
+
+class _TemplateTreeGenerator(object):
+    """
+    Writes a random tree of nested templates, using intrinsic functions, conditions, mappings and
+    include macros, into a directory. Templates may be shared by several parents.
+    """
+
+    def __init__(self, seed: int, root_dir: str, max_depth=2, max_resources=6, max_nested=3):
+        self.random = random.Random(seed)
+        self.root_dir = root_dir
+        self.max_depth = max_depth
+        self.max_resources = max_resources
+        self.max_nested = max_nested
+        self._stacks = 0
+        self._shared = []
+
+    def generate(self) -> str:
+        return self._template(self.root_dir, 0)
+
+    def _template(self, dir_path: str, depth: int) -> str:
+        from cfn.yaml_extensions import dump_cfn
+
+        rnd = self.random
+        os.makedirs(dir_path, exist_ok=True)
+        with open(os.path.join(dir_path, 'text.txt'), 'w') as f:
+            f.write(f'text {rnd.random()}\n')
+        with open(os.path.join(dir_path, 'data.yaml'), 'w') as f:
+            f.write(f'key: value {rnd.randint(0, 1000)}\nitems: [1, 2, 3]\n')
+
+        template = {
+            'AWSTemplateFormatVersion': '2010-09-09',
+            'Parameters': {
+                'Stage': {'Type': 'String', 'Default': rnd.choice(['dev', 'prod'])},
+                'Name': {'Type': 'String'},
+            },
+            'Conditions': {
+                'IsProd': _fn('Equals', [_fn('Ref', 'Stage'), 'prod']),
+            },
+            'Mappings': {
+                'Sizes': {'dev': {'Size': 1}, 'prod': {'Size': 3}},
+            },
+            'Resources': {},
+        }
+
+        resources = template['Resources']
+        for i in range(rnd.randint(1, self.max_resources)):
+            resource_def = {
+                'Type': rnd.choice(_resource_types),
+                'Properties': {f'Property{j}': self._value(list(resources), 2) for j in range(rnd.randint(0, 4))},
+            }
+            if rnd.random() < 0.2:
+                resource_def['Condition'] = 'IsProd'
+            resources[f'Resource{i}'] = resource_def
+
+        if depth < self.max_depth:
+            for _ in range(rnd.randint(0, self.max_nested)):
+                if self._shared and rnd.random() < 0.3:
+                    nested_path = rnd.choice(self._shared)
+                else:
+                    nested_path = self._template(os.path.join(dir_path, f'nested{self._stacks}'), depth + 1)
+                    self._shared.append(nested_path)
+
+                self._stacks += 1
+                resources[f'Stack{self._stacks}'] = {
+                    'Type': rnd.choice(_stack_types),
+                    'Properties': {
+                        'Location': os.path.relpath(nested_path, dir_path),
+                        'Parameters': {
+                            'Stage': rnd.choice([_fn('Ref', 'Stage'), 'dev', 'prod']),
+                            'Name': self._value(list(resources), 1),
+                        },
+                    },
+                }
+                if rnd.random() < 0.3:
+                    # the default of the nested template applies
+                    del resources[f'Stack{self._stacks}']['Properties']['Parameters']['Stage']
+
+        if resources and rnd.random() < 0.5:
+            template['Outputs'] = {
+                'Output': {'Value': _fn('GetAtt', f'{rnd.choice(list(resources))}.Arn')},
+            }
+
+        template_path = os.path.join(dir_path, 'template.yaml')
+        with open(template_path, 'w') as f:
+            f.write(dump_cfn(template, aliases=False))
+        return template_path
+
+    def _value(self, resource_names: list, depth: int):
+        rnd = self.random
+        choices = ['str', 'int', 'ref', 'sub', 'include_string', 'include_json']
+        if resource_names:
+            choices += ['ref_resource', 'get_att']
+        if depth > 0:
+            choices += ['dict', 'list', 'join', 'if', 'select', 'find_in_map']
+
+        match rnd.choice(choices):
+            case 'str':
+                return rnd.choice(['a', 'value', 'long value ' * 20])
+            case 'int':
+                return rnd.randint(0, 100)
+            case 'ref':
+                return _fn('Ref', rnd.choice(['Stage', 'Name', 'AWS::Region', 'AWS::StackName']))
+            case 'ref_resource':
+                return _fn('Ref', rnd.choice(resource_names))
+            case 'get_att':
+                return _fn('GetAtt', [rnd.choice(resource_names), 'Arn'])
+            case 'sub':
+                names = ['Stage', 'Name', 'AWS::Region'] + [f'{name}.Arn' for name in resource_names]
+                return _fn('Sub', '-'.join('${' + rnd.choice(names) + '}' for _ in range(rnd.randint(1, 3))))
+            case 'include_string':
+                return _fn('IncludeString', 'text.txt')
+            case 'include_json':
+                return _fn('IncludeJsonStringFromYamlFile', 'data.yaml')
+            case 'dict':
+                return {f'Key{i}': self._value(resource_names, depth - 1) for i in range(rnd.randint(1, 3))}
+            case 'list':
+                return [self._value(resource_names, depth - 1) for _ in range(rnd.randint(1, 3))]
+            case 'join':
+                return _fn('Join', ['-', [self._value(resource_names, 0) for _ in range(rnd.randint(1, 3))]])
+            case 'if':
+                return _fn('If', ['IsProd', self._value(resource_names, depth - 1), _fn('Ref', 'AWS::NoValue')])
+            case 'select':
+                return _fn('Select', [rnd.randint(0, 1), ['a', self._value(resource_names, 0)]])
+            case 'find_in_map':
+                return _fn('FindInMap', ['Sizes', _fn('Ref', 'Stage'), 'Size'])
+
+
+def _fn(tag: str, data):
+    from cfn import yaml_extensions
+    return getattr(yaml_extensions, tag)(data)
+
+
+def _without_imports(template: dict) -> dict:
+    # the reference does not describe imports
+    template = dict(template, Metadata=dict(template['Metadata']))
+    template['Metadata'].pop('ResourcesForImport', None)
+    template['Metadata'].pop('UnresolvedResourcesForImport', None)
+    return template
+
+
+@pytest.fixture(params=_seeds)
+def template_tree(request, tmp_path):
+    return _TemplateTreeGenerator(request.param, str(tmp_path / 'root')).generate()
+
+
+@pytest.mark.parametrize('evaluate_macros', [True, False])
+def test_flatten_matches_reference(template_tree, evaluate_macros):
+    from commands.flatten import flatten_cloudformation_template
+    from tests.reference import reference_flatten
+
+    expected, _ = reference_flatten(template_tree, evaluate_macros=evaluate_macros)
+    got = flatten_cloudformation_template(template_tree, evaluate_macros=evaluate_macros)
+
+    assert list(got['Resources']) == list(expected['Resources'])
+    assert _without_imports(got) == expected
+
+
+@pytest.mark.parametrize('evaluate_macros', [True, False])
+def test_async_matches_reference(template_tree, evaluate_macros):
+    import asyncio
+    from commands.flatten import flatten_cloudformation_template_async
+    from tests.reference import reference_flatten
+
+    expected, _ = reference_flatten(template_tree, evaluate_macros=evaluate_macros)
+    got = asyncio.run(flatten_cloudformation_template_async(template_tree,
+                                                            evaluate_macros=evaluate_macros,
+                                                            max_concurrency=2))
+
+    assert _without_imports(got) == expected
+
+
+def test_scan_matches_reference(template_tree, tmp_path_factory):
+    from commands.scan import scan_templates
+    from cfn.yaml_extensions import load_cfn
+    from tests.reference import reference_flatten
+
+    expected, _ = reference_flatten(template_tree)
+
+    root = os.path.dirname(template_tree)
+    output_dir = str(tmp_path_factory.mktemp('output'))
+    results = scan_templates(root, output_dir=output_dir, max_workers=4)
+
+    assert [os.path.relpath(result.template_path, root) for result in results] == ['template.yaml']
+    assert results[0].error is None
+    assert _without_imports(load_cfn(results[0].output_path)) == expected
+
+
+def test_scan_fold_constants_matches_flatten(template_tree, tmp_path_factory):
+    from commands.flatten import flatten_cloudformation_template
+    from commands.scan import scan_templates
+    from cfn.yaml_extensions import load_cfn
+
+    # folding has no reference, the shared template cache of scan is checked against flatten
+    expected = flatten_cloudformation_template(template_tree, fold_constants=True)
+
+    root = os.path.dirname(template_tree)
+    output_dir = str(tmp_path_factory.mktemp('output'))
+    results = scan_templates(root, output_dir=output_dir, fold_constants=True, max_workers=4)
+
+    assert results[0].error is None
+    assert load_cfn(results[0].output_path) == expected
+
+
+def test_mmap_matches_reference(template_tree, monkeypatch):
+    from collections import OrderedDict
+    from commands.flatten import flatten_cloudformation_template
+    from cfn import file_io, yaml_extensions
+    from tests.reference import reference_flatten
+
+    expected, _ = reference_flatten(template_tree, evaluate_macros=True)
+
+    monkeypatch.setattr(file_io, 'MMAP_THRESHOLD', 0)
+    monkeypatch.setattr(yaml_extensions, '_macro_results', OrderedDict())
+
+    assert _without_imports(flatten_cloudformation_template(template_tree, evaluate_macros=True)) == expected
+
+
+def test_dedupe_matches_reference(template_tree):
+    from commands.flatten import flatten_cloudformation_template
+    from cfn.yaml_extensions import CfnLoader, dump_cfn
+    from tests.reference import reference_flatten
+
+    expected, _ = reference_flatten(template_tree, evaluate_macros=True)
+    shared = flatten_cloudformation_template(template_tree, evaluate_macros=True, dedupe=True)
+
+    assert _without_imports(shared) == expected
+    assert _without_imports(yaml.load(dump_cfn(shared), Loader=CfnLoader)) == expected
+
+
+def test_fold_constants_keeps_reachable_resources(template_tree):
+    from commands.flatten import flatten_cloudformation_template
+    from tests.reference import reference_flatten
+
+    expected, unreachable = reference_flatten(template_tree)
+    got = flatten_cloudformation_template(template_tree, fold_constants=True)
+
+    assert list(got['Resources']) == [name for name in expected['Resources'] if name not in unreachable]
+    assert {name: resource_def['Type'] for name, resource_def in got['Resources'].items()} == \
+           {name: expected['Resources'][name]['Type'] for name in got['Resources']}
+
+
+def test_diff_finds_mutation(template_tree):
+    from commands.diff import diff_templates, Change
+    from commands.flatten import flatten_cloudformation_template
+
+    expected = flatten_cloudformation_template(template_tree)
+    mutated = copy.deepcopy(expected)
+    resource_name = sorted(mutated['Resources'])[0]
+    mutated['Resources'][resource_name]['Properties']['Mutated'] = 'yes'
+
+    assert not diff_templates(expected, copy.deepcopy(expected))
+    assert diff_templates(expected, mutated).modified == {
+        resource_name: [Change('Properties.Mutated', new='yes')],
+    }
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('nested, resources, time_budget, memory_budget', [
+    (20, 100, 10.0, 64 * 1024 * 1024),
+])
+def test_flatten_scale(tmp_path, nested, resources, time_budget, memory_budget):
+    from commands.flatten import flatten_cloudformation_template
+
+    root = tmp_path / 'root'
+    (root / 'nested').mkdir(parents=True)
+    (root / 'nested' / 'template.yaml').write_text('\n'.join(['Parameters:\n  Name:\n    Type: String\nResources:'] + [
+        f'  Function{i}:\n'
+        f'    Type: AWS::Lambda::Function\n'
+        f'    Properties:\n'
+        f'      FunctionName: !Sub "${{Name}}-{i}"\n'
+        f'      Role: !GetAtt Role.Arn\n'
+        f'      Environment:\n'
+        f'        Variables:\n'
+        f'          TABLE: !Ref Table\n'
+        for i in range(resources)
+    ] + ['  Role:\n    Type: AWS::IAM::Role\n  Table:\n    Type: AWS::DynamoDB::Table\n']))
+    (root / 'template.yaml').write_text('\n'.join(['Resources:'] + [
+        f'  Stack{i}:\n'
+        f'    Type: AWS::CloudFormation::Stack\n'
+        f'    Properties:\n'
+        f'      Location: nested/template.yaml\n'
+        f'      Parameters:\n'
+        f'        Name: stack-{i}\n'
+        for i in range(nested)
+    ]))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        template = flatten_cloudformation_template(str(root / 'template.yaml'), fold_constants=True)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(template['Resources']) == nested * (resources + 2)
+    assert elapsed < time_budget
+    assert peak < memory_budget
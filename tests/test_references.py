@@ -0,0 +1,35 @@
+def test_resource_references():
+    from cfn.references import resource_references
+    from cfn.yaml_extensions import Ref, GetAtt, Sub
+
+    resources = {'Table', 'Role', 'Queue', 'Topic', 'Bucket', 'Key'}
+    resource_def = {
+        'Type': 'AWS::Lambda::Function',
+        'DependsOn': 'Bucket',
+        'Properties': {
+            'Role': GetAtt('Role.Arn'),
+            'Environment': {
+                'TABLE': Ref('Table'),
+                'QUEUE': {'Fn::GetAtt': ['Queue', 'Arn']},
+                'TOPIC': Sub(['${Topic}-${Local}-${!Key}-${AWS::Region}', {'Local': 'value'}]),
+                'STAGE': Ref('Stage'),
+            },
+            'Ports': {80: 'http'},
+        },
+    }
+
+    assert resource_references(resource_def, resources) == {'Bucket', 'Role', 'Table', 'Queue', 'Topic'}
+    assert resource_references({'Value': Sub('${Key.Arn}')}, resources) == {'Key'}
+
+
+def test_function_references():
+    from cfn.references import function_references, sub_placeholders
+
+    assert list(function_references('Ref', 'Table')) == [('Table', None)]
+    assert list(function_references('Ref', 'Table.Arn')) == [('Table', 'Arn')]
+    assert list(function_references('Fn::GetAtt', ['Table', 'StreamArn'])) == [('Table', 'StreamArn')]
+    assert list(function_references('Fn::Sub', ['${Stage}-${Table.Arn}-${!Literal}-${Local}', {'Local': 'x'}])) == [
+        ('Stage', None), ('Table', 'Arn'),
+    ]
+    assert list(sub_placeholders('${ AWS::Region }/${!Literal}')) == ['AWS::Region']
+    assert list(function_references('Fn::Join', ['', []])) == []
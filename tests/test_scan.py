@@ -0,0 +1,138 @@
+import os
+import pathlib
+
+import pytest
+
+test_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+_nested_template = '''
+Parameters:
+  Name:
+    Type: String
+Resources:
+  Queue:
+    Type: AWS::SQS::Queue
+    Properties:
+      QueueName: !Ref Name
+'''
+
+_root_template = '''
+Resources:
+  Bucket:
+    Type: AWS::S3::Bucket
+  Shared:
+    Type: AWS::CloudFormation::Stack
+    Properties:
+      Location: ../shared/template.yaml
+      Parameters:
+        Name: {name}
+'''
+
+
+@pytest.fixture
+def monorepo(tmp_path):
+    (tmp_path / 'shared').mkdir()
+    (tmp_path / 'shared' / 'template.yaml').write_text(_nested_template)
+    for name in ['orders', 'invoices', 'payments']:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'template.yaml').write_text(_root_template.format(name=name))
+    (tmp_path / 'standalone').mkdir()
+    (tmp_path / 'standalone' / 'template.yaml').write_text('Resources:\n  Topic:\n    Type: AWS::SNS::Topic\n')
+    return tmp_path
+
+
+def test_scan_templates(monorepo, tmp_path_factory):
+    from commands.scan import scan_templates, TemplateCache
+    from cfn.yaml_extensions import load_cfn
+
+    output_dir = tmp_path_factory.mktemp('output')
+    cache = TemplateCache()
+    results = scan_templates(str(monorepo), output_dir=str(output_dir), fold_constants=True, cache=cache)
+
+    assert [(os.path.relpath(result.template_path, monorepo), result.resources, result.error)
+            for result in results] == [
+        (os.path.join('invoices', 'template.yaml'), 2, None),
+        (os.path.join('orders', 'template.yaml'), 2, None),
+        (os.path.join('payments', 'template.yaml'), 2, None),
+        (os.path.join('standalone', 'template.yaml'), 1, None),
+    ]
+    # the shared nested template is parsed once
+    assert cache.parsed == 5
+
+    flattened = load_cfn(os.path.join(str(output_dir), 'orders', 'template.yaml'))
+    assert flattened['Resources']['SharedQueue']['Properties'] == {'QueueName': 'orders'}
+
+
+def test_build_template_graph(monorepo):
+    from commands.scan import build_template_graph, discover_templates, TemplateCache
+
+    (monorepo / 'remote').mkdir()
+    (monorepo / 'remote' / 'template.yaml').write_text(
+        'Resources:\n'
+        '  Remote:\n'
+        '    Type: AWS::CloudFormation::Stack\n'
+        '    Properties:\n'
+        '      TemplateURL: https://example.com/template.yaml\n')
+
+    cache = TemplateCache()
+    graph = build_template_graph(discover_templates(str(monorepo)), cache)
+
+    shared = str(monorepo / 'shared' / 'template.yaml')
+    assert graph[str(monorepo / 'orders' / 'template.yaml')] == [shared]
+    assert graph[shared] == []
+    assert graph[str(monorepo / 'remote' / 'template.yaml')] == []
+    # only the template with a stack not given by Location is parsed
+    assert cache.parsed == 1
+
+
+def test_scan_templates_bounded_cache(monorepo):
+    from commands.scan import scan_templates, TemplateCache
+
+    cache = TemplateCache(max_size=1)
+    results = scan_templates(str(monorepo), cache=cache, max_workers=2)
+
+    assert [result.error for result in results] == [None] * 4
+    assert len(cache._entries) == 1
+
+
+def test_scan_templates_parse_processes(monorepo, tmp_path_factory):
+    from commands.scan import scan_templates
+
+    def outputs(results):
+        return [(result.resources, result.issues, result.error, pathlib.Path(result.output_path).read_text())
+                for result in results]
+
+    expected = scan_templates(str(monorepo), output_dir=str(tmp_path_factory.mktemp('output')), validate=True)
+    got = scan_templates(str(monorepo), output_dir=str(tmp_path_factory.mktemp('output')), validate=True,
+                         parse_processes=2)
+
+    assert outputs(got) == outputs(expected)
+
+
+def test_scan_templates_errors(monorepo):
+    from commands.scan import scan_templates
+
+    (monorepo / 'broken').mkdir()
+    (monorepo / 'broken' / 'template.yaml').write_text(_root_template.replace('../shared', '../missing'))
+    (monorepo / 'cycle').mkdir()
+    (monorepo / 'cycle' / 'template.yaml').write_text(_root_template.replace('../shared', '../cycle'))
+
+    errors = {os.path.basename(os.path.dirname(result.template_path)): result.error
+              for result in scan_templates(str(monorepo)) if result.error}
+
+    assert sorted(errors) == ['broken', 'cycle']
+
+
+@pytest.mark.parametrize('template_file_path', [
+    'sam_stack_cf/template.yaml',
+    'complex_cf_01/template.yaml',
+])
+def test_scan_fixture(template_file_path):
+    from commands.flatten import flatten_cloudformation_template
+    from commands.scan import scan_templates
+
+    template_path = os.path.abspath(os.path.join(test_fixtures, template_file_path))
+    results = scan_templates(os.path.dirname(template_path))
+
+    assert [result.template_path for result in results] == [template_path]
+    assert results[0].resources == len(flatten_cloudformation_template(template_path)['Resources'])
@@ -0,0 +1,180 @@
+import sys
+import time
+
+import pytest
+import yaml
+
+
+def _deep_tree(depth: int):
+    from cfn import yaml_extensions
+
+    # alternating maps and lists, like the states of a Step Functions definition
+    root = node = {}
+    for i in range(depth):
+        node['Next'] = [{'Resource': yaml_extensions.Ref('Table')}]
+        node = node['Next'][0]
+    node['Leaf'] = yaml_extensions.Sub('${Table.Arn}')
+    return root
+
+
+def test_walk():
+    from cfn import yaml_extensions
+    from cfn.traversal import path_keys, walk
+
+    tree = {'A': [1, {'B': yaml_extensions.GetAtt(['Table', 'Arn'])}], 'C': 'd'}
+
+    assert [(node if not isinstance(node, (dict, list)) else type(node).__name__, path_keys(path))
+            for node, path in walk(tree, ('Resources',))] == [
+        ('dict', ['Resources']),
+        ('list', ['Resources', 'A']),
+        (1, ['Resources', 'A', 0]),
+        ('dict', ['Resources', 'A', 1]),
+        (yaml_extensions.GetAtt(['Table', 'Arn']), ['Resources', 'A', 1, 'B']),
+        ('list', ['Resources', 'A', 1, 'B', 'Fn::GetAtt']),
+        ('Table', ['Resources', 'A', 1, 'B', 'Fn::GetAtt', 0]),
+        ('Arn', ['Resources', 'A', 1, 'B', 'Fn::GetAtt', 1]),
+        ('d', ['Resources', 'C']),
+    ]
+
+
+def test_iter_nodes_visits_replaced_data():
+    from cfn import yaml_extensions
+    from cfn.traversal import iter_nodes
+
+    tree = [yaml_extensions.Sub('x')]
+
+    visited = []
+    for node in iter_nodes(tree):
+        if isinstance(node, yaml_extensions.CloudFormationObject):
+            node.data = ['${X}', {'X': 'y'}]
+        visited.append(node)
+
+    assert visited[-1] == 'y'
+
+
+def test_rebuild():
+    from cfn import yaml_extensions
+    from cfn.traversal import DESCEND, rebuild
+
+    tree = {'A': [1, {'B': yaml_extensions.Ref('Table')}], 'C': (2, 3)}
+
+    copy = rebuild(tree)
+    assert copy == tree
+    assert copy['A'][1]['B'] is not tree['A'][1]['B']
+
+    def enter(node):
+        return str(node) if isinstance(node, int) else DESCEND
+
+    def leave(node, copy):
+        return copy.data if isinstance(copy, yaml_extensions.CloudFormationObject) else copy
+
+    assert rebuild(tree, enter=enter, leave=leave) == {'A': ['1', {'B': 'Table'}], 'C': ('2', '3')}
+
+
+def test_to_json():
+    from cfn import yaml_extensions
+
+    expr = yaml_extensions.If(['IsProd', {'Name': yaml_extensions.Ref('Table.Arn')}, yaml_extensions.Ref('AWS::NoValue')])
+
+    assert expr.to_json() == {'Fn::If': ['IsProd', {'Name': {'Fn::GetAtt': ['Table', 'Arn']}}, {'Ref': 'AWS::NoValue'}]}
+
+
+def test_deep_templates():
+    from commands.diff import diff_templates
+    from commands.flatten import _sanitize_resource
+    from commands.validate import validate_template
+    from cfn.dedupe import share_subtrees
+    from cfn.evaluate import Evaluator
+    from cfn import yaml_extensions
+    from cfn.traversal import functions, iter_nodes
+    from cfn.yaml_extensions import Sub
+
+    depth = 2 * sys.getrecursionlimit()
+    resource_def = {'Type': 'AWS::StepFunctions::StateMachine', 'Properties': _deep_tree(depth)}
+
+    _, sanitized, _, _ = _sanitize_resource('Machine', resource_def, {'naming_prefix': 'Nested'})
+    assert [node for node in iter_nodes(sanitized) if isinstance(node, Sub)] == [Sub('${NestedTable.Arn}')]
+
+    template = {'Resources': {'Machine': sanitized, 'NestedTable': {'Type': 'AWS::DynamoDB::Table'}}}
+    assert validate_template(template) == []
+    # == of deep trees hits the recursion limit, diff_templates does not
+    assert not diff_templates(template, share_subtrees(template))
+    assert not diff_templates(template, Evaluator({}).evaluate(template))
+
+    as_json = yaml_extensions.If(['C', template, {}]).to_json()
+    assert sorted({name for name, _ in functions(as_json)}) == ['Fn::If', 'Fn::Sub', 'Ref']
+    assert not any(isinstance(node, yaml_extensions.CloudFormationObject) for node in iter_nodes(as_json))
+
+
+def test_deep_nested_stacks(tmp_path):
+    from commands.flatten import flatten_cloudformation_template
+
+    depth = sys.getrecursionlimit() + 10
+    for i in range(depth):
+        (tmp_path / f'stack{i}.yaml').write_text(
+            f'Resources:\n'
+            f'  Queue{i}:\n'
+            f'    Type: AWS::SQS::Queue\n'
+            f'  Next{i}:\n'
+            f'    Type: AWS::CloudFormation::Stack\n'
+            f'    Properties:\n'
+            f'      Location: stack{i + 1}.yaml\n'
+        )
+    (tmp_path / f'stack{depth}.yaml').write_text('Resources:\n  Queue:\n    Type: AWS::SQS::Queue\n')
+
+    template = flatten_cloudformation_template(str(tmp_path / 'stack0.yaml'))
+
+    assert len(template['Resources']) == depth + 1
+
+
+def test_nested_stack_cycle(tmp_path):
+    from commands.flatten import flatten_cloudformation_template
+
+    (tmp_path / 'template.yaml').write_text(
+        'Resources:\n  Self:\n    Type: AWS::CloudFormation::Stack\n    Properties:\n      Location: template.yaml\n'
+    )
+
+    with pytest.raises(ValueError, match='form a cycle'):
+        flatten_cloudformation_template(str(tmp_path / 'template.yaml'))
+
+
+@pytest.mark.benchmark
+def test_iter_nodes_throughput():
+    from cfn import yaml_extensions
+    from cfn.traversal import iter_nodes
+    from cfn.yaml_extensions import CloudFormationObject
+
+    tree = yaml.load('\n'.join(['Resources:'] + [
+        f'  Function{i}:\n'
+        f'    Type: AWS::Lambda::Function\n'
+        f'    Properties:\n'
+        f'      FunctionName: !Sub "${{AWS::StackName}}-{i}"\n'
+        f'      Environment:\n'
+        f'        Variables:\n'
+        f'          TABLE: !Ref Table\n'
+        f'          INDEXES: [1, 2, 3]\n'
+        for i in range(2000)
+    ]), Loader=yaml_extensions.CfnLoader)
+
+    def recursive(obj) -> int:
+        # the shape of the walkers replaced by iter_nodes
+        count = 1
+        if isinstance(obj, dict):
+            for value in obj.values():
+                count += recursive(value)
+        elif isinstance(obj, list):
+            for member in obj:
+                count += recursive(member)
+        elif isinstance(obj, CloudFormationObject):
+            count += recursive(obj.data)
+        return count
+
+    def throughput(count_nodes) -> float:
+        start = time.perf_counter()
+        nodes = count_nodes()
+        return nodes / (time.perf_counter() - start)
+
+    iterative = max(throughput(lambda: sum(1 for _ in iter_nodes(tree))) for _ in range(3))
+    reference = max(throughput(lambda: recursive(tree)) for _ in range(3))
+
+    assert iterative > reference / 4
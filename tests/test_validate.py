@@ -0,0 +1,89 @@
+import os
+import time
+
+import pytest
+
+test_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _issues(template):
+    from commands.validate import validate_template
+    return sorted((issue.path, issue.function, issue.target) for issue in validate_template(template))
+
+
+def test_validate_template():
+    from cfn.yaml_extensions import Ref, GetAtt, Sub, If
+
+    template = {
+        'Parameters': {'Stage': {'Type': 'String'}, 'Table': {'Type': 'String'}},
+        'Conditions': {'IsProd': {'Fn::Equals': [{'Ref': 'Stage'}, 'prod']}},
+        'Resources': {
+            'Table': {'Type': 'AWS::DynamoDB::Table'},
+            'Balancer': {'Type': 'AWS::ElasticLoadBalancing::LoadBalancer', 'Properties': {'Ports': {80: 'http'}}},
+            'Function': {
+                'Type': 'AWS::Lambda::Function',
+                'Condition': 'IsDev',
+                'DependsOn': ['Table', 'Queue'],
+                'Properties': {
+                    'Role': GetAtt('PrefixNone.Arn'),
+                    'Environment': [
+                        Ref('Stage'),
+                        Ref('AWS::Region'),
+                        Ref('Missing'),
+                        Sub('${Table.Arn}/${AWS::Region}/${!Literal}/${Bucket}'),
+                        Sub(['${Local}-${Other}', {'Local': Ref('Stage')}]),
+                        If(['IsProd', 'a', {'Fn::GetAtt': ['Gone', 'Arn']}]),
+                    ],
+                },
+            },
+        },
+    }
+
+    assert _issues(template) == [
+        ('Resources.Function.Condition', 'Condition', 'IsDev'),
+        ('Resources.Function.DependsOn', 'DependsOn', 'Queue'),
+        ('Resources.Function.Properties.Environment.2', 'Ref', 'Missing'),
+        ('Resources.Function.Properties.Environment.3', 'Fn::Sub', 'Bucket'),
+        ('Resources.Function.Properties.Environment.4', 'Fn::Sub', 'Other'),
+        ('Resources.Function.Properties.Environment.5.Fn::If.2', 'Fn::GetAtt', 'Gone'),
+        ('Resources.Function.Properties.Role', 'Fn::GetAtt', 'PrefixNone'),
+        ('Resources.Table', 'Ref', 'Table'),
+    ]
+
+
+@pytest.mark.parametrize('template_file_path', [
+    'simple_cf/template.yaml',
+    'sam_stack_cf/template.yaml',
+    'complex_cf_01/template.yaml',
+])
+def test_validate_fixture(template_file_path):
+    from cfn.yaml_extensions import load_cfn
+
+    template_path = os.path.abspath(os.path.join(test_fixtures, template_file_path))
+    assert _issues(load_cfn(template_path)) == []
+
+
+def test_validate_template_scale():
+    from cfn.yaml_extensions import Ref, GetAtt, Sub
+
+    resources = {
+        f'Resource{i}': {
+            'Type': 'AWS::SQS::Queue',
+            'DependsOn': f'Resource{i - 1}' if i else [],
+            'Properties': {
+                'A': Ref(f'Resource{i + 1}'),
+                'B': GetAtt(f'Resource{i - 1}.Arn'),
+                'C': Sub(f'${{Resource{i}.Arn}}-${{AWS::Region}}'),
+            },
+        } for i in range(20000)
+    }
+
+    started = time.perf_counter()
+    issues = _issues({'Resources': resources})
+    elapsed = time.perf_counter() - started
+
+    assert issues == [
+        ('Resources.Resource0.Properties.B', 'Fn::GetAtt', 'Resource-1'),
+        ('Resources.Resource19999.Properties.A', 'Ref', 'Resource20000'),
+    ]
+    assert elapsed < 5
@@ -45,3 +45,148 @@ def test_load_cfn(template_file_path, evaluate_macros, expected):
 
     if expected is not None:
         assert got == expected
+
+
+def test_load_cfn_async():
+    import asyncio
+
+    template_file_path = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), 'fixtures', 'with_macros_01', 'template.yaml'))
+
+    from cfn.yaml_extensions import load_cfn, load_cfn_async
+    got = asyncio.run(load_cfn_async(template_file_path, evaluate_macros=True))
+
+    assert got == load_cfn(template_file_path, evaluate_macros=True)
+
+
+def test_load_cfn_async_process_executor():
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+
+    template_file_path = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), 'fixtures', 'with_macros_01', 'template.yaml'))
+
+    from cfn.yaml_extensions import load_cfn, load_cfn_async
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        got = asyncio.run(load_cfn_async(template_file_path, evaluate_macros=True, executor=executor))
+
+        with open(template_file_path, 'r') as f, pytest.raises(TypeError):
+            asyncio.run(load_cfn_async(f, executor=executor))
+
+    assert got == load_cfn(template_file_path, evaluate_macros=True)
+
+
+@pytest.fixture
+def macro_registry(monkeypatch):
+    """
+    Restore the registered macros and the loaders and dumpers they are registered with.
+    """
+    from collections import OrderedDict
+    from cfn import yaml_extensions
+
+    monkeypatch.setattr(yaml_extensions, '_macro_registry', dict(yaml_extensions._macro_registry))
+    monkeypatch.setattr(yaml_extensions, '_object_classes', list(yaml_extensions._object_classes))
+    monkeypatch.setattr(yaml_extensions, '_macro_results', OrderedDict())
+    for loader in [yaml_extensions.CfnLoader, yaml_extensions.CfnMacroLoader]:
+        monkeypatch.setattr(loader, 'yaml_constructors', dict(loader.yaml_constructors))
+    for dumper in [yaml_extensions.CfnDumper, yaml_extensions.CfnAliasDumper]:
+        monkeypatch.setattr(dumper, 'yaml_representers', dict(dumper.yaml_representers))
+
+    module_names = set(vars(yaml_extensions))
+    yield
+    # classes of the registered macros
+    for name in set(vars(yaml_extensions)) - module_names:
+        delattr(yaml_extensions, name)
+
+
+def test_register_macro(tmp_path, macro_registry):
+    from cfn.yaml_extensions import MacroDefinition, CloudFormationObject, register_macro, load_cfn
+
+    calls = []
+
+    def upper_constructor(loader_context, node):
+        calls.append(node.value)
+        return loader_context.construct_scalar(node).upper()
+
+    register_macro(MacroDefinition('Macro::TestUpper', 'TestUpper', CloudFormationObject.SCALAR,
+                                   upper_constructor, pure=True, deterministic=True))
+
+    template_file_path = tmp_path / 'template.yaml'
+    template_file_path.write_text('A: !TestUpper abc\nB: !TestUpper abc\nC: !TestUpper def\n')
+
+    assert load_cfn(str(template_file_path), evaluate_macros=True) == {'A': 'ABC', 'B': 'ABC', 'C': 'DEF'}
+    assert load_cfn(str(template_file_path), evaluate_macros=True) == {'A': 'ABC', 'B': 'ABC', 'C': 'DEF'}
+    assert calls == ['abc', 'def']
+
+
+def test_macro_plugins(monkeypatch, macro_registry):
+    from cfn import yaml_extensions
+    from cfn.yaml_extensions import MacroDefinition, CloudFormationObject
+
+    class EntryPoint(object):
+        def load(self):
+            def register(register_macro):
+                register_macro(MacroDefinition('Macro::TestPlugin', 'TestPlugin', CloudFormationObject.SCALAR,
+                                               lambda loader_context, node: 'plugin'))
+
+            return register
+
+    monkeypatch.setattr(yaml_extensions, '_macro_plugins_loaded', False)
+    monkeypatch.setattr(yaml_extensions, 'entry_points', lambda group: [EntryPoint()])
+
+    assert 'Macro::TestPlugin' in [macro.name for macro in yaml_extensions.registered_macros()]
+    assert not yaml_extensions.macros_deterministic()
+
+
+def test_generate_uuid_seeded(tmp_path):
+    import uuid
+    from cfn.macros import set_uuid_seed
+    from cfn.yaml_extensions import load_cfn, macros_deterministic
+
+    template_file_path = tmp_path / 'template.yaml'
+    template_file_path.write_text('A: !GenerateUUID\nB: !GenerateUUID\n')
+
+    try:
+        assert not macros_deterministic()
+
+        set_uuid_seed('build-1')
+        assert macros_deterministic()
+        first = load_cfn(str(template_file_path), evaluate_macros=True)
+        assert first == load_cfn(str(template_file_path), evaluate_macros=True)
+        assert first['A'] != first['B']
+        uuid.UUID(first['A'])
+
+        set_uuid_seed('build-2')
+        assert load_cfn(str(template_file_path), evaluate_macros=True) != first
+    finally:
+        set_uuid_seed(None)
+
+    random = load_cfn(str(template_file_path), evaluate_macros=True)
+    assert random != load_cfn(str(template_file_path), evaluate_macros=True)
+
+
+def test_generate_uuid_seeded_working_directory(tmp_path, monkeypatch):
+    from cfn.macros import set_uuid_seed
+    from commands.flatten import flatten_cloudformation_template
+
+    (tmp_path / 'project').mkdir()
+    (tmp_path / 'project' / 'template.yaml').write_text(
+        'Resources:\n'
+        '  Queue:\n'
+        '    Type: AWS::SQS::Queue\n'
+        '    Properties:\n'
+        '      QueueName: !GenerateUUID\n')
+
+    def queue_name(working_dir, template_file_path):
+        monkeypatch.chdir(working_dir)
+        template = flatten_cloudformation_template(template_file_path, evaluate_macros=True)
+        return template['Resources']['Queue']['Properties']['QueueName']
+
+    try:
+        set_uuid_seed('build-1')
+        expected = queue_name(tmp_path, str(tmp_path / 'project' / 'template.yaml'))
+        assert queue_name(tmp_path, os.path.join('project', 'template.yaml')) == expected
+        assert queue_name(tmp_path / 'project', 'template.yaml') == expected
+        assert queue_name(tmp_path / 'project', str(tmp_path / 'project' / 'template.yaml')) == expected
+    finally:
+        set_uuid_seed(None)